@@ -0,0 +1,36 @@
+"""
+Runs the benchmarks and writes the results as JSON, e.g.
+
+    python -m benchmarks --output after.json --compare before.json
+"""
+
+import argparse
+
+from benchmarks import harness
+from benchmarks import file_benchmarks, scheduler_benchmarks, stream_benchmarks  # noqa
+from benchmarks import task_benchmarks  # noqa
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("-c", "--compare", help="JSON results to compare against")
+    parser.add_argument("-k", "--filter", default="", help="only run matching names")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "-q", "--quick", action="store_true", help="only the smallest params"
+    )
+    args = parser.parse_args(argv)
+
+    selected = [bench for bench in harness.BENCHMARKS if args.filter in bench.name]
+    results = harness.run(selected, repeat=args.repeat, quick=args.quick)
+
+    if args.output:
+        harness.dump(results, args.output)
+    if args.compare:
+        print()
+        harness.compare(results, harness.load(args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+
+from benchmarks.harness import benchmark
+from stream_processor.files import FileSink, read_jsonl, read_lines
+from stream_processor.stream import Stream
+
+SIZES = [10000, 100000, 1000000]
+
+_files = {}
+
+
+def _jsonl_file(size: int) -> str:
+    # Written once per size and reused across the runs
+    if size not in _files:
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w") as f:
+            for i in range(size):
+                f.write(json.dumps({"id": i, "name": f"item-{i}"}) + "\n")
+        _files[size] = path
+    return _files[size]
+
+
+@benchmark("files.read_lines", size=SIZES)
+def files_read_lines(size):
+    path = _jsonl_file(size)
+    return lambda: read_lines(path).list(), size
+
+
+@benchmark("files.read_lines.naive", size=SIZES)
+def files_read_lines_naive(size):
+    path = _jsonl_file(size)
+
+    def run():
+        with open(path) as f:
+            return Stream(line.rstrip("\n") for line in f).list()
+
+    return run, size
+
+
+@benchmark("files.read_jsonl", size=SIZES)
+def files_read_jsonl(size):
+    path = _jsonl_file(size)
+    return lambda: read_jsonl(path).list(), size
+
+
+@benchmark("files.sink", size=SIZES, background=[False, True])
+def files_sink(size, background):
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+
+    def run():
+        sink = FileSink(path, format="jsonl", background=background)
+        Stream(range(size)).map(_record).sink(sink)
+
+    return run, size, lambda: os.remove(path)
+
+
+def _record(i):
+    return {"id": i}
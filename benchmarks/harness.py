@@ -0,0 +1,134 @@
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Any
+
+BENCHMARKS: List["Benchmark"] = []
+
+
+class Benchmark:
+    """
+    A workload run for every combination of its params. `setup(**params)`
+    returns the function to time and the number of items it processes, and
+    optionally a function releasing what it set up, called after each repeat.
+    """
+
+    def __init__(self, name: str, setup: Callable, params: Dict[str, List[Any]]):
+        self.name = name
+        self.setup = setup
+        self.params = params
+
+    def cases(self):
+        keys = list(self.params)
+        for values in itertools.product(*(self.params[key] for key in keys)):
+            yield dict(zip(keys, values))
+
+
+def benchmark(name: str, **params: List[Any]) -> Callable:
+    def register(setup: Callable) -> Callable:
+        BENCHMARKS.append(Benchmark(name, setup, params))
+        return setup
+
+    return register
+
+
+def measure(bench: Benchmark, params: Dict[str, Any], repeat: int) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        func, items, *teardown = bench.setup(**params)
+        try:
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        finally:
+            for release in teardown:
+                release()
+
+    best = min(timings)
+    return {
+        "name": bench.name,
+        "params": params,
+        "items": items,
+        "repeat": repeat,
+        "min": best,
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "items_per_second": items / best if best else None,
+        "seconds_per_item": best / items if items else None,
+    }
+
+
+def run(selected: List[Benchmark], repeat: int, quick: bool, report=print) -> Dict:
+    results = []
+    for bench in selected:
+        for params in bench.cases():
+            if quick and not _is_quick(bench, params):
+                continue
+            result = measure(bench, params, repeat)
+            report(_format(result))
+            results.append(result)
+    return {"meta": _meta(), "results": results}
+
+
+def compare(current: Dict, baseline: Dict, report=print) -> None:
+    baseline_results = {_key(result): result for result in baseline["results"]}
+    for result in current["results"]:
+        previous = baseline_results.get(_key(result))
+        if previous is None:
+            continue
+        ratio = result["min"] / previous["min"] if previous["min"] else float("nan")
+        report(f"{_label(result):<70} {ratio:6.2f}x")
+
+
+def dump(results: Dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _is_quick(bench: Benchmark, params: Dict[str, Any]) -> bool:
+    # Quick runs only use the smallest value of every param
+    return all(value == min(bench.params[key]) for key, value in params.items())
+
+
+def _key(result: Dict) -> str:
+    return json.dumps([result["name"], result["params"]], sort_keys=True)
+
+
+def _label(result: Dict) -> str:
+    params = ",".join(f"{key}={value}" for key, value in result["params"].items())
+    return f"{result['name']}[{params}]"
+
+
+def _format(result: Dict) -> str:
+    return (
+        f"{_label(result):<70} {result['min'] * 1000:10.3f} ms "
+        f"{result['seconds_per_item'] * 1e6:10.3f} us/item"
+    )
+
+
+def _meta() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
@@ -0,0 +1,104 @@
+import time
+
+from benchmarks.harness import benchmark
+from stream_processor.events import BatchHandler, EventBus
+from stream_processor.limits import AdaptiveConcurrency
+from stream_processor.schedulers import (
+    SerialScheduler,
+    ThreadPoolScheduler,
+    WorkStealingScheduler,
+)
+from stream_processor.tasks import Task
+
+SIZES = [100, 1000]
+WORKERS = [1, 2, 4, 8]
+
+
+def cpu_bound(x):
+    return sum(range(1000))
+
+
+def sleep_bound(x):
+    time.sleep(0.001)
+    return x
+
+
+def uneven_bound(x):
+    # every 16th task takes 16 times as long as the rest
+    time.sleep(0.016 if x % 16 == 0 else 0.001)
+    return x
+
+
+WORKLOADS = {"cpu": cpu_bound, "sleep": sleep_bound, "uneven": uneven_bound}
+
+
+@benchmark("scheduler.serial", workload=list(WORKLOADS), size=SIZES)
+def serial(workload, size):
+    scheduler = SerialScheduler()
+    func = WORKLOADS[workload]
+    return lambda: list(scheduler.map(func, range(size))), size, scheduler.close
+
+
+@benchmark(
+    "scheduler.thread_pool", workload=list(WORKLOADS), size=SIZES, workers=WORKERS
+)
+def thread_pool(workload, size, workers):
+    scheduler = ThreadPoolScheduler(max_workers=workers)
+    func = WORKLOADS[workload]
+    return lambda: list(scheduler.map(func, range(size))), size, scheduler.close
+
+
+@benchmark(
+    "scheduler.work_stealing", workload=list(WORKLOADS), size=SIZES, workers=WORKERS
+)
+def work_stealing(workload, size, workers):
+    scheduler = WorkStealingScheduler(max_workers=workers)
+    func = WORKLOADS[workload]
+    return lambda: list(scheduler.map(func, range(size))), size, scheduler.close
+
+
+@benchmark("scheduler.adaptive", workload=list(WORKLOADS), size=SIZES)
+def adaptive(workload, size):
+    scheduler = ThreadPoolScheduler(concurrency=AdaptiveConcurrency(max_limit=16))
+    func = WORKLOADS[workload]
+    return lambda: list(scheduler.map(func, range(size))), size, scheduler.close
+
+
+@benchmark("scheduler.add_task_and_results", size=SIZES)
+def add_task_and_results(size):
+    scheduler = SerialScheduler()
+    func = WORKLOADS["cpu"]
+
+    def run():
+        for item in range(size):
+            scheduler.add_task(func, item)
+        list(scheduler.results())
+
+    return run, size, scheduler.close
+
+
+def write_results(*args):
+    # a round trip to a database, whether writing one result or many
+    time.sleep(0.0005)
+
+
+@benchmark("scheduler.handlers", dispatch=["sync", "bus", "bus_batched"], size=SIZES)
+def handlers(dispatch, size):
+    bus = None if dispatch == "sync" else EventBus()
+    handler = (
+        BatchHandler(write_results) if dispatch == "bus_batched" else write_results
+    )
+    task = Task(cpu_bound, on_completion_success_handlers=[handler], event_bus=bus)
+    scheduler = ThreadPoolScheduler(max_workers=4)
+
+    def run():
+        list(scheduler.map(task, range(size)))
+        if bus is not None:
+            bus.flush()
+
+    def close():
+        scheduler.close()
+        if bus is not None:
+            bus.close()
+
+    return run, size, close
@@ -0,0 +1,115 @@
+import sys
+
+from benchmarks.harness import benchmark
+from stream_processor.stream import Stream
+
+SIZES = [1000, 10000, 100000]
+
+
+def double(x):
+    return x * 2
+
+
+def is_even(x):
+    return x % 2 == 0
+
+
+@benchmark("stream.map", size=SIZES)
+def stream_map(size):
+    return lambda: Stream(range(size)).map(double).list(), size
+
+
+@benchmark("stream.filter", size=SIZES)
+def stream_filter(size):
+    return lambda: Stream(range(size)).filter(is_even).list(), size
+
+
+@benchmark("stream.batch", size=SIZES, batch_size=[10, 100])
+def stream_batch(size, batch_size):
+    return lambda: Stream(range(size)).batch(batch_size).list(), size
+
+
+@benchmark("stream.batch.concat", size=SIZES, batch_size=[10, 100])
+def stream_batch_concat(size, batch_size):
+    return lambda: Stream(range(size)).batch(batch_size).concat().list(), size
+
+
+@benchmark("stream.take", size=SIZES)
+def stream_take(size):
+    return lambda: Stream(range(size * 2)).take(size).list(), size
+
+
+@benchmark("stream.chain", size=SIZES)
+def stream_chain(size):
+    def run():
+        return (
+            Stream(range(size))
+            .map(double)
+            .filter(is_even)
+            .map(double)
+            .batch(100)
+            .concat()
+            .take(size)
+            .list()
+        )
+
+    return run, size
+
+
+@benchmark("stream.fused", size=SIZES, stages=[1, 10])
+def stream_fused(size, stages):
+    def run():
+        stream = Stream(range(size))
+        for _ in range(stages):
+            stream = stream.map(double).filter(is_even)
+        return stream.list()
+
+    return run, size
+
+
+def cpu_bound(x):
+    return sum(range(200)) + x
+
+
+if sys.version_info >= (3, 8):
+
+    @benchmark("stream.parallelize", size=[10000, 100000], processes=[1, 4])
+    def stream_parallelize(size, processes):
+        def run():
+            return Stream(range(size)).parallelize(processes).map(cpu_bound).list()
+
+        return run, size
+
+
+@benchmark("stream.profile", size=SIZES, sample_rate=[1.0, 0.01])
+def stream_profile(size, sample_rate):
+    def run():
+        return (
+            Stream(range(size))
+            .map(double)
+            .filter(is_even)
+            .batch(100)
+            .concat()
+            .take(size)
+            .profile(sample_rate)
+            .list()
+        )
+
+    return run, size
+
+
+@benchmark("stream.broadcast", size=SIZES, branches=[2, 4])
+def stream_broadcast(size, branches):
+    def run():
+        return Stream(range(size)).broadcast(*[sum] * branches)
+
+    return run, size
+
+
+@benchmark("stream.merge", size=SIZES, streams=[2, 4])
+def stream_merge(size, streams):
+    def run():
+        first, *others = [range(size // streams)] * streams
+        return Stream(first).merge(*others).list()
+
+    return run, size
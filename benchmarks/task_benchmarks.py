@@ -0,0 +1,70 @@
+from benchmarks.harness import benchmark
+from stream_processor import metrics
+from stream_processor.tasks import Task
+
+SIZES = [10000, 100000]
+
+
+def double(x):
+    return x * 2
+
+
+def double_with_context(x, context=None):
+    return x * 2
+
+
+def on_success(result):
+    pass
+
+
+def on_success_with_context(result, context=None):
+    pass
+
+
+@benchmark("task.baseline_call", size=SIZES)
+def baseline_call(size):
+    def run():
+        for item in range(size):
+            double(item)
+
+    return run, size
+
+
+@benchmark("task.spawn_and_call", size=SIZES, handlers=[0, 1, 4])
+def spawn_and_call(size, handlers):
+    template = Task(
+        double_with_context,
+        on_completion_success_handlers=[on_success, on_success_with_context]
+        * (handlers // 2)
+        + [on_success] * (handlers % 2),
+    )
+
+    def run():
+        for item in range(size):
+            template.spawn()(item)
+
+    return run, size
+
+
+@benchmark("task.create_and_call", size=SIZES)
+def create_and_call(size):
+    def run():
+        for item in range(size):
+            Task(double)(item)
+
+    return run, size
+
+
+@benchmark("task.spawn_and_call_with_metrics", size=SIZES)
+def spawn_and_call_with_metrics(size):
+    template = Task(double)
+
+    def run():
+        metrics.enable(metrics.InMemoryMetrics())
+        try:
+            for item in range(size):
+                template.spawn()(item)
+        finally:
+            metrics.disable()
+
+    return run, size
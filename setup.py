@@ -15,6 +15,14 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     extras_require={
-        "test": ["pytest", "pytest-runner", "pytest-cov", "pytest-pep8", "hypothesis"]
+        "test": [
+            "pytest",
+            "pytest-runner",
+            "pytest-cov",
+            "pytest-pep8",
+            "hypothesis",
+            "numpy",
+        ],
+        "numpy": ["numpy"],
     },
 )
@@ -0,0 +1,131 @@
+import asyncio
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, OrderedDict, Tuple
+
+DEFAULT_MAX_SIZE = 1024
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        # calls which waited for an in-flight call with the same key
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"CacheStats(hits={self.hits}, misses={self.misses}, "
+            f"coalesced={self.coalesced}, evictions={self.evictions}, "
+            f"expirations={self.expirations})"
+        )
+
+
+class CachedFunction:
+    """
+    Memoizes `func` by `key(*args, **kwargs)`, the single argument by default.
+    Up to `max_size` results are kept, least recently used first out, each for
+    at most `ttl` seconds. Concurrent calls for a key being computed wait for
+    that call instead of calling `func` again. Failures are not cached.
+
+    The cache is shared by every task the function is spawned into; in a
+    ProcessPoolScheduler worker a chunk of tasks starts with an empty cache.
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        key: Callable[..., Hashable] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: float = None,
+    ) -> None:
+        if asyncio.iscoroutinefunction(func):
+            raise ValueError("Expected a synchronous function to cache")
+        self._func = func
+        self._key = key
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires at, result), in least recently used order
+        self._results: OrderedDict[Hashable, Tuple[Optional[float], Any]] = (
+            collections.OrderedDict()
+        )
+        self._in_flight: Dict[Hashable, Future] = {}
+        self.stats = CacheStats()
+
+    def __call__(self, *args, **kwargs) -> Any:
+        key = self._key(*args, **kwargs) if self._key else _default_key(args, kwargs)
+
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                expires_at, result = cached
+                if expires_at is None or expires_at > time.monotonic():
+                    self._results.move_to_end(key)
+                    self.stats.hits += 1
+                    return result
+                del self._results[key]
+                self.stats.expirations += 1
+
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                self.stats.misses += 1
+                owner = True
+            else:
+                self.stats.coalesced += 1
+                owner = False
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._func(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._store(key, result)
+        future.set_result(result)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __deepcopy__(self, memo) -> "CachedFunction":
+        # Spawned tasks share the cache
+        return self
+
+    def __reduce__(self):
+        return CachedFunction, (self._func, self._key, self._max_size, self._ttl)
+
+    def _store(self, key: Hashable, result: Any) -> None:
+        expires_at = None if self._ttl is None else time.monotonic() + self._ttl
+        self._results[key] = (expires_at, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self._max_size:
+            self._results.popitem(last=False)
+            self.stats.evictions += 1
+
+
+def _default_key(args: tuple, kwargs: dict) -> Hashable:
+    if len(args) == 1 and not kwargs:
+        return args[0]
+    return args, tuple(sorted(kwargs.items()))
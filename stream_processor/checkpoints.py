@@ -0,0 +1,132 @@
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, NamedTuple, Optional
+
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+DEFAULT_COMPACTION_INTERVAL = 1000
+
+# length and crc32 of a record in the append-only file
+_HEADER = struct.Struct(">II")
+
+
+class Checkpoint(NamedTuple):
+    # the plan the states were taken from, see Stream.explain
+    plan: str
+    # one state per operator of the plan, the source's offset last
+    states: List[Any]
+    committed_at: float
+
+
+class CheckpointStore(ABC):
+    @abstractmethod
+    def load(self, name: str) -> Optional[Checkpoint]:
+        raise NotImplemented
+
+    @abstractmethod
+    def commit(self, name: str, checkpoint: Checkpoint) -> None:
+        raise NotImplemented
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """
+    Keeps the latest checkpoint of every stream name in a SQLite database, each
+    commit being a single transaction.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints "
+                "(name TEXT PRIMARY KEY, checkpoint BLOB NOT NULL)"
+            )
+
+    def load(self, name: str) -> Optional[Checkpoint]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT checkpoint FROM checkpoints WHERE name = ?", (name,)
+            ).fetchone()
+        return None if row is None else Checkpoint(*pickle.loads(row[0]))
+
+    def commit(self, name: str, checkpoint: Checkpoint) -> None:
+        data = pickle.dumps(tuple(checkpoint), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checkpoints (name, checkpoint) VALUES (?, ?)",
+                (name, data),
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    Appends checkpoints to a file per stream name in `directory`, fsynced on
+    every commit. A record torn by a crash fails its checksum and is ignored,
+    so loading falls back to the checkpoint before it. Every `compact_every`
+    commits the file is atomically replaced by one holding the latest record.
+    """
+
+    def __init__(
+        self, directory: str, compact_every: int = DEFAULT_COMPACTION_INTERVAL
+    ) -> None:
+        self._directory = directory
+        self._compact_every = compact_every
+        self._commits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, name: str) -> Optional[Checkpoint]:
+        latest = None
+        with self._lock:
+            try:
+                with open(self._path(name), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+
+        position = 0
+        while position + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, position)
+            record = data[position + _HEADER.size : position + _HEADER.size + length]
+            if len(record) < length or zlib.crc32(record) != crc:
+                break
+            latest = record
+            position += _HEADER.size + length
+        return None if latest is None else Checkpoint(*pickle.loads(latest))
+
+    def commit(self, name: str, checkpoint: Checkpoint) -> None:
+        record = pickle.dumps(tuple(checkpoint), protocol=pickle.HIGHEST_PROTOCOL)
+        data = _HEADER.pack(len(record), zlib.crc32(record)) + record
+        with self._lock:
+            commits = self._commits.get(name, 0) + 1
+            # The first commit also drops a record torn by an earlier crash,
+            # which would otherwise hide the records appended after it.
+            if name not in self._commits or commits >= self._compact_every:
+                self._replace(name, data)
+                commits = 0
+            else:
+                _write(self._path(name), data, "ab")
+            self._commits[name] = commits
+
+    def _replace(self, name: str, data: bytes) -> None:
+        path = self._path(name)
+        _write(path + ".tmp", data, "wb")
+        os.replace(path + ".tmp", path)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._directory, f"{name}.checkpoints")
+
+
+def _write(path: str, data: bytes, mode: str) -> None:
+    with open(path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,225 @@
+import inspect
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from stream_processor import tasks
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+
+_STOP = object()
+
+
+class InlineHandler:
+    """
+    Marks a handler to be run by the worker moving the task, as without an
+    event bus, e.g. one which has to run before the task's result is used.
+    """
+
+    def __init__(self, handler: Callable) -> None:
+        self.handler = handler
+        self.__signature__ = inspect.signature(handler)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.handler(*args, **kwargs)
+
+
+class BatchHandler:
+    """
+    Marks a handler to be called by an event bus with a list of the Events
+    for it drained at once, rather than once per event.
+    """
+
+    def __init__(self, handler: Callable[[List["Event"]], Any]) -> None:
+        self.handler = handler
+
+    def __call__(self, events: List["Event"]) -> Any:
+        return self.handler(events)
+
+
+class Event:
+    """A task having moved to `state`, with the arguments for its handlers."""
+
+    __slots__ = ("state", "args", "context", "published_at")
+
+    def __init__(
+        self, state: "tasks.State", args: tuple, context: "tasks.TaskContext"
+    ) -> None:
+        self.state = state
+        self.args = args
+        self.context = context
+        self.published_at = time.monotonic()
+
+    @property
+    def task_name(self) -> Optional[str]:
+        return self.context.task_name
+
+    def __repr__(self) -> str:
+        return f"Event({self.task_name}, {self.state.value}, args={self.args!r})"
+
+
+# a handler, whether it takes the context and whether it takes batches
+_BusPlan = Tuple[Tuple[Callable, bool, bool], ...]
+
+
+class EventBus:
+    """
+    Runs the handlers of tasks on `workers` threads of its own, so a slow
+    handler doesn't hold up the worker running the task. A state change puts
+    an Event on a queue of up to `max_size` events, blocking the task's worker
+    while it is full, or dropping the event with `drop_when_full`. The threads
+    drain up to `batch_size` events at once and call BatchHandlers once with
+    all of their events. With more than one thread events may be handled out
+    of order.
+
+    Handlers can't fail the task they were called for: their errors are
+    counted in `failed` and passed to `on_error`. They get the task's context
+    as it is by the time they run. InlineHandlers still run on the task's
+    worker.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        workers: int = 1,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        drop_when_full: bool = False,
+        on_error: Callable[[Exception], None] = None,
+    ) -> None:
+        self._events = queue.Queue(max_size)
+        self._batch_size = batch_size
+        self._drop_when_full = drop_when_full
+        self._on_error = on_error
+        self._lock = threading.Lock()
+        self._closed = False
+        self.handled = 0
+        self.dropped = 0
+        self.failed = 0
+        self._workers = [
+            threading.Thread(target=self._drain, name=f"EventBus-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def plan(
+        self, state: "tasks.State", handlers: Optional[List[Callable]]
+    ) -> "tasks.HandlerPlan":
+        """
+        The dispatch plan of a task's `handlers` for `state`: its InlineHandlers
+        followed by publishing an Event for the others to the bus.
+        """
+        inline, published = [], []
+        for handler in handlers or ():
+            if isinstance(handler, InlineHandler):
+                inline.append((handler.handler, tasks.accepts_context(handler.handler)))
+            elif isinstance(handler, BatchHandler):
+                published.append((handler.handler, False, True))
+            else:
+                published.append((handler, tasks.accepts_context(handler), False))
+        if published:
+            inline.append((_Publisher(self, state, tuple(published)), True))
+        return tuple(inline)
+
+    def publish(self, handlers: _BusPlan, event: Event) -> None:
+        if self._closed:
+            raise RuntimeError("Cannot publish to a closed event bus")
+        if not self._drop_when_full:
+            self._events.put((handlers, event))
+            return
+        try:
+            self._events.put_nowait((handlers, event))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self) -> None:
+        """Blocks until every event published so far has been handled."""
+        self._events.join()
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stops the bus once the events published so far are handled, waiting
+        for them unless `wait` is False.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._events.put(_STOP)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def __enter__(self) -> "EventBus":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _drain(self) -> None:
+        events = self._events
+        while True:
+            item = events.get()
+            batch = []
+            while item is not _STOP:
+                batch.append(item)
+                if len(batch) >= self._batch_size:
+                    break
+                try:
+                    item = events.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._dispatch(batch)
+            finally:
+                for _ in range(len(batch) + (item is _STOP)):
+                    events.task_done()
+            if item is _STOP:
+                return
+
+    def _dispatch(self, batch: List[Tuple[_BusPlan, Event]]) -> None:
+        batches = {}
+        for handlers, event in batch:
+            for handler, accepts_context, takes_batches in handlers:
+                if takes_batches:
+                    batches.setdefault(id(handler), (handler, []))[1].append(event)
+                elif accepts_context:
+                    self._call(handler, *event.args, context=event.context)
+                else:
+                    self._call(handler, *event.args)
+        for handler, events in batches.values():
+            self._call(handler, events)
+        with self._lock:
+            self.handled += len(batch)
+
+    def _call(self, handler: Callable, *args, **kwargs) -> None:
+        try:
+            result = handler(*args, **kwargs)
+            if inspect.isawaitable(result):
+                tasks.run_sync(result)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            if self._on_error is not None:
+                self._on_error(e)
+
+
+class _Publisher:
+    """Stands in the dispatch plan of a task for the handlers on the bus."""
+
+    __slots__ = ("_bus", "_state", "_handlers")
+
+    def __init__(self, bus: EventBus, state: "tasks.State", handlers: _BusPlan):
+        self._bus = bus
+        self._state = state
+        self._handlers = handlers
+
+    def __call__(self, *args, context: "tasks.TaskContext") -> None:
+        self._bus.publish(self._handlers, Event(self._state, args, context))
+
+    def __deepcopy__(self, memo) -> "_Publisher":
+        # The bus is shared, not copied with the tasks using it
+        return self
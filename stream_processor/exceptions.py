@@ -8,3 +8,11 @@ class InvalidStateTransition(Exception):
 
 class InvalidTask(Exception):
     pass
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
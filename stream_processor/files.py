@@ -0,0 +1,379 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from stream_processor.stream import Stream
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_MAX_RECORDS = 10000
+DEFAULT_MAX_PENDING = 4
+
+LINES = "lines"
+JSONL = "jsonl"
+CSV = "csv"
+FORMATS = (LINES, JSONL, CSV)
+
+_CLOSE = object()
+
+
+class FileSource(Stream):
+    """
+    Streams the lines of a local file, as bytes or decoded with `encoding`.
+    The file is read in chunks of `chunk_size` from a memory map, or a gzip
+    stream for ".gz" paths, and each chunk is decoded and split into lines at
+    once, so a line costs neither a syscall nor a Python level loop.
+
+    The byte position of the next line is checkpointed, so a resumed source
+    seeks to it instead of reading the file again. Lines end with a line feed
+    or a carriage return and a line feed, found in the raw bytes, so the
+    `encoding` has to be ASCII compatible.
+    """
+
+    def __init__(
+        self, path: str, encoding: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> None:
+        if encoding is not None and not _splits_on_newline(encoding):
+            raise ValueError(f"Expected an ASCII compatible encoding, got {encoding}")
+        self._path = path
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._position = 0
+        # lines of the current chunk, the iterator over them, the chunk and
+        # the position it starts at
+        self._chunk: Optional[Tuple[List, Iterator, bytes, int]] = None
+        self._items = itertools.chain.from_iterable(self._chunks())
+
+    def _describe(self) -> str:
+        return f"FileSource({self._path})"
+
+    def _snapshot(self) -> Any:
+        if self._chunk is None:
+            return self._position
+        lines, remaining, chunk, start = self._chunk
+        read = len(lines) - remaining.__length_hint__()
+        if read == len(lines):
+            return self._position
+        # offset in the raw bytes, as a decoded line may be shorter
+        unread = chunk.split(b"\n", read)[-1]
+        return start + len(chunk) - len(unread)
+
+    def _restore(self, state: Any) -> None:
+        self._position = state or 0
+
+    def _chunks(self) -> Iterator[Iterator]:
+        for chunk, end in self._read():
+            text = chunk if self._encoding is None else chunk.decode(self._encoding)
+            newline, cr = ("\n", "\r") if self._encoding else (b"\n", b"\r")
+            lines = text.split(newline)
+            if cr in text:
+                lines = [line[:-1] if line[-1:] == cr else line for line in lines]
+            remaining = iter(lines)
+            self._chunk = (lines, remaining, chunk, self._position)
+            self._position = end
+            yield remaining
+
+    def _read(self) -> Iterator[Tuple[bytes, int]]:
+        if self._path.endswith(".gz"):
+            with gzip.open(self._path, "rb") as f:
+                f.seek(self._position)
+                yield from _split_chunks(f.read, self._chunk_size, self._position)
+            return
+
+        with open(self._path, "rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files can't be mapped
+                return
+        with mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            mapped.seek(self._position)
+            yield from _split_chunks(mapped.read, self._chunk_size, self._position)
+
+
+def _splits_on_newline(encoding: str) -> bool:
+    try:
+        return b"\n".decode(encoding) == "\n" and "\n".encode(encoding)[-1:] == b"\n"
+    except UnicodeError:
+        return False
+
+
+def _split_chunks(
+    read: Callable[[int], bytes], chunk_size: int, position: int
+) -> Iterator[Tuple[bytes, int]]:
+    """
+    Yields chunks of whole lines without their last newline, and the position
+    following each chunk.
+    """
+    rest = b""
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            if rest:
+                yield rest, position + len(rest)
+            return
+
+        chunk = rest + chunk if rest else chunk
+        end = chunk.rfind(b"\n")
+        if end == -1:
+            rest = chunk
+            continue
+        rest = chunk[end + 1 :]
+        position += end + 1
+        yield chunk[:end], position
+
+
+def read_lines(
+    path: str, encoding: str = "utf-8", chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Stream:
+    return FileSource(path, encoding, chunk_size)
+
+
+def read_jsonl(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Stream:
+    # json.loads detects the encoding of bytes line by line, str skips that
+    lines = FileSource(path, "utf-8", chunk_size)
+    return lines.filter(_not_blank).map(json.loads)
+
+
+def _not_blank(line: str) -> str:
+    return line.strip()
+
+
+def read_csv(
+    path: str,
+    chunk_size: int = None,
+    header: bool = True,
+    encoding: str = "utf-8",
+    **fmtparams,
+) -> Stream:
+    """
+    Streams the rows of a CSV file, as dicts when it has a `header` and lists
+    otherwise. With `chunk_size` rows are streamed in lists of that many rows.
+    """
+    return Stream(_csv_rows(path, chunk_size, header, encoding, fmtparams))
+
+
+def _csv_rows(
+    path: str, chunk_size: Optional[int], header: bool, encoding: str, fmtparams
+) -> Iterator:
+    if path.endswith(".gz"):
+        f = io.TextIOWrapper(
+            io.BufferedReader(gzip.open(path, "rb"), DEFAULT_CHUNK_SIZE),
+            encoding=encoding,
+            newline="",
+        )
+    else:
+        f = open(path, encoding=encoding, newline="", buffering=DEFAULT_CHUNK_SIZE)
+
+    with f:
+        rows = csv.reader(f, **fmtparams)
+        if header:
+            names = next(rows, None)
+            if names is None:
+                return
+            rows = (dict(zip(names, row)) for row in rows)
+        if chunk_size is None:
+            yield from rows
+            return
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+class BufferedSink:
+    """
+    Buffers records and hands them to `write_batch` in bulk, once `max_records`
+    are buffered or the oldest buffered record has waited `max_delay` seconds;
+    without a writer thread the delay is only checked as records are written.
+
+    With `background=True` the batches are written by a writer thread, so the
+    writes overlap with producing the next records; up to `max_pending`
+    batches are queued before `write` blocks. An error raised by the writer is
+    raised again by every `write`, `flush` or `close` after it, and the batch
+    it failed on and those behind it are kept in `unwritten`.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List], None],
+        max_records: int = DEFAULT_MAX_RECORDS,
+        max_delay: float = None,
+        background: bool = False,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ) -> None:
+        self._write_batch = write_batch
+        self._max_records = max_records
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self._buffer: List = []
+        self._deadline = None
+        self._error: Optional[BaseException] = None
+        self._pending: Optional[queue.Queue] = None
+        self._writer: Optional[threading.Thread] = None
+        self.unwritten: List[List] = []
+        self.batches = 0
+        self.records = 0
+        if background:
+            self._pending = queue.Queue(maxsize=max_pending)
+            self._writer = threading.Thread(target=self._write_pending, daemon=True)
+            self._writer.start()
+
+    def write(self, record: Any) -> None:
+        with self._lock:
+            buffer = self._buffer
+            buffer.append(record)
+            full = len(buffer) >= self._max_records
+            if self._max_delay is not None:
+                now = time.monotonic()
+                if len(buffer) == 1:
+                    self._deadline = now + self._max_delay
+                elif now >= self._deadline:
+                    full = True
+            if not full:
+                return
+            self._buffer = []
+        self._dispatch(buffer)
+
+    def flush(self) -> None:
+        """Writes the buffered records, waiting for the writer thread."""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if buffer:
+            self._dispatch(buffer)
+        if self._pending is not None:
+            self._pending.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._writer is not None:
+                self._pending.put(_CLOSE)
+                self._writer.join()
+                self._writer = None
+
+    def __enter__(self) -> "BufferedSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _dispatch(self, batch: List) -> None:
+        if self._error is not None:
+            self.unwritten.append(batch)
+            self._raise_error()
+        if self._pending is None:
+            self._write(batch)
+        else:
+            self._pending.put(batch)
+
+    def _write(self, batch: List) -> None:
+        self._write_batch(batch)
+        self.batches += 1
+        self.records += len(batch)
+
+    def _write_pending(self) -> None:
+        while True:
+            try:
+                batch = self._pending.get(timeout=self._max_delay)
+            except queue.Empty:
+                # Idle, so write a buffer whose records waited too long. The
+                # lock is held while writing, so a flush waits for the write.
+                with self._lock:
+                    if self._buffer and time.monotonic() >= self._deadline:
+                        batch, self._buffer = self._buffer, []
+                        self._write_safely(batch)
+                continue
+
+            try:
+                if batch is _CLOSE:
+                    return
+                self._write_safely(batch)
+            finally:
+                self._pending.task_done()
+
+    def _write_safely(self, batch: List) -> None:
+        if self._error is None:
+            try:
+                self._write(batch)
+                return
+            except BaseException as e:
+                self._error = e
+        self.unwritten.append(batch)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+
+class FileSink(BufferedSink):
+    """
+    A BufferedSink writing records to `path` as text lines, JSON lines or CSV
+    rows, gzip compressed for ".gz" paths. A batch is serialised and written
+    with a single write.
+
+    CSV records are lists, or dicts written under a header row of the keys of
+    the first dict. The header is left out when appending to a non empty file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        format: str = LINES,
+        append: bool = False,
+        encoding: str = "utf-8",
+        **kwargs,
+    ) -> None:
+        if format not in FORMATS:
+            raise ValueError(f"Expected format to be one of {FORMATS}, got {format}")
+        mode = "ab" if append else "wb"
+        self._header = not (append and os.path.exists(path) and os.path.getsize(path))
+        self._fieldnames = None
+        self._file = gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+        self._format = format
+        self._encoding = encoding
+        super().__init__(self._write_records, **kwargs)
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+    def _write_records(self, records: List) -> None:
+        if self._format == JSONL:
+            data = "".join([json.dumps(record) + "\n" for record in records])
+        elif self._format == CSV:
+            data = self._csv_rows(records)
+        else:
+            data = "".join([f"{record}\n" for record in records])
+        self._file.write(data.encode(self._encoding))
+        self._file.flush()
+
+    def _csv_rows(self, records: List) -> str:
+        buffer = io.StringIO()
+        fieldnames = self._fieldnames
+        if fieldnames is None and records and isinstance(records[0], dict):
+            fieldnames = list(records[0])
+            if self._header:
+                csv.writer(buffer).writerow(fieldnames)
+        if fieldnames is None:
+            csv.writer(buffer).writerows(records)
+        elif all(isinstance(record, dict) for record in records):
+            csv.DictWriter(buffer, fieldnames).writerows(records)
+        else:
+            raise TypeError("Expected dict records in a CSV file with a header")
+        self._fieldnames = fieldnames
+        return buffer.getvalue()
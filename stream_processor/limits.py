@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Optional
+
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 100
+DEFAULT_BACKOFF_RATIO = 0.9
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_BASELINE_DRIFT = 0.01
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, and bursts of up to
+    `burst` of them after an idle period. Shared by several schedulers, it
+    caps their combined rate.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError(f"Expected a positive rate, got {rate}")
+        if burst < 1:
+            raise ValueError(f"Expected burst to be at least 1, got {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Takes a token if there is one and returns 0, or else returns the
+        seconds until there is one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._tokens + (now - self._updated_at) * self.rate, self.burst
+            )
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """Blocks until a token is taken."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    An AIMD limit on the number of tasks in flight. Every task finished in
+    time raises the limit by 1 / limit, so by about one per round of tasks,
+    while a failed task, or one taking more than `latency_tolerance` times the
+    baseline latency, cuts it to `backoff_ratio` of itself, at most once a
+    round.
+
+    The baseline is the lowest latency seen, drifting up by `baseline_drift`
+    of the difference on every slower task, so it follows a downstream that
+    got permanently slower.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = None,
+        min_limit: int = DEFAULT_MIN_LIMIT,
+        max_limit: int = DEFAULT_MAX_LIMIT,
+        backoff_ratio: float = DEFAULT_BACKOFF_RATIO,
+        latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE,
+        baseline_drift: float = DEFAULT_BASELINE_DRIFT,
+    ):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError(
+                f"Expected 1 <= min_limit <= max_limit, got {min_limit}, {max_limit}"
+            )
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.baseline_drift = baseline_drift
+        self._limit = float(min(max(initial_limit or min_limit, min_limit), max_limit))
+        self._baseline: Optional[float] = None
+        # tasks to observe before the limit may be cut again
+        self._cooldown = 0
+        self._lock = threading.Lock()
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def baseline(self) -> Optional[float]:
+        return self._baseline
+
+    def observe(self, latency: float, failed: bool) -> None:
+        with self._lock:
+            baseline = self._baseline
+            if baseline is None or latency < baseline:
+                self._baseline = latency
+            else:
+                self._baseline = baseline + (latency - baseline) * self.baseline_drift
+
+            if self._cooldown:
+                self._cooldown -= 1
+            overloaded = failed or (
+                baseline is not None and latency > baseline * self.latency_tolerance
+            )
+            if not overloaded:
+                self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+            elif not self._cooldown:
+                self._limit = max(self._limit * self.backoff_ratio, self.min_limit)
+                self._cooldown = self.limit
+                self.decreases += 1
@@ -0,0 +1,177 @@
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+TRANSITIONS = "task_transitions_total"
+STATE_DURATION = "task_state_duration_seconds"
+IN_FLIGHT = "scheduler_tasks_in_flight"
+QUEUE_DEPTH = "scheduler_queue_depth"
+RETRIES_WAITING = "scheduler_retries_waiting"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# The backend the tasks and schedulers report to, None while metrics are
+# disabled so that the hot paths only pay for a None check.
+recorder: Optional["MetricsBackend"] = None
+
+
+def enable(backend: "MetricsBackend") -> "MetricsBackend":
+    global recorder
+    recorder = backend
+    return backend
+
+
+def disable() -> None:
+    global recorder
+    recorder = None
+
+
+class MetricsBackend(ABC):
+    @abstractmethod
+    def increment(self, name: str, labels: Labels, value: float = 1) -> None:
+        raise NotImplemented
+
+    @abstractmethod
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        raise NotImplemented
+
+    @abstractmethod
+    def set_gauge(self, name: str, labels: Labels, value: float) -> None:
+        raise NotImplemented
+
+    def record_transition(
+        self, task: str, from_state, to_state, duration: Optional[float]
+    ) -> None:
+        self.increment(TRANSITIONS, (("state", to_state.value), ("task", task)))
+        if duration is not None:
+            labels = (("state", from_state.value), ("task", task))
+            self.observe(STATE_DURATION, labels, duration)
+
+    def record_scheduler(
+        self, scheduler: str, in_flight: int, queue_depth: int, retries_waiting: int
+    ) -> None:
+        labels = (("scheduler", scheduler),)
+        self.set_gauge(IN_FLIGHT, labels, in_flight)
+        self.set_gauge(QUEUE_DEPTH, labels, queue_depth)
+        self.set_gauge(RETRIES_WAITING, labels, retries_waiting)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[Tuple[float, int]]:
+        total, cumulative = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class InMemoryMetrics(MetricsBackend):
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+
+    def increment(self, name: str, labels: Labels, value: float = 1) -> None:
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self._buckets)
+            histogram.observe(value)
+
+    def set_gauge(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            self.gauges.setdefault(name, {})[labels] = value
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(_labels(labels))
+
+    def gauge(self, name: str, **labels) -> Optional[float]:
+        return self.gauges.get(name, {}).get(_labels(labels))
+
+
+class PrometheusExporter:
+    """
+    Renders an InMemoryMetrics backend in the Prometheus text exposition
+    format, e.g. to be served from a `/metrics` endpoint.
+    """
+
+    def __init__(self, metrics: InMemoryMetrics):
+        self._metrics = metrics
+
+    def render(self) -> str:
+        lines = []
+        with self._metrics._lock:
+            for name, series in sorted(self._metrics.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format(labels)} {value}")
+
+            for name, series in sorted(self._metrics.gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format(labels)} {value}")
+
+            for name, series in sorted(self._metrics.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative_counts():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        bucket_labels = labels + (("le", le),)
+                        lines.append(f"{name}_bucket{_format(bucket_labels)} {count}")
+                    lines.append(f"{name}_sum{_format(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
@@ -0,0 +1,336 @@
+import itertools
+import multiprocessing
+import pickle
+import struct
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_SLOTS = 4
+DEFAULT_SLOT_SIZE = 1 << 20
+
+# kinds of records
+_DATA, _END, _ERROR = 0, 1, 2
+
+# kind of a slot's record, and the name length of the segment it spilled to
+_SLOT = struct.Struct(">BH")
+# number of out-of-band buffers of a record, followed by the lengths of the
+# pickle data and the buffers
+_COUNT = struct.Struct(">I")
+_LENGTH = struct.Struct(">Q")
+
+_POLL_INTERVAL = 0.1
+
+
+class RingBuffer:
+    """
+    A single producer, single consumer queue of records in `slots` slots of
+    `slot_size` bytes of shared memory. `put` blocks while every slot is taken,
+    which is what holds back a producer outrunning its consumer; a record too
+    large for a slot is written to a shared memory segment of its own.
+
+    A record is the pickle data of a value plus its out-of-band buffers, e.g.
+    the data of NumPy arrays, which are copied into the slot as they are and
+    read back as views on it, without being pickled. The views are valid until
+    `release` hands the slot back to the producer.
+    """
+
+    def __init__(
+        self,
+        slots: int = DEFAULT_SLOTS,
+        slot_size: int = DEFAULT_SLOT_SIZE,
+        context: multiprocessing.context.BaseContext = None,
+    ) -> None:
+        context = context or multiprocessing.get_context()
+        self._slots = slots
+        self._slot_size = slot_size
+        self._memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._owner = True
+        self._free = context.Semaphore(slots)
+        self._filled = context.Semaphore(0)
+        # records written and read through this instance
+        self._written = self._read = 0
+        self._reading: Optional[Tuple[List[memoryview], Any]] = None
+
+    def __getstate__(self) -> tuple:
+        return self._slots, self._slot_size, self._memory.name, self._free, self._filled
+
+    def __setstate__(self, state: tuple) -> None:
+        self._slots, self._slot_size, name, self._free, self._filled = state
+        self._memory = _attach(name)
+        self._owner = False
+        self._written = self._read = 0
+        self._reading = None
+
+    def put(
+        self,
+        kind: int,
+        data: bytes,
+        buffers: Iterable[pickle.PickleBuffer] = (),
+        timeout: float = None,
+    ) -> bool:
+        """
+        Writes a record, returning False if no slot was free within `timeout`.
+        """
+        raws = [buffer.raw() for buffer in buffers]
+        lengths = [len(data)] + [raw.nbytes for raw in raws]
+        size = _COUNT.size + _LENGTH.size * len(lengths) + sum(lengths)
+        if not self._free.acquire(timeout=timeout):
+            return False
+
+        with self._slot(self._written) as slot:
+            if _SLOT.size + size <= self._slot_size:
+                _SLOT.pack_into(slot, 0, kind, 0)
+                _write_record(slot[_SLOT.size :], data, raws, lengths)
+            else:
+                segment = shared_memory.SharedMemory(create=True, size=size)
+                _write_record(segment.buf, data, raws, lengths)
+                segment.close()
+                name = segment.name.encode()
+                _SLOT.pack_into(slot, 0, kind, len(name))
+                slot[_SLOT.size : _SLOT.size + len(name)] = name
+        self._written += 1
+        self._filled.release()
+        return True
+
+    def get(self, timeout: float = None) -> Optional[Tuple[int, memoryview, List]]:
+        """
+        Returns the kind, pickle data and buffers of the next record, or None
+        if none was written within `timeout`. The record is read in place,
+        until `release`.
+        """
+        if not self._filled.acquire(timeout=timeout):
+            return None
+        slot = self._slot(self._read)
+        kind, spilled = _SLOT.unpack_from(slot)
+        segment = None
+        record = slot[_SLOT.size :]
+        if spilled:
+            name = bytes(slot[_SLOT.size : _SLOT.size + spilled]).decode()
+            segment = _attach(name)
+            record = segment.buf
+        views = _read_record(record)
+        self._reading = ([slot, record] + views, segment)
+        return kind, views[0], views[1:]
+
+    def release(self) -> None:
+        """Hands the slot of the record last read back to the producer."""
+        views, segment = self._reading
+        self._reading = None
+        for view in reversed(views):
+            try:
+                view.release()
+            except BufferError:
+                # still referenced by a value read from it
+                pass
+        if segment is not None:
+            _discard(segment)
+        self._read += 1
+        self._free.release()
+
+    def close(self, written: bool) -> None:
+        """
+        Frees the segments of the records left unread and, if this instance
+        created the ring, the ring itself; `written` tells whether this side
+        writes or reads the ring.
+        """
+        unread = 0
+        while self._filled.acquire(block=False):
+            unread += 1
+        first = self._written - unread if written else self._read
+        for position in range(first, first + unread):
+            with self._slot(position) as slot:
+                _, spilled = _SLOT.unpack_from(slot)
+                if spilled:
+                    name = bytes(slot[_SLOT.size : _SLOT.size + spilled]).decode()
+                    _discard(_attach(name))
+
+        try:
+            self._memory.close()
+        except BufferError:
+            # values read in place still use it, it is unmapped once they go
+            pass
+        if self._owner:
+            self._memory.unlink()
+
+    def _slot(self, position: int) -> memoryview:
+        offset = position % self._slots * self._slot_size
+        return self._memory.buf[offset : offset + self._slot_size]
+
+
+def _write_record(target: memoryview, data: bytes, raws: List, lengths: List[int]):
+    _COUNT.pack_into(target, 0, len(raws))
+    offset = _COUNT.size
+    for length in lengths:
+        _LENGTH.pack_into(target, offset, length)
+        offset += _LENGTH.size
+    for chunk, length in zip([data] + raws, lengths):
+        target[offset : offset + length] = chunk
+        offset += length
+
+
+def _read_record(record: memoryview) -> List[memoryview]:
+    (count,) = _COUNT.unpack_from(record)
+    offset = _COUNT.size
+    lengths = []
+    for _ in range(count + 1):
+        lengths.append(_LENGTH.unpack_from(record, offset)[0])
+        offset += _LENGTH.size
+    views = []
+    for length in lengths:
+        views.append(record[offset : offset + length])
+        offset += length
+    return views
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Workers share the resource tracker of the process creating the segments,
+    # which tracks a segment until it is unlinked by any of them
+    return shared_memory.SharedMemory(name)
+
+
+def _discard(segment: shared_memory.SharedMemory) -> None:
+    try:
+        segment.close()
+    except BufferError:
+        pass
+    segment.unlink()
+
+
+def _encode(value: Any) -> Tuple[bytes, List[pickle.PickleBuffer]]:
+    buffers = []
+    data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    return data, buffers
+
+
+def _work(
+    process: Callable[[List], Iterable], inputs: RingBuffer, outputs: RingBuffer
+) -> None:
+    """Runs `process` over every batch of `inputs` until its end."""
+    while True:
+        kind, data, buffers = inputs.get()
+        if kind == _END:
+            inputs.release()
+            outputs.put(_END, b"")
+            return
+        try:
+            results = list(process(pickle.loads(data, buffers=buffers)))
+            kind, (data, buffers) = _DATA, _encode(results)
+        except Exception as e:
+            kind, (data, buffers) = _ERROR, _encode_error(e)
+        # Arrays of the batch are views on the input slot, which the results
+        # may still refer to until they are written
+        outputs.put(kind, data, buffers)
+        inputs.release()
+        if kind == _ERROR:
+            return
+
+
+def _encode_error(error: Exception) -> Tuple[bytes, List]:
+    try:
+        return _encode(error)
+    except Exception:
+        return _encode(RuntimeError(repr(error)))
+
+
+def run(
+    process: Callable[[List], Iterable],
+    items: Iterable,
+    processes: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    slots: int = DEFAULT_SLOTS,
+    slot_size: int = DEFAULT_SLOT_SIZE,
+) -> Iterator:
+    """
+    Runs `process` over batches of `items` in `processes` worker processes,
+    yielding the results in order. The batches are handed out round robin over
+    a pair of rings per worker, so the results are collected in the same order
+    without reordering. A thread feeds the input rings, blocking while the
+    workers are behind, and the workers block while the results aren't read.
+    Results are copied out of their slot, which is reused once released.
+    """
+    context = multiprocessing.get_context()
+    inputs = [RingBuffer(slots, slot_size, context) for _ in range(processes)]
+    outputs = [RingBuffer(slots, slot_size, context) for _ in range(processes)]
+    workers = [
+        context.Process(
+            target=_work, args=(process, inputs[i], outputs[i]), daemon=True
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stopped = threading.Event()
+    failure = []
+    feeder = threading.Thread(
+        target=_feed, args=(items, inputs, batch_size, stopped, failure), daemon=True
+    )
+    feeder.start()
+
+    ended = False
+    try:
+        for position in itertools.count():
+            ring, worker = outputs[position % processes], workers[position % processes]
+            record = ring.get(timeout=_POLL_INTERVAL)
+            while record is None:
+                if not worker.is_alive():
+                    raise RuntimeError(
+                        f"Worker process exited with code {worker.exitcode}"
+                    )
+                record = ring.get(timeout=_POLL_INTERVAL)
+
+            kind, data, buffers = record
+            if kind == _END:
+                ring.release()
+                ended = True
+                break
+            # Copied out, as the slot is reused once released
+            value = pickle.loads(data, buffers=[bytearray(b) for b in buffers])
+            ring.release()
+            if kind == _ERROR:
+                raise value
+            yield from value
+
+        if failure:
+            raise failure[0]
+    finally:
+        stopped.set()
+        feeder.join()
+        for worker in workers:
+            if not ended:
+                worker.terminate()
+            worker.join()
+        for ring in inputs:
+            ring.close(written=True)
+        for ring in outputs:
+            ring.close(written=False)
+
+
+def _feed(
+    items: Iterable,
+    inputs: List[RingBuffer],
+    batch_size: int,
+    stopped: threading.Event,
+    failure: List,
+) -> None:
+    def put(ring: RingBuffer, kind: int, data: bytes, buffers=()) -> bool:
+        while not stopped.is_set():
+            if ring.put(kind, data, buffers, timeout=_POLL_INTERVAL):
+                return True
+        return False
+
+    iterator = iter(items)
+    try:
+        for ring in itertools.cycle(inputs):
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+            if not put(ring, _DATA, *_encode(batch)):
+                return
+    except Exception as e:
+        failure.append(e)
+    for ring in inputs:
+        if not put(ring, _END, b""):
+            return
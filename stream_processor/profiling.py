@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+from typing import Iterator, List, Optional, Set
+
+DEFAULT_SAMPLE_RATE = 1.0
+
+
+class Probe:
+    """
+    Counts the items pulled from an operator and times the pulls, every one
+    of them or, with a `sample_rate` below 1, about that share of them, which
+    the estimates are scaled up from.
+    """
+
+    def __init__(self, sample_rate: float = DEFAULT_SAMPLE_RATE) -> None:
+        self._interval = max(round(1 / sample_rate), 1)
+        # random phase, so probes of the same plan don't sample the same pulls
+        self._countdown = random.randrange(self._interval)
+        self.calls = 0
+        self.items = 0
+        self.sampled = 0
+        self.sampled_wall = 0.0
+        self.sampled_cpu = 0.0
+        # threads pulling from the operator
+        self.threads: Set[int] = set()
+
+    @property
+    def wall(self) -> float:
+        return self._estimate(self.sampled_wall)
+
+    @property
+    def cpu(self) -> float:
+        return self._estimate(self.sampled_cpu)
+
+    def wrap(self, items: Iterator) -> Iterator:
+        perf_counter, thread_time = time.perf_counter, time.thread_time
+        while True:
+            self.calls += 1
+            if self._countdown:
+                self._countdown -= 1
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            else:
+                self._countdown = self._interval - 1
+                self.threads.add(threading.get_ident())
+                started, cpu_started = perf_counter(), thread_time()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    self.sampled += 1
+                    self.sampled_wall += perf_counter() - started
+                    self.sampled_cpu += thread_time() - cpu_started
+            self.items += 1
+            yield item
+
+    def _estimate(self, sampled: float) -> float:
+        return sampled * self.calls / self.sampled if self.sampled else 0.0
+
+
+class OperatorProfile:
+    """
+    Time spent in an operator itself, in seconds, excluding the time it was
+    blocked on `upstream`, the operator feeding it. `queue_wait` is the part
+    of it its consumer waited for work handed off to a scheduler, worker
+    processes or a read ahead thread, which isn't counted as `cpu`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        items_in: Optional[int],
+        items_out: int,
+        wall: float,
+        cpu: float,
+        upstream: float,
+        queue_wait: float,
+    ) -> None:
+        self.name = name
+        self.items_in = items_in
+        self.items_out = items_out
+        self.wall = wall
+        self.cpu = cpu
+        self.upstream = upstream
+        self.queue_wait = queue_wait
+
+    def __repr__(self) -> str:
+        return (
+            f"OperatorProfile({self.name}, items_in={self.items_in}, "
+            f"items_out={self.items_out}, wall={self.wall:.6f}, cpu={self.cpu:.6f}, "
+            f"upstream={self.upstream:.6f}, queue_wait={self.queue_wait:.6f})"
+        )
+
+
+class Profile:
+    """The operators of a plan, from the source up to the last one."""
+
+    _COLUMNS = ("items in", "items out", "wall s", "cpu s", "upstream s", "queue s")
+
+    def __init__(self, operators: List[OperatorProfile]) -> None:
+        self.operators = operators
+
+    def __str__(self) -> str:
+        rows = [
+            (
+                "-" if op.items_in is None else str(op.items_in),
+                str(op.items_out),
+                *(
+                    f"{value:.6f}"
+                    for value in (op.wall, op.cpu, op.upstream, op.queue_wait)
+                ),
+            )
+            for op in self.operators
+        ]
+        width = max([len("operator")] + [len(op.name) for op in self.operators])
+        widths = [
+            max([len(column)] + [len(row[i]) for row in rows])
+            for i, column in enumerate(self._COLUMNS)
+        ]
+
+        def line(name, values):
+            cells = (value.rjust(w) for value, w in zip(values, widths))
+            return "  ".join([name.ljust(width), *cells])
+
+        lines = [line("operator", self._COLUMNS)]
+        lines.extend(line(op.name, row) for op, row in zip(self.operators, rows))
+        return "\n".join(lines)
+
+    def collapsed(self) -> str:
+        """
+        The time of each operator in the collapsed stack format of flamegraph
+        tools, in microseconds: the operators pulling from it, from the last
+        one down, then its own name and time.
+        """
+        lines, frames = [], []
+        for op in reversed(self.operators):
+            frames.append(op.name.replace(";", ","))
+            micros = round(op.wall * 1e6)
+            if micros > 0:
+                lines.append(f"{';'.join(frames)} {micros}")
+        return "\n".join(lines)
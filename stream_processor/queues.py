@@ -0,0 +1,101 @@
+import bisect
+import collections
+import threading
+from typing import Any, Counter, Deque, Dict, Iterator, List, Optional, Tuple
+
+from stream_processor.tasks import Task, State
+
+DEFAULT_PRIORITY = 0
+
+QueuedTask = Tuple[Task, Any]
+
+
+class TaskQueue:
+    """
+    Thread safe FIFO queue of (task, params) pairs per priority level, lower
+    priority values are dequeued first. Enqueueing is O(1) for a known level.
+
+    Iterating pops the queued tasks, skipping any task whose state was moved
+    away from QUEUED while it waited, so tasks can be terminated or rejected in
+    place. The queue can be inspected with `snapshot` and `states` without
+    consuming it.
+
+    Its length counts the tasks still to run: those moved by `move_queued`
+    are discounted at once, those moved otherwise once they are popped.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (task, params, generation) per priority level
+        self._levels: Dict[int, Deque[Tuple[Task, Any, int]]] = {}
+        self._priorities: List[int] = []
+        self._size = 0
+        self._live = 0
+        # entries of generations up to `_cleared` were discounted from `_live`
+        self._generation = 0
+        self._cleared = -1
+
+    def put(self, task: Task, params: Any = None, priority: int = DEFAULT_PRIORITY):
+        with self._lock:
+            level = self._levels.get(priority)
+            if level is None:
+                level = self._levels[priority] = collections.deque()
+                bisect.insort(self._priorities, priority)
+            level.append((task, params, self._generation))
+            self._size += 1
+            self._live += 1
+
+    def get(self) -> Optional[QueuedTask]:
+        while True:
+            with self._lock:
+                if not self._size:
+                    return None
+                priority = self._priorities[0]
+                level = self._levels[priority]
+                task, params, generation = level.popleft()
+                self._size -= 1
+                if generation > self._cleared:
+                    self._live -= 1
+                if not level:
+                    del self._levels[priority]
+                    self._priorities.pop(0)
+            if task.state == State.QUEUED:
+                return task, params
+
+    def snapshot(self) -> List[QueuedTask]:
+        with self._lock:
+            return [
+                (task, params)
+                for priority in self._priorities
+                for task, params, _ in self._levels[priority]
+            ]
+
+    def states(self) -> Counter[State]:
+        return collections.Counter(task.state for task, _ in self.snapshot())
+
+    def move_queued(self, state: State) -> None:
+        """Moves the queued tasks to `state` in place, e.g. to terminate them."""
+        with self._lock:
+            self._live = 0
+            self._cleared = self._generation
+            self._generation += 1
+            tasks = [
+                task
+                for priority in self._priorities
+                for task, _, _ in self._levels[priority]
+            ]
+        for task in tasks:
+            if task.context._is_valid_move(task.state, state):
+                task.state = state
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __iter__(self) -> Iterator[QueuedTask]:
+        return self
+
+    def __next__(self) -> QueuedTask:
+        item = self.get()
+        if item is None:
+            raise StopIteration
+        return item
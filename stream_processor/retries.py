@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+from typing import Optional, Tuple, Type
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 0.1
+DEFAULT_BACKOFF_MULTIPLIER = 2.0
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_JITTER = 0.1
+DEFAULT_WINDOW = 10.0
+
+
+class RetryBudget:
+    """
+    Caps the number of retries across every policy sharing the budget, so a
+    failing downstream doesn't get multiplied load from all of its callers.
+
+    Up to `max_retries` retries are allowed per `window` seconds, the budget
+    refilling steadily as time passes. With a `window` of None it never
+    refills.
+    """
+
+    def __init__(self, max_retries: int, window: Optional[float] = DEFAULT_WINDOW):
+        if window is not None and window <= 0:
+            raise ValueError(f"Expected a positive window, got {window}")
+        self.max_retries = max_retries
+        self.window = window
+        self._tokens = float(max_retries)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            return int(self._refill())
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self._refill() < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _refill(self) -> float:
+        if self.window is not None:
+            now = time.monotonic()
+            refilled = (now - self._updated_at) * self.max_retries / self.window
+            self._tokens = min(self._tokens + refilled, self.max_retries)
+            self._updated_at = now
+        return self._tokens
+
+
+class RetryPolicy:
+    """
+    Decides whether a FAILED task is queued again, and after how long.
+
+    A task is retried while it has made fewer than `max_attempts` attempts, its
+    error is an instance of `retry_on` and the `budget`, if any, has retries
+    left. The n-th retry waits `backoff * multiplier ** (n - 1)` seconds, capped
+    at `max_backoff` and spread by +/- `jitter` of itself.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff: float = DEFAULT_BACKOFF,
+        multiplier: float = DEFAULT_BACKOFF_MULTIPLIER,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        jitter: float = DEFAULT_JITTER,
+        retry_on: Tuple[Type[Exception], ...] = (Exception,),
+        budget: RetryBudget = None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+        self.budget = budget
+
+    def next_delay(self, attempts: int, error: Exception) -> Optional[float]:
+        """
+        Returns the delay before the next attempt, or None if there is none.
+        """
+        if attempts >= self.max_attempts or not isinstance(error, self.retry_on):
+            return None
+        if self.budget is not None and not self.budget.acquire():
+            return None
+
+        delay = min(self.backoff * self.multiplier ** (attempts - 1), self.max_backoff)
+        return max(delay * (1 + random.uniform(-self.jitter, self.jitter)), 0)
@@ -1,57 +1,825 @@
+import asyncio
+import collections
+import functools
+import heapq
 import itertools
-from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, Iterator, Any, Union, Type
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from abc import ABC
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    Future,
+    wait,
+    FIRST_COMPLETED,
+)
+from types import FunctionType, BuiltinFunctionType
+from typing import (
+    Callable,
+    Iterator,
+    Iterable,
+    Any,
+    Union,
+    Type,
+    List,
+    Tuple,
+    Dict,
+    Optional,
+    Deque,
+    NamedTuple,
+)
 
-from stream_processor.exceptions import InvalidTask
-from stream_processor.tasks import Task, State
+from stream_processor import metrics
+from stream_processor.exceptions import DeadlineExceeded, InvalidTask
+from stream_processor.limits import AdaptiveConcurrency, TokenBucket
+from stream_processor.queues import TaskQueue, DEFAULT_PRIORITY
+from stream_processor.retries import RetryPolicy
+from stream_processor.tasks import (
+    Task,
+    TaskContext,
+    State,
+    execute_detached,
+    task_factory,
+)
 
 DEFAULT_MAX_WORKERS = 5
+IN_FLIGHT_PER_WORKER = 2
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_MAX_CONCURRENCY = 1000
+# seconds a WorkStealingScheduler worker waiting for a subtask's result sleeps
+# between steal attempts
+IDLE_INTERVAL = 0.01
 
 
 class Scheduler(ABC):
-    def __init__(self):
-        self.tasks: Iterator[Task] = iter(())
+    """
+    Runs tasks through a window of at most `_max_in_flight` of them, pulling
+    the next task only when there is room for it.
+
+    Results are yielded in dispatch order, holding back up to
+    `_reorder_buffer_size` completed results behind a task that is still
+    pending, unless `_ordered` is False and they are yielded as they complete.
+
+    FAILED tasks are queued again as long as the retry policy of the task, or
+    else the one of the scheduler, allows it. A task waiting for its retry
+    doesn't take up a slot of the window.
+
+    With a `rate_limit` a task is only started, or retried, once it gets a
+    token from the bucket. With a `concurrency` limiter the window is sized by
+    its limit instead, which is fed the latency and outcome of every task.
+
+    A task still running after its `timeout`, or else the scheduler's
+    `task_timeout`, is moved to TERMINATED and its result is None; a worker
+    stuck in it is abandoned rather than waited for. A run past its `deadline`
+    terminates its remaining tasks and raises DeadlineExceeded.
+
+    Subclasses provide the execution through `_submit`, `_wait` and `_outcome`.
+    """
+
+    _max_in_flight = 1
+    _ordered = True
+    _reorder_buffer_size = 1
+
+    def __init__(
+        self,
+        retry_policy: RetryPolicy = None,
+        rate_limit: TokenBucket = None,
+        concurrency: AdaptiveConcurrency = None,
+        task_timeout: float = None,
+    ):
+        self.tasks: TaskQueue = TaskQueue()
+        self._retry_policy = retry_policy
+        self._rate_limit = rate_limit
+        self._concurrency = concurrency
+        self._task_timeout = task_timeout
+        # tasks terminated by their timeout or the deadline of a run
+        self.expired = 0
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Terminates the queued tasks and releases the workers, waiting for the
+        running tasks to finish with `wait`.
+        """
+        self.terminate_tasks()
+        self._shutdown(wait)
+
+    def __enter__(self) -> "Scheduler":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        # Don't hang on a worker stuck in an abandoned task
+        self.close(wait=exc_type is None and not self.expired)
 
     def terminate_tasks(self) -> None:
-        for task in self.tasks:
-            task.state = State.TERMINATED
+        self.tasks.move_queued(State.TERMINATED)
 
     def reject_tasks(self) -> None:
-        for task in self.tasks:
-            task.state = State.REJECTED
+        self.tasks.move_queued(State.REJECTED)
+
+    def add_task(
+        self,
+        task: Union[Task, Callable],
+        params: Any = None,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> None:
+        task = self._as_task(task)
+        task.state = State.QUEUED
+        self.tasks.put(task, params, priority)
+
+    def results(self, deadline: float = None) -> Iterator:
+        """
+        Runs the queued tasks. Tasks added while the results are consumed are
+        picked up too, until the queue is found empty. After `deadline` seconds
+        the tasks left are terminated and DeadlineExceeded is raised.
+        """
+        return self._run(self.tasks, deadline)
 
-    def add_task(self, task: Union[Task, Callable], params: Any = None) -> None:
+    def map(
+        self, func: Union[Task, Callable], items: Iterable, deadline: float = None
+    ) -> Iterator:
+        """
+        Lazily runs `func` over `items`, a new task per item. Items are only
+        pulled from `items` when the scheduler has room for another task, so
+        `items` may be unbounded.
+        """
+        return self._run(self._queue_lazily(func, items), deadline)
 
+    def _queue_lazily(self, func: Union[Task, Callable], items: Iterable) -> Iterator:
+        new_task = self._task_factory(func)
+        for params in items:
+            task = new_task()
+            task.state = State.QUEUED
+            yield task, params
+
+    @classmethod
+    def _task_factory(cls, func: Union[Task, Callable]) -> Callable[[], Task]:
+        if isinstance(func, (FunctionType, BuiltinFunctionType)):
+            return cls._as_task(func).spawn
+        new_func = task_factory(func)
+        return lambda: cls._as_task(new_func())
+
+    @staticmethod
+    def _as_task(task: Union[Task, Callable]) -> Task:
         if isinstance(task, Task):
-            task = task
-        elif isinstance(task, Callable):
-            task = Task(task)
-        else:
-            raise InvalidTask("Expected Callable or instance of Task")
+            return task
+        elif callable(task):
+            return Task(task)
+        raise InvalidTask("Expected Callable or instance of Task")
 
-        self.tasks = itertools.chain(self.tasks, ((task, params),))
-        task.state = State.QUEUED
+    def _run(self, tasks: Iterator[Tuple[Task, Any]], deadline: float = None):
+        running: Dict[Any, _Dispatch] = {}
+        delayed: List[Tuple[float, int, _Dispatch]] = []
+        # (expires at, seq, handle) of the running tasks with a timeout
+        expiring: List[Tuple[float, int, Any]] = []
+        buffered: Dict[int, Any] = {}
+        sequence = itertools.count()
+        next_to_yield = 0
+        rate_limit, concurrency = self._rate_limit, self._concurrency
+        if deadline is not None:
+            deadline += time.monotonic()
+        try:
+            while True:
+                # seconds until the rate limit lets another task start
+                throttled = 0.0
+                while delayed and delayed[0][0] <= time.monotonic():
+                    if rate_limit is not None:
+                        throttled = rate_limit.try_acquire()
+                        if throttled:
+                            break
+                    _, _, dispatch = heapq.heappop(delayed)
+                    self._start(running, expiring, dispatch)
+
+                if len(buffered) < self._reorder_buffer_size and not throttled:
+                    limit = self._max_in_flight
+                    if concurrency is not None:
+                        limit = concurrency.limit
+                    vacancies = max(limit - len(running), 0)
+                    if rate_limit is None:
+                        for task, params in itertools.islice(tasks, vacancies):
+                            dispatch = _Dispatch(task, params, next(sequence))
+                            self._start(running, expiring, dispatch)
+                    while rate_limit is not None and vacancies:
+                        throttled = rate_limit.try_acquire()
+                        if throttled:
+                            break
+                        item = next(tasks, None)
+                        if item is None:
+                            break
+                        dispatch = _Dispatch(*item, next(sequence))
+                        self._start(running, expiring, dispatch)
+                        vacancies -= 1
+
+                if metrics.recorder is not None:
+                    metrics.recorder.record_scheduler(
+                        type(self).__name__, len(running), len(self.tasks), len(delayed)
+                    )
+
+                timeout = delayed[0][0] if delayed else None
+                if throttled:
+                    # a retry that is due has to wait for the token as well
+                    timeout = time.monotonic() + throttled
+                for expires_at in (expiring[0][0] if expiring else None, deadline):
+                    if expires_at is not None:
+                        timeout = (
+                            expires_at if timeout is None else min(timeout, expires_at)
+                        )
+                if timeout is not None:
+                    timeout = max(timeout - time.monotonic(), 0)
+
+                if not running and not delayed and not throttled:
+                    return
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._expire_run(tasks, running, delayed)
+                    raise DeadlineExceeded(
+                        f"{type(self).__name__} run exceeded its deadline"
+                    )
+                if not running:
+                    time.sleep(timeout)
+                    continue
+
+                for handle in self._wait(running, timeout):
+                    dispatch = running.pop(handle)
+                    result = self._outcome(handle, dispatch.task)
+                    if concurrency is not None:
+                        concurrency.observe(
+                            time.monotonic() - dispatch.started_at,
+                            dispatch.task.state is State.FAILED,
+                        )
+                    delay = self._retry_delay(dispatch.task)
+                    if delay is not None:
+                        ready_at = time.monotonic() + delay
+                        heapq.heappush(delayed, (ready_at, dispatch.seq, dispatch))
+                    elif self._ordered:
+                        buffered[dispatch.seq] = result
+                    else:
+                        yield result
+
+                now = time.monotonic()
+                while expiring and expiring[0][0] <= now:
+                    _, seq, handle = heapq.heappop(expiring)
+                    dispatch = running.get(handle)
+                    # a task which finished meanwhile is collected by _wait
+                    if dispatch is None or handle.done():
+                        continue
+                    context = dispatch.task.context
+                    # the timeout runs from the move to RUNNING, which a task
+                    # waiting for a worker hasn't made yet
+                    expires_at = context.deadline or now + context.timeout
+                    if expires_at > now:
+                        heapq.heappush(expiring, (expires_at, seq, handle))
+                        continue
+                    if not self._expire(handle, dispatch.task):
+                        continue
+                    del running[handle]
+                    if not handle.cancelled() and self._replace_stuck_worker():
+                        # the tasks which didn't start yet move to the new pool
+                        for pending, waiting in list(running.items()):
+                            if pending.cancel():
+                                del running[pending]
+                                self._start(running, expiring, waiting)
+                    if concurrency is not None:
+                        concurrency.observe(
+                            time.monotonic() - dispatch.started_at, True
+                        )
+                    if self._ordered:
+                        buffered[seq] = None
+                    else:
+                        yield None
+
+                while next_to_yield in buffered:
+                    yield buffered.pop(next_to_yield)
+                    next_to_yield += 1
+        finally:
+            self._cancel(list(running))
+
+    def _start(
+        self, running: Dict[Any, "_Dispatch"], expiring: List, dispatch: "_Dispatch"
+    ) -> None:
+        task = dispatch.task
+        timeout = self._task_timeout if task.timeout is None else task.timeout
+        if self._concurrency is not None or timeout is not None:
+            dispatch.started_at = time.monotonic()
+        if timeout is not None:
+            task.context.timeout = timeout
+            task.context.deadline = None
+        handle = self._submit(task, dispatch.params)
+        running[handle] = dispatch
+        if timeout is not None:
+            expires_at = dispatch.started_at + timeout
+            heapq.heappush(expiring, (expires_at, dispatch.seq, handle))
+
+    def _expire(self, handle: Any, task: Task) -> bool:
+        if not task.context.terminate():
+            return False
+        handle.cancel()
+        self.expired += 1
+        return True
 
-    @abstractmethod
-    def results(self) -> Iterator:
-        raise NotImplemented
+    def _expire_run(
+        self, tasks: Iterator, running: Dict[Any, "_Dispatch"], delayed: List
+    ) -> None:
+        for handle, dispatch in list(running.items()):
+            if self._expire(handle, dispatch.task):
+                del running[handle]
+        for _, _, dispatch in delayed:
+            if dispatch.task.context.terminate():
+                self.expired += 1
+        delayed.clear()
+        if tasks is self.tasks:
+            self.terminate_tasks()
+
+    def _retry_delay(self, task: Task) -> Optional[float]:
+        if task.state is not State.FAILED:
+            return None
+        policy = task.retry_policy or self._retry_policy
+        if policy is None:
+            return None
+        delay = policy.next_delay(task.context.attempts, task.error)
+        if delay is not None:
+            task.state = State.QUEUED
+        return delay
+
+    def _submit(self, task: Task, params: Any) -> Any:
+        """
+        Starts running `task` and returns a handle to wait on. Runs it inline
+        by default, so subclasses only overriding `results` keep working.
+        """
+        return _Done(task(params))
+
+    def _wait(self, handles: Iterable, timeout: Optional[float]) -> Iterable:
+        """Blocks until some of `handles` are done, or `timeout` expires."""
+        return list(handles)
+
+    def _outcome(self, handle: Any, task: Task) -> Any:
+        return handle.result()
+
+    def _cancel(self, handles: List) -> None:
+        for handle in handles:
+            handle.cancel()
+
+    def _shutdown(self, wait: bool) -> None:
+        pass
+
+    def _replace_stuck_worker(self) -> bool:
+        """
+        Called when a timeout abandons a task its worker is stuck in. Returns
+        whether new workers replace the current ones, for the tasks which
+        didn't start yet.
+        """
+        return False
+
+
+class _Dispatch:
+    __slots__ = ("task", "params", "seq", "started_at")
+
+    def __init__(self, task: Task, params: Any, seq: int):
+        self.task = task
+        self.params = params
+        self.seq = seq
+        self.started_at = 0.0
+
+
+class _Done:
+    __slots__ = ("_result",)
+
+    def __init__(self, result: Any):
+        self._result = result
+
+    def result(self) -> Any:
+        return self._result
+
+    def cancel(self) -> bool:
+        return False
+
+    def done(self) -> bool:
+        return True
 
 
 class SerialScheduler(Scheduler):
-    def results(self) -> Iterator:
-        return (task(params) for task, params in self.tasks)
+    """Runs each task inline, when its result is consumed."""
 
 
 class ThreadPoolScheduler(Scheduler):
-    def __init__(self, max_workers=None):
-        super().__init__()
+    """
+    Keeps at most `max_in_flight` tasks submitted to the pool, refilling the
+    window as they finish, so queued tasks are only pulled in as fast as the
+    results are consumed.
+
+    With `ordered=False` results are yielded as the tasks complete. Otherwise
+    they are yielded in submission order, and up to `reorder_buffer_size`
+    completed results are held back while an earlier task is still running;
+    once the buffer is full no new tasks are submitted until it drains.
+    """
+
+    def __init__(
+        self,
+        max_workers=None,
+        max_in_flight=None,
+        ordered=True,
+        reorder_buffer_size=None,
+        retry_policy: RetryPolicy = None,
+        rate_limit: TokenBucket = None,
+        concurrency: AdaptiveConcurrency = None,
+        task_timeout: float = None,
+    ):
+        super().__init__(retry_policy, rate_limit, concurrency, task_timeout)
         self._max_workers = max_workers or DEFAULT_MAX_WORKERS
+        if concurrency is not None:
+            # threads are started lazily, so room for the highest limit is free
+            self._max_workers = max(self._max_workers, concurrency.max_limit)
+        self._max_in_flight = max_in_flight or self._max_workers * IN_FLIGHT_PER_WORKER
+        self._ordered = ordered
+        self._reorder_buffer_size = reorder_buffer_size or self._max_in_flight
         self._pool = ThreadPoolExecutor(max_workers=self._max_workers)
 
-    def results(self) -> Iterator:
-        task_futures = [self._pool.submit(task, params) for task, params in self.tasks]
-        return (r.result() for r in task_futures)
+    def _submit(self, task: Task, params: Any) -> Future:
+        return self._pool.submit(task, params)
+
+    def _wait(self, handles: Iterable, timeout: Optional[float]) -> Iterable:
+        done, _ = wait(handles, timeout=timeout, return_when=FIRST_COMPLETED)
+        return done
+
+    def _replace_stuck_worker(self) -> bool:
+        stuck, self._pool = self._pool, ThreadPoolExecutor(self._max_workers)
+        stuck.shutdown(wait=False)
+        return True
+
+    def _shutdown(self, wait: bool) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+class WorkerStats(NamedTuple):
+    # tasks run by the worker, stolen ones included
+    executed: int
+    # tasks taken from the deques of other workers
+    steals: int
+    # times the worker found no task to run or steal, and for how long
+    idle: int
+    idle_seconds: float
+
+
+class WorkStealingScheduler(Scheduler):
+    """
+    Runs tasks on `max_workers` threads with a deque each, instead of a queue
+    shared by all of them. Tasks of `results()` and `map` are spread over the
+    deques round robin, a worker runs the newest task of its own deque first
+    and once it runs dry steals the oldest task of another worker, so a long
+    task only holds up the tasks queued behind it until they are stolen.
+
+    A task can `submit` follow-up subtasks, which are pushed to the deque of
+    the worker running it, to run next on the same thread unless stolen.
+    Waiting for a subtask's result from a task runs other tasks meanwhile, so
+    workers waiting for each other don't deadlock. `stats()` reports the tasks
+    run, stolen and the idle time of every worker.
+
+    A worker stuck in a task abandoned by its timeout isn't replaced, the
+    other workers steal the tasks queued on its deque meanwhile.
+    """
+
+    def __init__(
+        self,
+        max_workers=None,
+        max_in_flight=None,
+        ordered=True,
+        retry_policy: RetryPolicy = None,
+        rate_limit: TokenBucket = None,
+        concurrency: AdaptiveConcurrency = None,
+        task_timeout: float = None,
+    ):
+        super().__init__(retry_policy, rate_limit, concurrency, task_timeout)
+        self._max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self._max_in_flight = max_in_flight or self._max_workers * IN_FLIGHT_PER_WORKER
+        self._ordered = ordered
+        self._reorder_buffer_size = self._max_in_flight
+        self._deques: List[Deque[Tuple[Future, Task, Any, bool]]] = [
+            collections.deque() for _ in range(self._max_workers)
+        ]
+        # executed, steals, idle and idle seconds of every worker
+        self._stats = [[0, 0, 0, 0.0] for _ in range(self._max_workers)]
+        self._next_worker = itertools.cycle(range(self._max_workers))
+        self._condition = threading.Condition()
+        self._sleeping = 0
+        self._closed = False
+        self._workers = [
+            threading.Thread(
+                target=self._work,
+                args=(index,),
+                name=f"WorkStealingScheduler-{index}",
+                daemon=True,
+            )
+            for index in range(self._max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func: Union[Task, Callable], params: Any = None) -> Future:
+        """
+        Runs `func` with `params` as a task of its own, on the current worker
+        when called from a task, and returns a future of its result, which
+        raises the error of the task if it failed.
+        """
+        return self._push(self._as_task(func), params, raise_error=True)
+
+    def stats(self) -> List[WorkerStats]:
+        return [WorkerStats(*stats) for stats in self._stats]
+
+    def _submit(self, task: Task, params: Any) -> Future:
+        return self._push(task, params, raise_error=False)
+
+    def _wait(self, handles: Iterable, timeout: Optional[float]) -> Iterable:
+        done, _ = wait(handles, timeout=timeout, return_when=FIRST_COMPLETED)
+        return done
+
+    def _push(self, task: Task, params: Any, raise_error: bool) -> Future:
+        if self._closed:
+            raise RuntimeError("Cannot submit tasks to a closed scheduler")
+        future = _StealingFuture()
+        worker = getattr(_current_worker, "worker", None)
+        if worker is not None and worker[0] is self:
+            index = worker[1]
+        else:
+            index = next(self._next_worker)
+        self._deques[index].append((future, task, params, raise_error))
+        if self._sleeping:
+            with self._condition:
+                self._condition.notify()
+        return future
+
+    def _next_task(self, index: int) -> Optional[Tuple[Future, Task, Any, bool]]:
+        try:
+            return self._deques[index].pop()
+        except IndexError:
+            pass
+        # The oldest task of a victim, the one its worker would run last
+        offset = random.randrange(self._max_workers)
+        for position in range(self._max_workers):
+            victim = (offset + position) % self._max_workers
+            if victim == index:
+                continue
+            try:
+                item = self._deques[victim].popleft()
+            except IndexError:
+                continue
+            self._stats[index][1] += 1
+            return item
+        return None
+
+    def _work(self, index: int) -> None:
+        _current_worker.worker = (self, index)
+        stats = self._stats[index]
+        while not self._closed:
+            item = self._next_task(index)
+            if item is not None:
+                self._execute(item, stats)
+                continue
+
+            idle_at = time.monotonic()
+            with self._condition:
+                self._sleeping += 1
+                # _push and _shutdown notify the sleeping workers
+                if not any(self._deques) and not self._closed:
+                    self._condition.wait()
+                self._sleeping -= 1
+            stats[2] += 1
+            stats[3] += time.monotonic() - idle_at
+
+    def _help(self, index: int, future: Future) -> None:
+        """Runs other tasks on worker `index` until `future` is done."""
+        stats = self._stats[index]
+        while not future.done():
+            item = self._next_task(index)
+            if item is None:
+                wait([future], timeout=IDLE_INTERVAL)
+            else:
+                self._execute(item, stats)
+
+    @staticmethod
+    def _execute(item: Tuple[Future, Task, Any, bool], stats: List) -> None:
+        future, task, params, raise_error = item
+        if not future.set_running_or_notify_cancel():
+            return
+        stats[0] += 1
+        try:
+            result = task(params)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            if raise_error and task.state is State.FAILED:
+                future.set_exception(task.error)
+            else:
+                future.set_result(result)
+
+    def _shutdown(self, wait: bool) -> None:
+        self._closed = True
+        with self._condition:
+            self._condition.notify_all()
+        for deque in self._deques:
+            while deque:
+                future = deque.popleft()[0]
+                future.cancel()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+_current_worker = threading.local()
+
+
+class _StealingFuture(Future):
+    def result(self, timeout: float = None) -> Any:
+        worker = getattr(_current_worker, "worker", None)
+        if worker is not None and not self.done():
+            scheduler, index = worker
+            scheduler._help(index, self)
+        return super().result(timeout)
+
+
+class ProcessPoolScheduler(Scheduler):
+    """
+    Runs the task functions in worker processes, shipping them in chunks of
+    `chunk_size` (task, params) pairs to amortise the IPC cost. Only the task
+    function, its params and the context kv store cross the process boundary,
+    so the state transitions and their handlers still fire in this process.
+
+    The outcomes of a chunk are only known once the whole chunk returns, so
+    a `task_timeout` needs a `chunk_size` of 1, its default then, and a task
+    with a timeout of its own is shipped alone. The timeout runs from the
+    moment a worker starts the task. A worker stuck in a task abandoned by
+    its timeout isn't replaced, the pool runs with one worker less until the
+    task returns.
+    """
+
+    def __init__(
+        self,
+        max_workers=None,
+        chunk_size=None,
+        retry_policy: RetryPolicy = None,
+        rate_limit: TokenBucket = None,
+        concurrency: AdaptiveConcurrency = None,
+        task_timeout: float = None,
+    ):
+        if task_timeout is not None and (chunk_size or 1) > 1:
+            raise ValueError(
+                f"Expected a chunk_size of 1 with a task_timeout, got {chunk_size}"
+            )
+        super().__init__(retry_policy, rate_limit, concurrency, task_timeout)
+        self._max_workers = max_workers or DEFAULT_MAX_WORKERS
+        if task_timeout is not None:
+            chunk_size = 1
+        self._chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self._max_in_flight = (
+            self._max_workers * IN_FLIGHT_PER_WORKER * self._chunk_size
+        )
+        self._reorder_buffer_size = self._max_in_flight
+        # (token, time.monotonic()) of the tasks with a timeout workers start
+        self._started = multiprocessing.Queue()
+        self._starting: Dict[int, TaskContext] = {}
+        self._tokens = itertools.count()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._max_workers,
+            initializer=_init_worker,
+            initargs=(self._started,),
+        )
+        self._chunk: List[Tuple[Future, tuple]] = []
+
+    def _submit(self, task: Task, params: Any) -> Future:
+        context = task.context
+        context["args"] = (params,)
+        context["kwargs"] = {}
+        context._advance(State.RUNNING)
+
+        token = None
+        if context.timeout is not None:
+            # the deadline is set once a worker reports the start
+            context.deadline = None
+            token = next(self._tokens)
+            self._starting[token] = context
+            self._flush_chunk()
+
+        future = Future()
+        payload = (token, task._func, (params,), {}, dict(context._kv_store))
+        self._chunk.append((future, payload))
+        if token is not None or len(self._chunk) >= self._chunk_size:
+            self._flush_chunk()
+        return future
+
+    def _flush_chunk(self) -> None:
+        if not self._chunk:
+            return
+        futures, payloads = zip(*self._chunk)
+        self._chunk = []
+        chunk_future = self._pool.submit(_execute_chunk, list(payloads))
+        chunk_future.add_done_callback(functools.partial(_resolve_chunk, futures))
+
+    def _wait(self, handles: Iterable, timeout: Optional[float]) -> Iterable:
+        self._flush_chunk()
+        done, _ = wait(handles, timeout=timeout, return_when=FIRST_COMPLETED)
+        self._record_starts()
+        return done
+
+    def _record_starts(self) -> None:
+        while self._starting:
+            try:
+                token, started_at = self._started.get_nowait()
+            except queue.Empty:
+                return
+            context = self._starting.pop(token, None)
+            if context is not None:
+                context.deadline = started_at + context.timeout
+
+    def _shutdown(self, wait: bool) -> None:
+        for future, _ in self._chunk:
+            future.cancel()
+        self._chunk = []
+        self._starting.clear()
+        self._pool.shutdown(wait=wait)
+
+    def _outcome(self, handle: Future, task: Task) -> Any:
+        result, error, kv_store = handle.result()
+        task.context._kv_store.update(kv_store)
+        if error is None:
+            task._complete(result)
+        else:
+            task._fail(error)
+        return result
+
+
+class AsyncIOScheduler(Scheduler):
+    """
+    Runs the tasks as coroutines on a private event loop driven by the thread
+    consuming `results()`, keeping at most `max_concurrency` of them in flight.
+    Plain functions are called inline on the loop, so this scheduler is meant
+    for `async def` tasks.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=None,
+        ordered=True,
+        retry_policy: RetryPolicy = None,
+        rate_limit: TokenBucket = None,
+        concurrency: AdaptiveConcurrency = None,
+        task_timeout: float = None,
+    ):
+        super().__init__(retry_policy, rate_limit, concurrency, task_timeout)
+        self._max_in_flight = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        self._ordered = ordered
+        self._reorder_buffer_size = self._max_in_flight
+        self._loop = asyncio.new_event_loop()
+
+    def _submit(self, task: Task, params: Any) -> asyncio.Task:
+        return self._loop.create_task(task.run_async(params))
+
+    def _wait(self, handles: Iterable, timeout: Optional[float]) -> Iterable:
+        done, _ = self._loop.run_until_complete(
+            asyncio.wait(handles, timeout=timeout, return_when=FIRST_COMPLETED)
+        )
+        return done
+
+    def _cancel(self, handles: List) -> None:
+        super()._cancel(handles)
+        if handles:
+            self._loop.run_until_complete(
+                asyncio.gather(*handles, return_exceptions=True)
+            )
+
+    def _shutdown(self, wait: bool) -> None:
+        # includes the tasks abandoned by a timeout
+        pending = asyncio.all_tasks(self._loop)
+        self._cancel(list(pending))
+        self._loop.close()
+
+
+_worker_started: Optional[multiprocessing.Queue] = None
+
+
+def _init_worker(started: multiprocessing.Queue) -> None:
+    global _worker_started
+    _worker_started = started
+
+
+def _execute_chunk(
+    payloads: List[Tuple[Optional[int], Callable, tuple, dict, dict]]
+) -> List:
+    outcomes = []
+    for token, *payload in payloads:
+        if token is not None:
+            _worker_started.put((token, time.monotonic()))
+        outcomes.append(execute_detached(*payload))
+    return outcomes
+
+
+def _resolve_chunk(futures: Tuple[Future, ...], chunk_future: Future) -> None:
+    try:
+        outcomes = chunk_future.result()
+    except Exception as e:
+        outcomes = [(None, e, {})] * len(futures)
+    for future, outcome in zip(futures, outcomes):
+        if not future.cancelled():
+            future.set_result(outcome)
 
 
 class SchedulerFactory:
@@ -1,29 +1,325 @@
+import collections
+import copy
 import itertools
-from copy import deepcopy
-from typing import List, Set, Callable, Iterator, Iterable, Union, Generator, Any
+import queue
+import sys
+import threading
+import time
+from types import BuiltinFunctionType, FunctionType
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Set,
+    Callable,
+    Iterator,
+    Iterable,
+    Union,
+    Generator,
+    Any,
+    Hashable,
+    Tuple,
+)
 
+from stream_processor.caching import CachedFunction, DEFAULT_MAX_SIZE
+from stream_processor.checkpoints import (
+    Checkpoint,
+    CheckpointStore,
+    DEFAULT_CHECKPOINT_INTERVAL,
+)
+from stream_processor.exceptions import CheckpointError, DeadlineExceeded
+from stream_processor.profiling import (
+    DEFAULT_SAMPLE_RATE,
+    OperatorProfile,
+    Probe,
+    Profile,
+)
 from stream_processor.schedulers import Scheduler, SerialScheduler
+from stream_processor.tasks import Task, task_factory
+from stream_processor.vectorized import BatchFunction, NUMPY, ScheduledBatches
+from stream_processor.windows import Aggregator, Windower, Windows
+
+if TYPE_CHECKING:
+    from stream_processor.files import BufferedSink
+
+DEFAULT_ITEMS_PER_LANE = 64
+# items a tee branch, or a merged or zipped stream, buffers ahead of its consumer
+DEFAULT_BUFFER_SIZE = 1024
 
 
 class Stream:
+    """
+    Operators build a lazy plan over the source: consecutive serial `map` and
+    `filter` stages are fused into a single loop, `take` is pushed below 1:1
+    maps towards the source and `batch(n).concat()` is folded away.
+    `explain()` shows the resulting plan.
+    """
+
+    _parent: "Stream" = None
+    # items pulled from the source, only counted on checkpointed streams
+    _offset: int = None
+
     def __init__(self, items: Union[Iterator, Iterable, Generator]):
         self._items = iter(items)
 
     def map(self, func: Callable, scheduler: "Scheduler" = None) -> "Stream":
+        if scheduler is None:
+            return _FusedOperator(self, ((_MAP, func),))
         return _MapOperator(func, self, scheduler)
 
+    def cached_map(
+        self,
+        func: Callable,
+        key: Callable[..., Hashable] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: float = None,
+        scheduler: "Scheduler" = None,
+    ) -> "Stream":
+        """
+        Like `map`, but results are memoized by `key(item)` in a bounded LRU
+        cache with an optional `ttl`, and concurrent calls for the same key on
+        the scheduler are coalesced into one. The hit/miss counters are on
+        `.cache.stats` of the returned stream.
+        """
+        cached = CachedFunction(func, key=key, max_size=max_size, ttl=ttl)
+        return _CachedMapOperator(cached, self, scheduler)
+
     def filter(self, func: Callable) -> "Stream":
-        return Stream(item for item in self if deepcopy(func)(item))
+        return _FusedOperator(self, ((_FILTER, func),))
 
     def take(self, count: int) -> "Stream":
-        return Stream(itertools.islice(self, count))
+        return _TakeOperator(self, count)
+
+    def batch(
+        self,
+        count: int,
+        max_latency: float = None,
+        max_weight: float = None,
+        weigher: Callable[[Any], float] = None,
+    ) -> "Stream":
+        """
+        Groups items into lists of up to `count` items. With `max_weight` a
+        batch is also cut before its total weight, measured by `weigher`
+        (bytes by default), would exceed it. With `max_latency` a partial batch
+        is emitted once its first item has waited that many seconds.
+        """
+        return _BatchOperator(count, self, max_latency, max_weight, weigher)
+
+    def map_batches(
+        self,
+        func: Callable,
+        batch_size: int,
+        format: str = NUMPY,
+        scheduler: "Scheduler" = None,
+    ) -> "Stream":
+        """
+        Applies a vectorised `func` to batches of `batch_size` items, assembled
+        as a NumPy array or a dict of column arrays depending on `format`, and
+        flattens the results back into a stream of items. A batch that fails,
+        on a `scheduler` as well, raises its error.
+        """
+        batch_func = BatchFunction(func, format)
+        if scheduler is None:
+            return self.batch(batch_size).map(batch_func).concat()
+        batches = ScheduledBatches(batch_func)
+        results = self.batch(batch_size).map(batches.task, scheduler=scheduler)
+        return results.map(batches.check).concat()
+
+    def parallelize(
+        self,
+        processes: int,
+        batch_size: int = None,
+        slots: int = None,
+        slot_size: int = None,
+    ) -> "Stream":
+        """
+        A boundary after which the serial `map` and `filter` stages run in
+        `processes` worker processes, up to the next boundary. Batches of
+        `batch_size` items move between the processes through shared memory
+        rings of `slots` slots of `slot_size` bytes, see `parallel.run`.
+        The stage functions have to be picklable. Needs Python 3.8 or later.
+        """
+        # imported here, as shared memory only exists since Python 3.8
+        from stream_processor import parallel
 
-    def batch(self, count: int) -> "Stream":
-        return _BatchOperator(count, self)
+        return _ParallelOperator(
+            self,
+            processes,
+            batch_size or parallel.DEFAULT_BATCH_SIZE,
+            slots or parallel.DEFAULT_SLOTS,
+            slot_size or parallel.DEFAULT_SLOT_SIZE,
+            (),
+        )
+
+    def partition_by(
+        self, key_fn: Callable[[Any], Hashable], partitions: int
+    ) -> "PartitionedStream":
+        return PartitionedStream(self, key_fn, partitions)
+
+    def window(
+        self,
+        windows: Windows,
+        aggregator: Aggregator,
+        key: Callable[[Any], Hashable] = None,
+        value: Callable[[Any], Any] = None,
+        timestamp: Callable[[Any], float] = None,
+        allowed_lateness: float = 0,
+    ) -> "Stream":
+        """
+        Aggregates `value(item)` per `key(item)` over tumbling, sliding or
+        session `windows`, emitting a WindowResult per window once it closes.
+        Windows are on event time when `timestamp` is given, closing as later
+        timestamps arrive, and on processing time otherwise, closing on the
+        clock even while the parent is idle.
+        """
+        return _WindowOperator(
+            self, windows, aggregator, key, value, timestamp, allowed_lateness
+        )
+
+    def aggregate(self, aggregator: Aggregator, value: Callable = None) -> Any:
+        state = aggregator.create()
+        for item in self:
+            state = aggregator.add(state, value(item) if value else item)
+        return aggregator.result(state)
 
     def concat(self) -> "Stream":
         return _ConcatOperator(self)
 
+    def tee(
+        self, branches: int = 2, buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> List["Stream"]:
+        """
+        Splits the stream into `branches` streams of the same items, sharing a
+        single pass over it. A branch buffers up to `buffer_size` items the
+        other branches have pulled and it hasn't, so branches ahead of it wait
+        for it: the branches have to be consumed concurrently, e.g. on threads.
+        A branch no longer holds the others back once its iteration closes.
+        """
+        hub = _Tee(self, branches, buffer_size)
+        return [_TeeBranch(self, hub, index) for index in range(branches)]
+
+    def broadcast(
+        self,
+        *consumers: Callable[["Stream"], Any],
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> List[Any]:
+        """
+        Calls every consumer with a `tee` branch of the stream on a thread of
+        its own, e.g. `lambda branch: branch.sink(sink)`, and returns their
+        results. The first error of a consumer, or of the stream, is raised.
+        """
+        branches = self.tee(len(consumers), buffer_size)
+        results, errors = [None] * len(consumers), []
+
+        def consume(index: int) -> None:
+            try:
+                results[index] = consumers[index](branches[index])
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                branches[index].close()
+
+        threads = [
+            threading.Thread(target=consume, args=(index,), daemon=True)
+            for index in range(len(consumers))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def merge(
+        self, *others: Iterable, buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> "Stream":
+        """
+        The items of this stream and `others` in the order they arrive, each
+        stream consumed by a thread of its own which reads up to `buffer_size`
+        items ahead of the consumer, shared by all of them.
+        """
+        return _MergeOperator(
+            self, [_as_stream(other) for other in others], buffer_size
+        )
+
+    def zip(
+        self, *others: Iterable, buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> "Stream":
+        """
+        Tuples of an item of this stream and of each of `others`, until one of
+        them ends. Every stream is consumed by a thread of its own which reads
+        up to `buffer_size` items ahead of the consumer.
+        """
+        return _ZipOperator(self, [_as_stream(other) for other in others], buffer_size)
+
+    def checkpoint(
+        self,
+        store: CheckpointStore,
+        name: str,
+        interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+        max_interval: float = None,
+    ) -> "Stream":
+        """
+        Commits the source offset and the state of every operator to `store`
+        after each `interval` items consumed from the stream, or `max_interval`
+        seconds, and once the stream is exhausted. A stream built with the same
+        plan and `name` resumes from the last commit: the source skips the
+        committed offset and buffered items are restored. Items consumed after
+        the last commit are emitted again, so processing is at least once.
+
+        Operators reading ahead on a thread (`max_latency` batches, processing
+        time windows) and unordered schedulers can't be checkpointed.
+        """
+        return _CheckpointOperator(self, store, name, interval, max_interval)
+
+    def deadline(self, seconds: float) -> "Stream":
+        """
+        Raises DeadlineExceeded once the stream has been iterated for `seconds`.
+        Scheduled maps of the stream terminate their tasks at the deadline,
+        rather than waiting for them.
+        """
+        return _DeadlineOperator(self, seconds)
+
+    def profile(self, sample_rate: float = DEFAULT_SAMPLE_RATE) -> "Stream":
+        """
+        Counts the items in and out of every operator of the stream and times
+        them, a `sample_rate` share of the items only to keep the overhead
+        low. `report()` of the returned stream gives the profile so far.
+        """
+        return _ProfileOperator(self, sample_rate)
+
+    def sink(self, sink: "BufferedSink") -> int:
+        """
+        Writes every item to `sink`, closes it and returns the number of items
+        written. Checkpoints of the stream flush the sink before committing.
+        """
+        node = self
+        while node is not None:
+            if isinstance(node, _CheckpointOperator):
+                node.before_commit.append(sink.flush)
+            node = node._parent
+
+        count = 0
+        try:
+            for item in self:
+                sink.write(item)
+                count += 1
+        finally:
+            sink.close()
+        return count
+
+    def explain(self) -> str:
+        """
+        Describes the optimised plan, one operator per line from the last one
+        down to the source.
+        """
+        lines, node = [], self
+        while node is not None:
+            if not isinstance(node, _Probe):
+                lines.append("  " * len(lines) + node._describe())
+            node = node._parent
+        return "\n".join(lines)
+
     def list(self) -> List:
         return list(self)
 
@@ -36,51 +332,1084 @@ class Stream:
     def __next__(self) -> Any:
         return next(self.__iter__())
 
+    def _describe(self) -> str:
+        return f"Source({type(self._items).__name__})"
+
+    def _hands_off(self) -> bool:
+        """Whether the work of the operator is done off the consuming thread."""
+        return False
+
+    def _snapshot(self) -> Any:
+        return self._offset
+
+    def _restore(self, state: Any) -> None:
+        self._offset = state or 0
+        self._items = self._counted(itertools.islice(self._items, self._offset, None))
+
+    def _counted(self, items: Iterator) -> Iterator:
+        for item in items:
+            self._offset += 1
+            yield item
+
+
+class PartitionedStream:
+    """
+    Routes items to one of `partitions` lanes by the hash of `key_fn(item)`.
+    A lane runs its items one after another, so items sharing a key are
+    processed in order, while different lanes run in parallel on the scheduler.
+
+    The parent is consumed in windows of `window` items, each lane of a window
+    being a single task; the window's results are emitted in input order before
+    the next window is scheduled. `counts` and `skew()` tell how evenly the
+    items were spread over the lanes.
+    """
+
+    def __init__(
+        self,
+        parent: Stream,
+        key_fn: Callable[[Any], Hashable],
+        partitions: int,
+        window: int = None,
+    ) -> None:
+        self._parent = parent
+        self._key_fn = key_fn
+        self._partitions = partitions
+        self._window = window or partitions * DEFAULT_ITEMS_PER_LANE
+        self.counts = [0] * partitions
+
+    def map(self, func: Callable, scheduler: "Scheduler" = None) -> Stream:
+        return _PartitionedMapOperator(self, func, scheduler or SerialScheduler())
+
+    def skew(self) -> float:
+        """
+        Ratio of the busiest lane's item count to the mean, 1.0 when balanced.
+        """
+        total = sum(self.counts)
+        if not total:
+            return 1.0
+        return max(self.counts) / (total / self._partitions)
+
+    def _map(
+        self,
+        lane_func: "_LaneFunction",
+        scheduler: "Scheduler",
+        items: Iterator = None,
+        pending: collections.deque = None,
+        expires_at: float = None,
+    ) -> Iterator:
+        items = iter(self._parent) if items is None else items
+        while True:
+            window = list(itertools.islice(items, self._window))
+            if not window:
+                return
+            if pending is not None:
+                pending.extend(window)
+
+            lanes = {}
+            for position, item in enumerate(window):
+                lane = hash(self._key_fn(item)) % self._partitions
+                self.counts[lane] += 1
+                lanes.setdefault(lane, []).append(position)
+
+            # lanes are tagged, as the scheduler may finish them in any order
+            lane_items = [
+                (lane, [window[p] for p in positions])
+                for lane, positions in lanes.items()
+            ]
+            results = [None] * len(window)
+            lane_results = _scheduled_map(scheduler, lane_func, lane_items, expires_at)
+            for lane_result in lane_results:
+                # a lane whose task failed leaves its items' results None
+                if lane_result is None:
+                    continue
+                lane, values = lane_result
+                for position, result in zip(lanes[lane], values):
+                    results[position] = result
+            if pending is None:
+                yield from results
+                continue
+            for result in results:
+                pending.popleft()
+                yield result
+
+
+class _LaneFunction:
+    def __init__(self, func: Callable) -> None:
+        self._func = func
+
+    def __call__(self, lane_items: Tuple[int, List]) -> Tuple[int, List]:
+        lane, items = lane_items
+        return lane, list(SerialScheduler().map(self._func, items))
+
+    def __deepcopy__(self, memo) -> "_LaneFunction":
+        # Stateless, the per item isolation is left to the SerialScheduler
+        return self
+
+
+class _Operator(Stream):
+    """
+    Operators only iterate their parent once they are iterated themselves.
+    `_snapshot` returns the operator's state between two items leaving the
+    stream, which `_restore` sets before a checkpointed stream is iterated.
+    """
 
-class _ConcatOperator(Stream):
     def __init__(self, parent: "Stream") -> None:
+        self._parent = parent
+
+    def _snapshot(self) -> Any:
+        return None
+
+    def _restore(self, state: Any) -> None:
+        pass
+
+
+class _CheckpointOperator(_Operator):
+    def __init__(
+        self,
+        parent: "Stream",
+        store: CheckpointStore,
+        name: str,
+        interval: int,
+        max_interval: float,
+    ) -> None:
+        super().__init__(parent)
+        self._store = store
+        self._name = name
+        self._interval = interval
+        self._max_interval = max_interval
+        self._results = None
+        # called before every commit, e.g. to flush a sink
+        self.before_commit: List[Callable[[], None]] = []
+
+    def __iter__(self):
+        if self._results is None:
+            self._results = self._checkpointed()
+        return self._results
+
+    def _describe(self) -> str:
+        return f"Checkpoint({self._name})"
+
+    def _checkpointed(self) -> Iterator:
+        plan, nodes = self._parent.explain(), []
+        node = self._parent
+        while node is not None:
+            if not isinstance(node, _Probe):
+                nodes.append(node)
+            node = node._parent
+
+        checkpoint = self._store.load(self._name)
+        if checkpoint is not None and checkpoint.plan != plan:
+            raise CheckpointError(
+                f"The plan of {self._name} changed since its last checkpoint:\n"
+                f"{checkpoint.plan}"
+            )
+        states = checkpoint.states if checkpoint else [None] * len(nodes)
+        for node, state in zip(nodes, states):
+            node._restore(state)
+
+        # Items are committed once the consumer asks for the next one
+        consumed, committed_at = 0, time.monotonic()
+        for item in self._parent:
+            yield item
+            consumed += 1
+            if (self._interval and consumed >= self._interval) or (
+                self._max_interval
+                and time.monotonic() - committed_at >= self._max_interval
+            ):
+                self._commit(plan, nodes)
+                consumed, committed_at = 0, time.monotonic()
+        self._commit(plan, nodes)
+
+    def _commit(self, plan: str, nodes: List[Stream]) -> None:
+        for func in self.before_commit:
+            func()
+        states = [node._snapshot() for node in nodes]
+        self._store.commit(self._name, Checkpoint(plan, states, time.time()))
+
+
+class _DeadlineOperator(_Operator):
+    def __init__(self, parent: "Stream", seconds: float) -> None:
         super().__init__(parent)
+        self._seconds = seconds
+        self._results = None
+
+    def __iter__(self):
+        if self._results is None:
+            expires_at = time.monotonic() + self._seconds
+            node = self._parent
+            while node is not None:
+                if isinstance(node, (_MapOperator, _PartitionedMapOperator)):
+                    node._expires_at = expires_at
+                node = node._parent
+            self._results = self._bounded(expires_at)
+        return self._results
+
+    def _describe(self) -> str:
+        return f"Deadline({self._seconds})"
+
+    def _bounded(self, expires_at: float) -> Iterator:
+        for item in self._parent:
+            if time.monotonic() >= expires_at:
+                raise DeadlineExceeded(f"Stream exceeded its {self._seconds}s deadline")
+            yield item
+
+
+class _Tee:
+    """
+    The single pass over `parent` shared by the branches of a tee. A branch
+    with nothing buffered pulls the next item itself and appends it to the
+    buffers of the other branches still attached, once none of them is full.
+    """
+
+    def __init__(self, parent: "Stream", branches: int, buffer_size: int) -> None:
         self._parent = parent
+        self._items = None
+        self._buffer_size = buffer_size
+        self._buffers = [collections.deque() for _ in range(branches)]
+        self._attached = set(range(branches))
+        self._condition = threading.Condition()
+        self._waiting = 0
+        self._pulling = False
+        # the end of the parent, _END or the error it raised
+        self._end = None
+
+    def next(self, branch: int) -> Any:
+        """Returns the next item of `branch`, or _END."""
+        buffer = self._buffers[branch]
+        with self._condition:
+            while True:
+                if buffer:
+                    item = buffer.popleft()
+                    if self._waiting:
+                        self._condition.notify_all()
+                    return item
+                if self._end is _END:
+                    return _END
+                if self._end is not None:
+                    raise self._end
+                if not self._pulling and all(
+                    len(self._buffers[other]) < self._buffer_size
+                    for other in self._attached
+                ):
+                    break
+                self._waiting += 1
+                self._condition.wait()
+                self._waiting -= 1
+            self._pulling = True
+
+        # Pulled without the lock, so the other branches drain meanwhile
+        end = None
+        try:
+            if self._items is None:
+                self._items = iter(self._parent)
+            item = next(self._items)
+        except StopIteration:
+            end = _END
+        except Exception as e:
+            end = e
+
+        with self._condition:
+            self._pulling = False
+            if end is None:
+                for other in self._attached:
+                    if other != branch:
+                        self._buffers[other].append(item)
+            else:
+                self._end = end
+            if self._waiting:
+                self._condition.notify_all()
+        if isinstance(end, Exception):
+            raise end
+        return item if end is None else _END
+
+    def detach(self, branch: int) -> None:
+        with self._condition:
+            self._attached.discard(branch)
+            self._buffers[branch].clear()
+            self._condition.notify_all()
+
+
+class _TeeBranch(_Operator):
+    def __init__(self, parent: "Stream", hub: _Tee, index: int) -> None:
+        super().__init__(parent)
+        self._hub = hub
+        self._index = index
+        self._results = None
+
+    def __iter__(self):
+        if self._results is None:
+            self._results = self._branch()
+        return self._results
+
+    def close(self) -> None:
+        """Stops the branch from holding back the others."""
+        if self._results is not None:
+            self._results.close()
+        self._hub.detach(self._index)
+
+    def _branch(self) -> Iterator:
+        try:
+            while True:
+                item = self._hub.next(self._index)
+                if item is _END:
+                    return
+                yield item
+        finally:
+            self._hub.detach(self._index)
+
+    def _describe(self) -> str:
+        return f"Tee({self._index + 1}/{len(self._hub._buffers)})"
+
+    def _hands_off(self) -> bool:
+        return True
+
+    def _restore(self, state: Any) -> None:
+        raise CheckpointError("Tee branches can't be checkpointed")
+
+
+class _MergeOperator(_Operator):
+    def __init__(
+        self, parent: "Stream", others: List["Stream"], buffer_size: int
+    ) -> None:
+        super().__init__(parent)
+        self._others = others
+        self._buffer_size = buffer_size
+        self._results = None
+
+    def __iter__(self):
+        if self._results is None:
+            self._results = self._merged()
+        return self._results
+
+    def _merged(self) -> Iterator:
+        streams = [self._parent, *self._others]
+        items = queue.Queue(maxsize=self._buffer_size)
+        stopped = threading.Event()
+        for stream in streams:
+            threading.Thread(
+                target=_read_ahead, args=(stream, items, stopped), daemon=True
+            ).start()
+
+        try:
+            running = len(streams)
+            while running:
+                kind, item = items.get()
+                if kind is _ITEM:
+                    yield item
+                elif kind is _END:
+                    running -= 1
+                else:
+                    raise item
+        finally:
+            stopped.set()
 
-    def take(self, count: int) -> Iterator:
-        return Stream(itertools.islice(self, count))
+    def _describe(self) -> str:
+        return f"Merge({1 + len(self._others)} streams)"
+
+    def _hands_off(self) -> bool:
+        return True
+
+    def _restore(self, state: Any) -> None:
+        raise CheckpointError("Merged streams can't be checkpointed")
+
+
+class _ZipOperator(_MergeOperator):
+    def __iter__(self):
+        if self._results is None:
+            self._results = self._zipped()
+        return self._results
+
+    def _zipped(self) -> Iterator:
+        streams = [self._parent, *self._others]
+        queues = [queue.Queue(maxsize=self._buffer_size) for _ in streams]
+        stopped = threading.Event()
+        for stream, items in zip(streams, queues):
+            threading.Thread(
+                target=_read_ahead, args=(stream, items, stopped), daemon=True
+            ).start()
+
+        try:
+            while True:
+                row = []
+                for items in queues:
+                    kind, item = items.get()
+                    if kind is _END:
+                        return
+                    if kind is _ERROR:
+                        raise item
+                    row.append(item)
+                yield tuple(row)
+        finally:
+            stopped.set()
+
+    def _describe(self) -> str:
+        return f"Zip({1 + len(self._others)} streams)"
+
+    def _restore(self, state: Any) -> None:
+        raise CheckpointError("Zipped streams can't be checkpointed")
+
+
+def _as_stream(items: Iterable) -> "Stream":
+    return items if isinstance(items, Stream) else Stream(items)
+
+
+class _ProfileOperator(_Operator):
+    def __init__(self, parent: "Stream", sample_rate: float) -> None:
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"Expected 0 < sample_rate <= 1, got {sample_rate}")
+        super().__init__(parent)
+        self._sample_rate = sample_rate
+        self._results = None
+        # the profiled operators from the last one down, with the probes
+        # timing the pulls from them
+        self._probes: List[Tuple[Stream, Probe]] = []
+
+    def __iter__(self):
+        if self._results is None:
+            consumer = self
+            while consumer._parent is not None:
+                node = consumer._parent
+                probe = Probe(self._sample_rate)
+                consumer._parent = _Probe(node, probe)
+                self._probes.append((node, probe))
+                consumer = node
+            self._results = iter(self._parent)
+        return self._results
+
+    def report(self) -> Profile:
+        operators = []
+        probes = self._probes + [(None, None)]
+        for (node, probe), (_, upstream) in zip(probes, probes[1:]):
+            wall, cpu = probe.wall, probe.cpu
+            if upstream is None:
+                upstream_wall = 0.0
+            else:
+                upstream_wall = upstream.wall
+                # pulled on the same thread, the upstream time is part of it
+                if not upstream.threads - probe.threads:
+                    wall = max(wall - upstream_wall, 0.0)
+                    cpu = max(cpu - upstream.cpu, 0.0)
+            queue_wait = max(wall - cpu, 0.0) if node._hands_off() else 0.0
+            operators.append(
+                OperatorProfile(
+                    node._describe(),
+                    None if upstream is None else upstream.items,
+                    probe.items,
+                    wall,
+                    cpu,
+                    upstream_wall,
+                    queue_wait,
+                )
+            )
+        return Profile(operators[::-1])
+
+    def _describe(self) -> str:
+        return f"Profile(sample_rate={self._sample_rate})"
+
+
+class _Probe(_Operator):
+    """Times the pulls from its parent, left out of the plan."""
+
+    def __init__(self, parent: "Stream", probe: Probe) -> None:
+        super().__init__(parent)
+        self._probe = probe
+
+    def __iter__(self):
+        return self._probe.wrap(iter(self._parent))
+
+    def _describe(self) -> str:
+        return self._parent._describe()
+
+
+class _PartitionedMapOperator(_Operator):
+    def __init__(
+        self, partitioned: PartitionedStream, func: Callable, scheduler: "Scheduler"
+    ) -> None:
+        super().__init__(partitioned._parent)
+        self._partitioned = partitioned
+        self._func = func
+        self._scheduler = scheduler
+        self._results = None
+        # items pulled from the parent whose results weren't emitted yet
+        self._pending = None
+        # time.monotonic() of the deadline of the stream, if any
+        self._expires_at = None
 
     def __iter__(self):
+        if self._results is None:
+            lane_func = _LaneFunction(self._func)
+            items, pending = iter(self._parent), self._pending
+            if pending is not None:
+                restored = list(pending)
+                pending.clear()
+                items = itertools.chain(restored, self._parent)
+            self._results = self._partitioned._map(
+                lane_func, self._scheduler, items, pending, self._expires_at
+            )
+        return self._results
+
+    def _snapshot(self) -> Any:
+        return list(self._pending)
+
+    def _restore(self, state: Any) -> None:
+        self._pending = collections.deque(state or ())
+
+    def _hands_off(self) -> bool:
+        return True
+
+    def _describe(self) -> str:
+        return (
+            f"PartitionedMap({_name(self._func)}, "
+            f"partitions={self._partitioned._partitions}, "
+            f"scheduler={type(self._scheduler).__name__})"
+        )
+
+
+class _TakeOperator(_Operator):
+    def __init__(self, parent: "Stream", count: int) -> None:
+        super().__init__(parent)
+        self._count = count
+        self._results = None
+        self._taken = None
+
+    def __iter__(self):
+        if self._results is None:
+            if self._taken is None:
+                self._results = itertools.islice(self._parent, self._count)
+            else:
+                self._results = self._counted_take()
+        return self._results
+
+    def _counted_take(self) -> Iterator:
+        for item in itertools.islice(self._parent, self._count - self._taken):
+            self._taken += 1
+            yield item
+
+    def _describe(self) -> str:
+        return f"Take({self._count})"
+
+    def _snapshot(self) -> Any:
+        return self._taken
+
+    def _restore(self, state: Any) -> None:
+        self._taken = state or 0
+
+
+_MAP, _FILTER = "map", "filter"
+
+Stage = Tuple[str, Callable]
+
+
+class _FusedOperator(_Operator):
+    """
+    Consecutive serial map and filter stages, run by a single loop generated
+    for the stages rather than a generator per stage.
+    """
+
+    def __init__(self, parent: "Stream", stages: Tuple[Stage, ...]) -> None:
+        super().__init__(parent)
+        self._stages = stages
+        self._results = None
+
+    def map(self, func: Callable, scheduler: "Scheduler" = None) -> "Stream":
+        if scheduler is None and self._results is None:
+            return _FusedOperator(self._parent, self._stages + ((_MAP, func),))
+        return super().map(func, scheduler)
+
+    def filter(self, func: Callable) -> "Stream":
+        if self._results is None:
+            return _FusedOperator(self._parent, self._stages + ((_FILTER, func),))
+        return super().filter(func)
+
+    def take(self, count: int) -> "Stream":
+        # Maps are 1:1, so the limit can be applied before them
+        if self._results is None and all(kind == _MAP for kind, _ in self._stages):
+            return _FusedOperator(self._parent.take(count), self._stages)
+        return super().take(count)
+
+    def __iter__(self):
+        if self._results is None:
+            self._results = _compile(self._stages)(self._parent)
+        return self._results
+
+    def _describe(self) -> str:
+        stages = " -> ".join(f"{kind}({_name(func)})" for kind, func in self._stages)
+        return f"Fused({stages})"
+
+
+def _compile(stages: Tuple[Stage, ...]) -> Callable[[Iterable], Iterator]:
+    lines = ["def fused(items):", "    for item in items:"]
+    namespace = {}
+    for position, (kind, func) in enumerate(stages):
+        name = f"func_{position}"
+        if isinstance(func, (FunctionType, BuiltinFunctionType)):
+            namespace[name] = func
+            call = f"{name}(item)"
+        else:
+            # Tasks and callable objects get an isolated instance per item
+            namespace[name] = task_factory(func)
+            call = f"{name}()(item)"
+
+        if kind == _MAP:
+            lines.append(f"        item = {call}")
+        else:
+            lines.append(f"        if not {call}:")
+            lines.append("            continue")
+    lines.append("        yield item")
+
+    exec("\n".join(lines), namespace)
+    return namespace["fused"]
+
+
+def _name(func: Callable) -> str:
+    if isinstance(func, Task):
+        return func.context.task_name or "Task"
+    return getattr(func, "__name__", type(func).__name__)
+
+
+def _scheduled_map(
+    scheduler: "Scheduler", func: Callable, items: Iterable, expires_at: float
+) -> Iterator:
+    if expires_at is None:
+        return scheduler.map(func, items)
+    deadline = max(expires_at - time.monotonic(), 0)
+    return scheduler.map(func, items, deadline=deadline)
+
+
+class _ParallelOperator(_Operator):
+    def __init__(
+        self,
+        parent: "Stream",
+        processes: int,
+        batch_size: int,
+        slots: int,
+        slot_size: int,
+        stages: Tuple[Stage, ...],
+    ) -> None:
+        super().__init__(parent)
+        self._processes = processes
+        self._options = (batch_size, slots, slot_size)
+        self._stages = stages
+        self._results = None
+
+    def map(self, func: Callable, scheduler: "Scheduler" = None) -> "Stream":
+        if scheduler is None and self._results is None:
+            return self._with_stage(_MAP, func)
+        return super().map(func, scheduler)
+
+    def filter(self, func: Callable) -> "Stream":
+        if self._results is None:
+            return self._with_stage(_FILTER, func)
+        return super().filter(func)
+
+    def __iter__(self):
+        if self._results is None:
+            from stream_processor import parallel
+
+            self._results = parallel.run(
+                _Stages(self._stages), self._parent, self._processes, *self._options
+            )
+        return self._results
+
+    def _with_stage(self, kind: str, func: Callable) -> "_ParallelOperator":
+        stages = self._stages + ((kind, func),)
+        return _ParallelOperator(
+            self._parent, self._processes, *self._options, stages=stages
+        )
+
+    def _describe(self) -> str:
+        stages = " -> ".join(f"{kind}({_name(func)})" for kind, func in self._stages)
+        return f"Parallel({stages}, processes={self._processes})"
+
+    def _hands_off(self) -> bool:
+        return True
+
+    def _restore(self, state: Any) -> None:
+        raise CheckpointError("Parallel stages can't be checkpointed")
+
+
+class _Stages:
+    """Fused stages to run in another process, compiled once they get there."""
+
+    def __init__(self, stages: Tuple[Stage, ...]) -> None:
+        self._stages = stages
+        self._fused = None
+
+    def __call__(self, items: Iterable) -> Iterator:
+        if self._fused is None:
+            self._fused = _compile(self._stages)
+        return self._fused(items)
+
+    def __getstate__(self) -> Tuple[Stage, ...]:
+        return self._stages
+
+    def __setstate__(self, stages: Tuple[Stage, ...]) -> None:
+        self._stages = stages
+        self._fused = None
+
+
+class _ConcatOperator(_Operator):
+    def __init__(self, parent: "Stream") -> None:
+        super().__init__(parent)
+        # the rest of the sub iterable being flattened, once checkpointed
+        self._current = None
+
+    def __iter__(self):
+        if self._current is not None:
+            return self._tracked_concat()
+        return self._concat()
+
+    def _concat(self) -> Iterator:
         for itr in self._parent:
             for sub_itr in itr:
                 yield sub_itr
 
+    def _tracked_concat(self) -> Iterator:
+        current = self._current
+        while current:
+            yield current.popleft()
+        for itr in self._parent:
+            self._current = current = collections.deque(itr)
+            while current:
+                yield current.popleft()
+
+    def _describe(self) -> str:
+        return "Concat"
+
+    def _snapshot(self) -> Any:
+        return list(self._current)
+
+    def _restore(self, state: Any) -> None:
+        self._current = collections.deque(state or ())
+
+
+class _MapOperator(_Operator):
+    _label = "Map"
 
-class _MapOperator(Stream):
     def __init__(
         self, func: Callable, parent: "Stream", scheduler: "Scheduler"
     ) -> None:
         super().__init__(parent)
-        self._parent = parent
-        self._scheduler = scheduler or SerialScheduler()
+        self._scheduler = scheduler
         self._func = func
+        self._results = None
+        # items submitted to the scheduler whose results weren't emitted yet
+        self._pending = None
+        # time.monotonic() of the deadline of the stream, if any
+        self._expires_at = None
 
     def take(self, count) -> "Stream":
-        for item in self._parent.take(count):
-            self._scheduler.add_task(deepcopy(self._func), item)
-        return Stream(self._scheduler.results())
+        # Once iterated, the items read ahead by the scheduler come first
+        if self._results is None:
+            return type(self)(self._func, self._parent.take(count), self._scheduler)
+        return super().take(count)
+
+    def _describe(self) -> str:
+        scheduler = type(self._scheduler).__name__ if self._scheduler else None
+        return f"{self._label}({_name(self._func)}, scheduler={scheduler})"
+
+    def _hands_off(self) -> bool:
+        return self._scheduler is not None
 
     def __iter__(self):
-        return (deepcopy(self._func)(task) for task in self._parent)
+        # The scheduler reads ahead of the consumer, so the pipeline has to be
+        # built once, or the read ahead items would be lost between iterators.
+        if self._results is None:
+            if self._scheduler is None:
+                new_func = task_factory(self._func)
+                self._results = (new_func()(item) for item in self._parent)
+            elif self._pending is not None:
+                self._results = self._tracked_map()
+            else:
+                self._results = self._scheduled(self._parent)
+        return self._results
+
+    def _tracked_map(self) -> Iterator:
+        pending = self._pending
+        restored = list(pending)
+        pending.clear()
+
+        def inputs():
+            for item in itertools.chain(restored, self._parent):
+                pending.append(item)
+                yield item
+
+        # Ordered results line up with the pending items
+        for result in self._scheduled(inputs()):
+            pending.popleft()
+            yield result
+
+    def _scheduled(self, items: Iterable) -> Iterator:
+        return _scheduled_map(self._scheduler, self._func, items, self._expires_at)
+
+    def _snapshot(self) -> Any:
+        return None if self._pending is None else list(self._pending)
+
+    def _restore(self, state: Any) -> None:
+        if self._scheduler is None:
+            return
+        if not self._scheduler._ordered:
+            raise CheckpointError("Unordered schedulers can't be checkpointed")
+        self._pending = collections.deque(state or ())
 
 
-class _BatchOperator(Stream):
-    def __init__(self, count: int, parent: "Stream") -> None:
+class _CachedMapOperator(_MapOperator):
+    _label = "CachedMap"
+
+    def __init__(
+        self, func: CachedFunction, parent: "Stream", scheduler: "Scheduler"
+    ) -> None:
+        super().__init__(func, parent, scheduler)
+        self.cache = func
+
+
+class _BatchOperator(_Operator):
+    def __init__(
+        self,
+        count: int,
+        parent: "Stream",
+        max_latency: float = None,
+        max_weight: float = None,
+        weigher: Callable[[Any], float] = None,
+    ) -> None:
         super().__init__(parent)
         self._count = count
-        self._parent = parent
+        self._max_latency = max_latency
+        self._max_weight = max_weight
+        self._weigher = weigher or _byte_size
+        self._timed_batches = None
+        # the batch being filled and the full batches which weren't emitted
+        self._batch, self._weight = [], 0
+        self._ready = collections.deque()
 
-    def take(self, count: int) -> "Stream":
-        return Stream(itertools.islice(self, count))
+    def concat(self) -> "Stream":
+        # Flattening the batches gives back the parent's items
+        if self._timed_batches is None:
+            return self._parent
+        return super().concat()
+
+    def _describe(self) -> str:
+        options = "".join(
+            f", {name}={value}"
+            for name, value in (
+                ("max_latency", self._max_latency),
+                ("max_weight", self._max_weight),
+            )
+            if value is not None
+        )
+        return f"Batch({self._count}{options})"
+
+    def _hands_off(self) -> bool:
+        return self._max_latency is not None
 
     def __iter__(self):
+        if self._max_latency is not None:
+            # The read ahead thread owns the parent, so it is only started once.
+            if self._timed_batches is None:
+                self._timed_batches = self._batches_with_latency()
+            return self._timed_batches
+        if self._max_weight is not None:
+            return self._batches(iter(self._parent))
+        return self._counted_batches()
+
+    def _counted_batches(self):
+        items = iter(self._parent)
         while True:
-            batch = self._parent.take(self._count).list()
+            batch = list(itertools.islice(items, self._count))
             if not batch:
                 return
             yield batch
+
+    def _batches(self, items: Iterator):
+        ready = self._ready
+        while ready:
+            yield ready.popleft()
+        for item in items:
+            self._add(item)
+            while ready:
+                yield ready.popleft()
+        if self._batch:
+            batch, self._batch, self._weight = self._batch, [], 0
+            yield batch
+
+    def _add(self, item: Any) -> None:
+        if self._max_weight is not None:
+            item_weight = self._weigher(item)
+            if self._batch and self._weight + item_weight > self._max_weight:
+                self._ready.append(self._batch)
+                self._batch, self._weight = [], 0
+            self._weight += item_weight
+
+        self._batch.append(item)
+        if len(self._batch) >= self._count or (
+            self._max_weight is not None and self._weight >= self._max_weight
+        ):
+            self._ready.append(self._batch)
+            self._batch, self._weight = [], 0
+
+    def _snapshot(self) -> Any:
+        return self._batch, self._weight, list(self._ready)
+
+    def _restore(self, state: Any) -> None:
+        if self._max_latency is not None:
+            raise CheckpointError("Batches with a max_latency can't be checkpointed")
+        if state is not None:
+            batch, self._weight, ready = state
+            self._batch, self._ready = batch, collections.deque(ready)
+
+    def _batches_with_latency(self):
+        items = queue.Queue(maxsize=self._count)
+        stopped = threading.Event()
+        reader = threading.Thread(
+            target=_read_ahead, args=(self._parent, items, stopped), daemon=True
+        )
+        reader.start()
+
+        deadline = None
+        try:
+            while True:
+                timeout = (
+                    None if not self._batch else max(deadline - time.monotonic(), 0)
+                )
+                try:
+                    kind, item = items.get(timeout=timeout)
+                except queue.Empty:
+                    batch, self._batch, self._weight = self._batch, [], 0
+                    yield batch
+                    continue
+
+                if kind is _ERROR:
+                    raise item
+                if kind is _END:
+                    if self._batch:
+                        yield self._batch
+                    return
+
+                self._add(item)
+                while self._ready:
+                    yield self._ready.popleft()
+                if len(self._batch) == 1:
+                    deadline = time.monotonic() + self._max_latency
+        finally:
+            stopped.set()
+
+
+class _WindowOperator(_Operator):
+    def __init__(
+        self,
+        parent: "Stream",
+        windows: Windows,
+        aggregator: Aggregator,
+        key: Callable[[Any], Hashable],
+        value: Callable[[Any], Any],
+        timestamp: Callable[[Any], float],
+        allowed_lateness: float,
+    ) -> None:
+        super().__init__(parent)
+        self._windows = windows
+        self._timestamp = timestamp
+        # The window state is per stream, so a Windows instance can be reused
+        self._windower = Windower(
+            copy.deepcopy(windows), aggregator, key, value, allowed_lateness
+        )
+        self._results = None
+        # closed windows which weren't emitted yet
+        self._ready = collections.deque()
+
+    @property
+    def late(self) -> int:
+        return self._windower.late
+
+    def _describe(self) -> str:
+        clock = "processing" if self._timestamp is None else "event"
+        return f"Window({type(self._windows).__name__}, {clock} time)"
+
+    def _hands_off(self) -> bool:
+        return self._timestamp is None
+
+    def __iter__(self):
+        if self._results is None:
+            if self._timestamp is None:
+                self._results = self._processing_time_windows()
+            else:
+                self._results = self._event_time_windows()
+        return self._results
+
+    def _snapshot(self) -> Any:
+        return self._windower.snapshot(), list(self._ready)
+
+    def _restore(self, state: Any) -> None:
+        if self._timestamp is None:
+            raise CheckpointError("Processing time windows can't be checkpointed")
+        if state is not None:
+            windower, ready = state
+            self._windower.restore(windower)
+            self._ready = collections.deque(ready)
+
+    def _event_time_windows(self):
+        ready = self._ready
+        while ready:
+            yield ready.popleft()
+        for item in self._parent:
+            ready.extend(self._windower.add(item, self._timestamp(item)))
+            while ready:
+                yield ready.popleft()
+        ready.extend(self._windower.flush())
+        while ready:
+            yield ready.popleft()
+
+    def _processing_time_windows(self):
+        items = queue.Queue(maxsize=DEFAULT_ITEMS_PER_LANE)
+        stopped = threading.Event()
+        reader = threading.Thread(
+            target=_read_ahead, args=(self._parent, items, stopped), daemon=True
+        )
+        reader.start()
+
+        try:
+            while True:
+                next_end = self._windower.next_end()
+                timeout = None if next_end is None else max(next_end - time.time(), 0)
+                try:
+                    kind, item = items.get(timeout=timeout)
+                except queue.Empty:
+                    yield from self._windower.advance(time.time())
+                    continue
+
+                if kind is _ERROR:
+                    raise item
+                if kind is _END:
+                    yield from self._windower.flush()
+                    return
+                yield from self._windower.add(item, time.time())
+        finally:
+            stopped.set()
+
+
+_ITEM, _END, _ERROR = object(), object(), object()
+
+
+def _read_ahead(parent: Stream, items: queue.Queue, stopped: threading.Event):
+    def put(kind, item=None):
+        while not stopped.is_set():
+            try:
+                items.put((kind, item), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for item in parent:
+            if not put(_ITEM, item):
+                return
+    except Exception as e:
+        put(_ERROR, e)
+    else:
+        put(_END)
+
+
+def _byte_size(item: Any) -> int:
+    if isinstance(item, (bytes, bytearray, memoryview, str)):
+        return len(item)
+    return sys.getsizeof(item)
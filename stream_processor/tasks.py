@@ -1,8 +1,18 @@
+import asyncio
 import inspect
+import threading
+import time
+from copy import copy, deepcopy
 from enum import Enum
-from typing import Any, Optional, Callable, List
+from types import FunctionType, BuiltinFunctionType
+from typing import TYPE_CHECKING, Any, Optional, Callable, List, Tuple, Awaitable
 
+from stream_processor import metrics
 from stream_processor.exceptions import TaskHandlerException, InvalidStateTransition
+from stream_processor.retries import RetryPolicy
+
+if TYPE_CHECKING:
+    from stream_processor.events import EventBus
 
 OnQueueCallable = Callable[[Optional["TaskContext"]], None]
 OnStartCallable = Callable[[Optional["TaskContext"]], None]
@@ -47,8 +57,26 @@ MOVES = {
     State.REJECTED: [],
 }
 
+_VALID_MOVES = {state: frozenset(moves) for state, moves in MOVES.items()}
+
+HandlerPlan = Tuple[Tuple[Callable, bool], ...]
+
 
 class TaskContext:
+    __slots__ = (
+        "_state",
+        "_handler_map",
+        "_kv_store",
+        "_entered_at",
+        "_lock",
+        "result",
+        "error",
+        "attempts",
+        "task_name",
+        "timeout",
+        "deadline",
+    )
+
     def __init__(
         self,
         *,
@@ -58,57 +86,198 @@ class TaskContext:
         on_rejection_handlers: List[OnRejectionCallable] = None,
         on_termination_handlers: List[OnTerminationCallable] = None,
         on_completion_success_handlers: List[OnCompletionSuccessCallable] = None,
+        event_bus: "EventBus" = None,
         **kwargs,
     ):
         self._state = State.CREATED
 
+        # Whether a handler takes the context is resolved once here, instead of
+        # introspecting every handler on every state change. With an event bus
+        # the plan publishes the events to it instead of calling the handlers.
+        def plan(state: State, handlers: Optional[List[Callable]]) -> HandlerPlan:
+            if event_bus is None:
+                return _dispatch_plan(handlers)
+            return event_bus.plan(state, handlers)
+
         self._handler_map = {
-            State.CREATED: [],
-            State.QUEUED: on_queue_handlers or [],
-            State.RUNNING: on_start_handlers or [],
-            State.FAILED: on_failure_handlers or [],
-            State.REJECTED: on_rejection_handlers or [],
-            State.TERMINATED: on_termination_handlers or [],
-            State.SUCCESS: on_completion_success_handlers or [],
+            State.CREATED: (),
+            State.QUEUED: plan(State.QUEUED, on_queue_handlers),
+            State.RUNNING: plan(State.RUNNING, on_start_handlers),
+            State.FAILED: plan(State.FAILED, on_failure_handlers),
+            State.REJECTED: plan(State.REJECTED, on_rejection_handlers),
+            State.TERMINATED: plan(State.TERMINATED, on_termination_handlers),
+            State.SUCCESS: plan(State.SUCCESS, on_completion_success_handlers),
         }
 
         self._kv_store = {}
+        self._entered_at = None
+        # serialises the moves of a task with a timeout, which a scheduler may
+        # terminate while a worker is still running it
+        self._lock = threading.Lock()
         self.result = None
         self.error = None
+        self.attempts = 0
+        self.task_name = None
+        # set by a scheduler, which terminates the task once it has been
+        # RUNNING for `timeout` seconds, at the time.monotonic() `deadline`
+        self.timeout = None
+        self.deadline = None
 
         for key, value in kwargs.items():
             self[key] = value
 
+    def spawn(self) -> "TaskContext":
+        """
+        Returns a fresh CREATED context sharing this context's handlers, with a
+        shallow copy of its kv store.
+        """
+        context = TaskContext.__new__(TaskContext)
+        context._state = State.CREATED
+        context._handler_map = self._handler_map
+        context._kv_store = dict(self._kv_store)
+        context._entered_at = None
+        context._lock = threading.Lock()
+        context.result = None
+        context.error = None
+        context.attempts = 0
+        context.task_name = self.task_name
+        context.timeout = None
+        context.deadline = None
+        return context
+
+    def __getstate__(self) -> dict:
+        # a lock can't be copied or pickled, the copy gets a lock of its own
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "_lock"}
+
+    def __setstate__(self, state: dict) -> None:
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._lock = threading.Lock()
+
     @property
     def state(self) -> State:
         return self._state
 
     @state.setter
     def state(self, state: State) -> None:
+        self._move(state)
+        if self._handler_map[state]:
+            self._invoke_handlers_for_state_change()
+
+    async def set_state_async(self, state: State) -> None:
+        """
+        Same as assigning `state`, but awaits `async def` handlers on the
+        running event loop instead of spinning up a new one for each of them.
+        """
+        self._move(state)
+        if self._handler_map[state]:
+            await self._invoke_handlers_for_state_change_async()
+
+    def terminate(self) -> bool:
+        """
+        Moves a QUEUED or RUNNING task to TERMINATED and returns True, or False
+        if it had already left those states.
+        """
+        with self._lock:
+            if not self._is_valid_move(self._state, State.TERMINATED):
+                return False
+            self._move(State.TERMINATED)
+        if self._handler_map[State.TERMINATED]:
+            self._invoke_handlers_for_state_change()
+        return True
+
+    def _advance(self, state: State) -> bool:
+        """
+        Same as assigning `state`, unless a task with a timeout was terminated
+        meanwhile, in which case its late outcome is dropped and False returned.
+        """
+        if self.timeout is None:
+            self.state = state
+            return True
+        if not self._move_unless_terminated(state):
+            return False
+        if self._handler_map[state]:
+            self._invoke_handlers_for_state_change()
+        return True
+
+    async def _advance_async(self, state: State) -> bool:
+        """Same as `_advance`, awaiting the handlers like `set_state_async`."""
+        if self.timeout is None:
+            await self.set_state_async(state)
+            return True
+        if not self._move_unless_terminated(state):
+            return False
+        if self._handler_map[state]:
+            await self._invoke_handlers_for_state_change_async()
+        return True
+
+    def _move_unless_terminated(self, state: State) -> bool:
+        with self._lock:
+            if self._state is State.TERMINATED:
+                return False
+            self._move(state)
+        return True
+
+    def _move(self, state: State) -> None:
         if not self._is_valid_move(self._state, state):
             raise InvalidStateTransition(
                 f"Invalid transition from {self.state} to {state}"
             )
-        self._state = state
-        self._invoke_handlers_for_state_change()
+        previous, self._state = self._state, state
+        if state is State.RUNNING:
+            self.attempts += 1
+            if self.timeout is not None:
+                self.deadline = time.monotonic() + self.timeout
+        if metrics.recorder is not None:
+            self._record_transition(previous, state)
+
+    def _record_transition(self, previous: State, state: State) -> None:
+        now = time.monotonic()
+        duration = None if self._entered_at is None else now - self._entered_at
+        self._entered_at = now
+        metrics.recorder.record_transition(
+            self.task_name or "unknown", previous, state, duration
+        )
 
     def _is_valid_move(self, from_state, to_state):
-        return to_state in MOVES.get(from_state, [])
+        return to_state in _VALID_MOVES.get(from_state, ())
+
+    def _publish_event(self, handlers: HandlerPlan, *args) -> None:
+        for handler, accepts_context in handlers:
+            if accepts_context:
+                result = handler(*args, context=self)
+            else:
+                result = handler(*args)
+            if inspect.isawaitable(result):
+                run_sync(result)
+
+    async def _publish_event_async(self, handlers: HandlerPlan, *args) -> None:
+        for handler, accepts_context in handlers:
+            if accepts_context:
+                result = handler(*args, context=self)
+            else:
+                result = handler(*args)
+            if inspect.isawaitable(result):
+                await result
 
-    def _publish_event(self, handlers: List[Callable], *args, **kwargs) -> None:
-        for handler in handlers:
-            if "context" in inspect.getfullargspec(handler).args:
-                kwargs["context"] = self
-            handler(*args, **kwargs)
+    def _event_for_state_change(self) -> Tuple[HandlerPlan, tuple]:
+        if self._state is State.FAILED:
+            return self._handler_map[State.FAILED], (self.error,)
+        elif self._state is State.SUCCESS:
+            return self._handler_map[State.SUCCESS], (self.result,)
+        return self._handler_map[self._state], ()
 
     def _invoke_handlers_for_state_change(self) -> None:
+        handlers, args = self._event_for_state_change()
         try:
-            if self.state == State.FAILED:
-                self._publish_event(self._handler_map[State.FAILED], self.error)
-            elif self.state == State.SUCCESS:
-                self._publish_event(self._handler_map[State.SUCCESS], self.result)
-            else:
-                self._publish_event(self._handler_map[self.state])
+            self._publish_event(handlers, *args)
+        except Exception:
+            raise TaskHandlerException
+
+    async def _invoke_handlers_for_state_change_async(self) -> None:
+        handlers, args = self._event_for_state_change()
+        try:
+            await self._publish_event_async(handlers, *args)
         except Exception:
             raise TaskHandlerException
 
@@ -123,6 +292,15 @@ class TaskContext:
 
 
 class Task:
+    __slots__ = (
+        "_func",
+        "_accepts_context",
+        "_is_coroutine",
+        "retry_policy",
+        "timeout",
+        "context",
+    )
+
     def __init__(
         self,
         func: Callable,
@@ -133,9 +311,18 @@ class Task:
         on_rejection_handlers: List[OnRejectionCallable] = None,
         on_termination_handlers: List[OnTerminationCallable] = None,
         on_completion_success_handlers: List[OnCompletionSuccessCallable] = None,
+        retry_policy: RetryPolicy = None,
+        timeout: float = None,
+        task_name: str = None,
+        event_bus: "EventBus" = None,
         **kwargs,
     ):
         self._func = func
+        self._accepts_context = accepts_context(func)
+        self._is_coroutine = inspect.iscoroutinefunction(func)
+        self.retry_policy = retry_policy
+        # seconds a scheduler lets the task run before terminating it
+        self.timeout = timeout
         self.context = TaskContext(
             on_queue_handlers=on_queue_handlers,
             on_start_handlers=on_start_handlers,
@@ -143,14 +330,42 @@ class Task:
             on_rejection_handlers=on_rejection_handlers,
             on_termination_handlers=on_termination_handlers,
             on_completion_success_handlers=on_completion_success_handlers,
+            event_bus=event_bus,
             **kwargs,
         )
+        self.context.task_name = task_name or getattr(
+            func, "__name__", type(func).__name__
+        )
+
+    def spawn(self) -> "Task":
+        """
+        Returns a new Task for a single invocation, treating this one as an
+        immutable template. The function and handlers are shared while the
+        context is fresh, which is much cheaper than a deepcopy of the Task.
+        """
+        task = copy(self) if hasattr(self, "__dict__") else self._copy_slots()
+        task.context = self.context.spawn()
+        return task
+
+    def _copy_slots(self) -> "Task":
+        task = Task.__new__(type(self))
+        task._func = self._func
+        task._accepts_context = self._accepts_context
+        task._is_coroutine = self._is_coroutine
+        task.retry_policy = self.retry_policy
+        task.timeout = self.timeout
+        return task
 
     def __call__(self, *args, **kwargs) -> Optional[Any]:
         self.context["args"] = args
         self.context["kwargs"] = kwargs
         return self._execute(*args, **kwargs)
 
+    async def run_async(self, *args, **kwargs) -> Optional[Any]:
+        self.context["args"] = args
+        self.context["kwargs"] = kwargs
+        return await self._execute_async(*args, **kwargs)
+
     @property
     def state(self) -> State:
         return self.context.state
@@ -168,21 +383,140 @@ class Task:
         return self.context.error
 
     def _execute(self, *args, **kwargs) -> Optional[Any]:
+        if self._is_coroutine:
+            return run_sync(self._execute_async(*args, **kwargs))
+
+        result = None
+        if not self.context._advance(State.RUNNING):
+            return None
+        try:
+            if self._accepts_context:
+                kwargs["context"] = self.context
+
+            result = self._func(*args, **kwargs)
+            self._complete(result)
+        except TaskHandlerException:
+            raise
+        except InvalidStateTransition:
+            raise
+        except Exception as e:
+            self._fail(e)
+
+        return result
+
+    async def _execute_async(self, *args, **kwargs) -> Optional[Any]:
         result = None
-        self.context.state = State.RUNNING
+        if not await self.context._advance_async(State.RUNNING):
+            return None
         try:
-            if "context" in inspect.getfullargspec(self._func).args:
+            if self._accepts_context:
                 kwargs["context"] = self.context
 
             result = self._func(*args, **kwargs)
-            self.context.result = result
-            self.context.state = State.SUCCESS
+            if inspect.isawaitable(result):
+                result = await result
+            await self._complete_async(result)
+        except asyncio.CancelledError:
+            # an Exception before Python 3.8, e.g. a task terminated on timeout
+            raise
         except TaskHandlerException:
             raise
         except InvalidStateTransition:
             raise
         except Exception as e:
-            self.context.error = e
-            self.context.state = State.FAILED
+            result = None
+            await self._fail_async(e)
 
         return result
+
+    def _complete(self, result: Any) -> None:
+        self.context.result = result
+        if not self.context._advance(State.SUCCESS):
+            self.context.result = None
+
+    def _fail(self, error: Exception) -> None:
+        self.context.error = error
+        if not self.context._advance(State.FAILED):
+            self.context.error = None
+
+    async def _complete_async(self, result: Any) -> None:
+        self.context.result = result
+        if not await self.context._advance_async(State.SUCCESS):
+            self.context.result = None
+
+    async def _fail_async(self, error: Exception) -> None:
+        self.context.error = error
+        if not await self.context._advance_async(State.FAILED):
+            self.context.error = None
+
+
+def accepts_context(func: Callable) -> bool:
+    try:
+        return "context" in inspect.getfullargspec(func).args
+    except TypeError:
+        return False
+
+
+def _dispatch_plan(handlers: Optional[List[Callable]]) -> HandlerPlan:
+    if not handlers:
+        return ()
+    # imported here, events builds on this module
+    from stream_processor.events import BatchHandler
+
+    if any(isinstance(handler, BatchHandler) for handler in handlers):
+        raise ValueError("A BatchHandler needs a Task with an event_bus")
+    return tuple([(handler, accepts_context(handler)) for handler in handlers])
+
+
+def task_factory(func: Callable) -> Callable[[], Callable]:
+    """
+    Returns a function producing an isolated instance of `func` for every
+    invocation: Tasks are spawned from `func` as a template, plain functions
+    are stateless and returned as is, any other callable is deep copied.
+    """
+    if isinstance(func, Task):
+        return func.spawn
+    if isinstance(func, (FunctionType, BuiltinFunctionType)):
+        return lambda: func
+    return lambda: deepcopy(func)
+
+
+def run_sync(awaitable: Awaitable) -> Any:
+    """
+    Drives `awaitable` to completion from synchronous code, e.g. an `async def`
+    task or handler running on a ThreadPoolScheduler worker.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_await(awaitable))
+    raise RuntimeError(
+        "Cannot block on a coroutine from a running event loop, "
+        "use `Task.run_async` or the AsyncIOScheduler instead"
+    )
+
+
+async def _await(awaitable: Awaitable) -> Any:
+    return await awaitable
+
+
+def execute_detached(
+    func: Callable, args: tuple, kwargs: dict, kv_store: dict
+) -> Tuple[Any, Optional[Exception], dict]:
+    """
+    Runs `func` away from its Task, e.g. in a worker process, where the
+    handlers cannot be invoked. The caller is expected to apply the returned
+    (result, error, kv_store) back onto the owning Task.
+    """
+    context = TaskContext(**kv_store)
+    context._state = State.RUNNING
+    kwargs = dict(kwargs)
+    try:
+        if accepts_context(func):
+            kwargs["context"] = context
+        result = func(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = run_sync(result)
+        return result, None, context._kv_store
+    except Exception as e:
+        return None, e, context._kv_store
@@ -0,0 +1,109 @@
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from stream_processor.tasks import State, Task, TaskContext
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+NUMPY = "numpy"
+COLUMNS = "columns"
+LIST = "list"
+FORMATS = (NUMPY, COLUMNS, LIST)
+
+
+class BatchFunction:
+    """
+    Calls a vectorised `func` with a batch of items assembled in `format`, and
+    splits its result back into a list with one entry per item:
+
+    - "numpy": a contiguous array of the items, the result an array (or any
+      sequence) with one row per item.
+    - "columns": dict items as a dict of column arrays, the result a dict of
+      columns which is turned back into a dict per row.
+    - "list": the batch as is, the result a list.
+
+    A result with another number of entries than the batch raises ValueError.
+    """
+
+    def __init__(self, func: Callable, format: str = NUMPY):
+        if format not in FORMATS:
+            raise ValueError(f"Expected format to be one of {FORMATS}, got {format}")
+        if format != LIST and numpy is None:
+            raise ImportError(
+                f'numpy is required for format="{format}", '
+                "install stream-processor[numpy]"
+            )
+        self._func = func
+        self._format = format
+
+    def __call__(self, batch: List) -> List:
+        if self._format == NUMPY:
+            results = _unbatch_array(self._func(numpy.asarray(batch)))
+        elif self._format == COLUMNS:
+            results = _unbatch_columns(self._func(_to_columns(batch)))
+        else:
+            results = list(self._func(batch))
+        if len(results) != len(batch):
+            raise ValueError(
+                f"Expected {len(batch)} results for the batch, got {len(results)}"
+            )
+        return results
+
+    def __deepcopy__(self, memo) -> "BatchFunction":
+        return self
+
+
+class ScheduledBatches:
+    """
+    Follows the tasks a scheduler runs a BatchFunction in, so that a batch the
+    scheduler yields None for, having failed or been terminated, raises its
+    error from `check` instead of flowing on as None.
+    """
+
+    def __init__(self, func: BatchFunction):
+        self._contexts = deque()
+        self.task = Task(func, on_queue_handlers=[self._queued])
+
+    def check(self, results: Optional[List]) -> List:
+        contexts = self._contexts
+        if results is None:
+            # the scheduler moves a task it retries back to QUEUED at once
+            context = next(c for c in contexts if c.state in _ENDED)
+            contexts.remove(context)
+            if context.error is not None:
+                raise context.error
+            raise RuntimeError(f"The batch was {context.state.value.lower()}")
+        while contexts and contexts[0].state is State.SUCCESS:
+            contexts.popleft()
+        return results
+
+    def __deepcopy__(self, memo) -> "ScheduledBatches":
+        return self
+
+    def _queued(self, context: TaskContext) -> None:
+        if context.attempts == 0:
+            self._contexts.append(context)
+
+
+_ENDED = (State.FAILED, State.TERMINATED, State.REJECTED)
+
+
+def _to_columns(batch: List[Dict[str, Any]]) -> Dict[str, "numpy.ndarray"]:
+    keys = dict.fromkeys(key for row in batch for key in row)
+    return {key: numpy.asarray([row.get(key) for row in batch]) for key in keys}
+
+
+def _unbatch_array(result: Any) -> List:
+    if isinstance(result, numpy.ndarray):
+        # tolist converts a whole 1-d array to Python scalars at C speed
+        return result.tolist() if result.ndim == 1 else list(result)
+    return list(result)
+
+
+def _unbatch_columns(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    keys = list(result)
+    columns = [_unbatch_array(result[key]) for key in keys]
+    return [dict(zip(keys, row)) for row in zip(*columns)]
@@ -0,0 +1,439 @@
+import copy
+import heapq
+import math
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Union
+
+
+class WindowResult(NamedTuple):
+    key: Hashable
+    start: float
+    end: float
+    value: Any
+
+
+class Aggregator(ABC):
+    """
+    An incremental aggregation. The state of a window only holds the
+    aggregate of its values, and states of adjacent panes can be merged.
+    `merge` must not modify its arguments.
+    """
+
+    @abstractmethod
+    def create(self) -> Any:
+        raise NotImplemented
+
+    @abstractmethod
+    def add(self, state: Any, value: Any) -> Any:
+        raise NotImplemented
+
+    @abstractmethod
+    def merge(self, state: Any, other: Any) -> Any:
+        raise NotImplemented
+
+    def result(self, state: Any) -> Any:
+        return state
+
+
+class Count(Aggregator):
+    def create(self) -> int:
+        return 0
+
+    def add(self, state: int, value: Any) -> int:
+        return state + 1
+
+    def merge(self, state: int, other: int) -> int:
+        return state + other
+
+
+class Sum(Aggregator):
+    def create(self) -> float:
+        return 0
+
+    def add(self, state: float, value: float) -> float:
+        return state + value
+
+    def merge(self, state: float, other: float) -> float:
+        return state + other
+
+
+class Min(Aggregator):
+    def create(self) -> Optional[float]:
+        return None
+
+    def add(self, state: Optional[float], value: float) -> float:
+        return value if state is None or value < state else state
+
+    def merge(self, state: Optional[float], other: Optional[float]) -> float:
+        return state if other is None else self.add(state, other)
+
+
+class Max(Aggregator):
+    def create(self) -> Optional[float]:
+        return None
+
+    def add(self, state: Optional[float], value: float) -> float:
+        return value if state is None or value > state else state
+
+    def merge(self, state: Optional[float], other: Optional[float]) -> float:
+        return state if other is None else self.add(state, other)
+
+
+class Mean(Aggregator):
+    def create(self) -> tuple:
+        return 0, 0
+
+    def add(self, state: tuple, value: float) -> tuple:
+        return state[0] + value, state[1] + 1
+
+    def merge(self, state: tuple, other: tuple) -> tuple:
+        return state[0] + other[0], state[1] + other[1]
+
+    def result(self, state: tuple) -> Optional[float]:
+        return state[0] / state[1] if state[1] else None
+
+
+class Quantile(Aggregator):
+    """
+    Approximate quantiles with a relative error of `relative_accuracy`, in the
+    manner of DDSketch: values are counted in logarithmic buckets, so the state
+    grows with the range of the values rather than their number.
+    """
+
+    def __init__(self, *quantiles: float, relative_accuracy: float = 0.01):
+        self.quantiles = quantiles or (0.5,)
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def create(self) -> tuple:
+        # positive buckets, negative buckets, zero count, total count
+        return {}, {}, 0, 0
+
+    def add(self, state: tuple, value: float) -> tuple:
+        positive, negative, zeros, count = state
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            positive[index] = positive.get(index, 0) + 1
+        elif value < 0:
+            index = math.ceil(math.log(-value) / self._log_gamma)
+            negative[index] = negative.get(index, 0) + 1
+        else:
+            zeros += 1
+        return positive, negative, zeros, count + 1
+
+    def merge(self, state: tuple, other: tuple) -> tuple:
+        positive, negative = dict(state[0]), dict(state[1])
+        for index, count in other[0].items():
+            positive[index] = positive.get(index, 0) + count
+        for index, count in other[1].items():
+            negative[index] = negative.get(index, 0) + count
+        return positive, negative, state[2] + other[2], state[3] + other[3]
+
+    def result(self, state: tuple) -> Union[Optional[float], Dict[float, float]]:
+        values = {q: self._quantile(state, q) for q in self.quantiles}
+        return values[self.quantiles[0]] if len(values) == 1 else values
+
+    def _quantile(self, state: tuple, q: float) -> Optional[float]:
+        positive, negative, zeros, count = state
+        if not count:
+            return None
+
+        rank, seen = q * (count - 1), 0
+        for index in sorted(negative, reverse=True):
+            seen += negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(positive):
+            seen += positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(positive))
+
+    def _value(self, index: int) -> float:
+        return 2 * self._gamma**index / (self._gamma + 1)
+
+
+class Aggregate(Aggregator):
+    """Runs several aggregators over the same values, e.g. Aggregate(n=Count())."""
+
+    def __init__(self, **aggregators: Aggregator):
+        self._aggregators = aggregators
+
+    def create(self) -> dict:
+        return {name: agg.create() for name, agg in self._aggregators.items()}
+
+    def add(self, state: dict, value: Any) -> dict:
+        for name, agg in self._aggregators.items():
+            state[name] = agg.add(state[name], value)
+        return state
+
+    def merge(self, state: dict, other: dict) -> dict:
+        return {
+            name: agg.merge(state[name], other[name])
+            for name, agg in self._aggregators.items()
+        }
+
+    def result(self, state: dict) -> dict:
+        return {
+            name: agg.result(state[name]) for name, agg in self._aggregators.items()
+        }
+
+
+class Windows(ABC):
+    """
+    Assigns keyed, timestamped values to windows and emits the aggregate of a
+    window once the watermark passes its end. Only the aggregates of the open
+    windows are kept.
+    """
+
+    def __init__(self) -> None:
+        self._aggregator: Optional[Aggregator] = None
+        # (end, tie breaker, key, window id) of the windows to close, entries
+        # for windows that moved or closed are skipped when popped.
+        self._closing: List[tuple] = []
+        self._counter = 0
+        self._watermark = -math.inf
+
+    def bind(self, aggregator: Aggregator) -> "Windows":
+        self._aggregator = aggregator
+        return self
+
+    @abstractmethod
+    def last_end(self, timestamp: float) -> float:
+        """End of the last window a value at `timestamp` belongs to."""
+        raise NotImplemented
+
+    @abstractmethod
+    def add(self, key: Hashable, timestamp: float, value: Any) -> None:
+        raise NotImplemented
+
+    @abstractmethod
+    def _close(self, key: Hashable, window_id: Any, end: float) -> List[WindowResult]:
+        raise NotImplemented
+
+    def next_end(self) -> Optional[float]:
+        return self._closing[0][0] if self._closing else None
+
+    def advance(self, watermark: float) -> List[WindowResult]:
+        self._watermark = watermark
+        results = []
+        while self._closing and self._closing[0][0] <= watermark:
+            end, _, key, window_id = heapq.heappop(self._closing)
+            results.extend(self._close(key, window_id, end))
+        return results
+
+    def flush(self) -> List[WindowResult]:
+        return self.advance(math.inf)
+
+    def _schedule(self, end: float, key: Hashable, window_id: Any) -> None:
+        self._counter += 1
+        heapq.heappush(self._closing, (end, self._counter, key, window_id))
+
+
+class TumblingWindows(Windows):
+    def __init__(self, size: float) -> None:
+        super().__init__()
+        self.size = size
+        self._open: Dict[tuple, Any] = {}
+
+    def last_end(self, timestamp: float) -> float:
+        return self._start(timestamp) + self.size
+
+    def add(self, key: Hashable, timestamp: float, value: Any) -> None:
+        start = self._start(timestamp)
+        state = self._open.get((key, start))
+        if state is None:
+            state = self._aggregator.create()
+            self._schedule(start + self.size, key, start)
+        self._open[(key, start)] = self._aggregator.add(state, value)
+
+    def _close(self, key: Hashable, start: float, end: float) -> List[WindowResult]:
+        state = self._open.pop((key, start))
+        return [WindowResult(key, start, end, self._aggregator.result(state))]
+
+    def _start(self, timestamp: float) -> float:
+        return math.floor(timestamp / self.size) * self.size
+
+
+class SlidingWindows(Windows):
+    """
+    Windows of `size` starting every `slide`. Values are aggregated once into
+    panes of `slide` length, and a window merges the panes it spans, so the
+    overlap between windows is never aggregated again.
+    """
+
+    def __init__(self, size: float, slide: float) -> None:
+        super().__init__()
+        panes = size / slide
+        if panes != int(panes):
+            raise ValueError("Expected the window size to be a multiple of the slide")
+        self.size = size
+        self.slide = slide
+        self._panes: Dict[Hashable, Dict[float, Any]] = {}
+        self._next_end: Dict[Hashable, float] = {}
+
+    def last_end(self, timestamp: float) -> float:
+        return self._pane(timestamp) + self.size
+
+    def add(self, key: Hashable, timestamp: float, value: Any) -> None:
+        pane = self._pane(timestamp)
+        panes = self._panes.setdefault(key, {})
+        state = panes.get(pane)
+        panes[pane] = self._aggregator.add(
+            self._aggregator.create() if state is None else state, value
+        )
+
+        # the first window of the pane which wasn't closed yet
+        first_end = pane + self.slide
+        if first_end <= self._watermark:
+            skipped = math.floor((self._watermark - first_end) / self.slide) + 1
+            first_end += skipped * self.slide
+        next_end = self._next_end.get(key)
+        if next_end is None or first_end < next_end:
+            self._next_end[key] = first_end
+            self._schedule(first_end, key, first_end)
+
+    def _close(self, key: Hashable, end: float, _) -> List[WindowResult]:
+        if self._next_end.get(key) != end:
+            return []
+
+        panes = self._panes[key]
+        start = end - self.size
+        state = None
+        for pane in sorted(p for p in panes if start <= p < end):
+            if state is None:
+                state = panes[pane]
+            else:
+                state = self._aggregator.merge(state, panes[pane])
+        results = []
+        if state is not None:
+            results.append(
+                WindowResult(key, start, end, self._aggregator.result(state))
+            )
+
+        for pane in [p for p in panes if p < start + self.slide]:
+            del panes[pane]
+        if panes:
+            # skip the windows without any pane after a gap
+            next_end = max(end + self.slide, min(panes) + self.slide)
+            self._next_end[key] = next_end
+            self._schedule(next_end, key, next_end)
+        else:
+            del self._panes[key]
+            del self._next_end[key]
+        return results
+
+    def _pane(self, timestamp: float) -> float:
+        return math.floor(timestamp / self.slide) * self.slide
+
+
+class SessionWindows(Windows):
+    """
+    A window per burst of activity of a key, closed once no value arrived for
+    `gap`. Sessions bridged by a late value are merged.
+    """
+
+    def __init__(self, gap: float) -> None:
+        super().__init__()
+        self.gap = gap
+        # key -> session id -> [start, last timestamp, state]
+        self._sessions: Dict[Hashable, Dict[int, list]] = {}
+        self._session_ids = 0
+
+    def last_end(self, timestamp: float) -> float:
+        return timestamp + self.gap
+
+    def add(self, key: Hashable, timestamp: float, value: Any) -> None:
+        sessions = self._sessions.setdefault(key, {})
+        touching = [
+            session_id
+            for session_id, (start, last, _) in sessions.items()
+            if start - self.gap <= timestamp <= last + self.gap
+        ]
+
+        state = self._aggregator.add(self._aggregator.create(), value)
+        start = last = timestamp
+        for session_id in touching:
+            other_start, other_last, other_state = sessions.pop(session_id)
+            start, last = min(start, other_start), max(last, other_last)
+            state = self._aggregator.merge(other_state, state)
+
+        if touching:
+            # the session keeps its heap entry, which is moved when popped
+            session_id = touching[0]
+        else:
+            self._session_ids += 1
+            session_id = self._session_ids
+            self._schedule(last + self.gap, key, session_id)
+        sessions[session_id] = [start, last, state]
+
+    def _close(self, key: Hashable, session_id: int, end: float) -> List[WindowResult]:
+        sessions = self._sessions.get(key, {})
+        session = sessions.get(session_id)
+        if session is None:
+            return []
+        if session[1] + self.gap > end:
+            self._schedule(session[1] + self.gap, key, session_id)
+            return []
+        del sessions[session_id]
+        if not sessions:
+            del self._sessions[key]
+        start, last, state = session
+        return [
+            WindowResult(key, start, last + self.gap, self._aggregator.result(state))
+        ]
+
+
+class Windower:
+    """
+    Feeds items into `windows`, tracking the watermark as the latest timestamp
+    seen minus `allowed_lateness`. Items belonging only to windows that were
+    already closed are dropped and counted in `late`.
+    """
+
+    def __init__(
+        self,
+        windows: Windows,
+        aggregator: Aggregator,
+        key: Callable[[Any], Hashable] = None,
+        value: Callable[[Any], Any] = None,
+        allowed_lateness: float = 0,
+    ) -> None:
+        self._windows = windows.bind(aggregator)
+        self._key = key
+        self._value = value
+        self._allowed_lateness = allowed_lateness
+        self.watermark = -math.inf
+        self.late = 0
+
+    def add(self, item: Any, timestamp: float) -> List[WindowResult]:
+        if self._windows.last_end(timestamp) <= self.watermark:
+            self.late += 1
+            return []
+
+        key = self._key(item) if self._key else None
+        value = self._value(item) if self._value else item
+        self._windows.add(key, timestamp, value)
+        return self.advance(timestamp - self._allowed_lateness)
+
+    def advance(self, watermark: float) -> List[WindowResult]:
+        if watermark <= self.watermark:
+            return []
+        self.watermark = watermark
+        return self._windows.advance(watermark)
+
+    def next_end(self) -> Optional[float]:
+        return self._windows.next_end()
+
+    def snapshot(self) -> tuple:
+        return copy.deepcopy(self._windows), self.watermark, self.late
+
+    def restore(self, state: tuple) -> None:
+        windows, self.watermark, self.late = state
+        self._windows = copy.deepcopy(windows)
+
+    def flush(self) -> List[WindowResult]:
+        return self._windows.flush()
@@ -0,0 +1,100 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists
+
+from stream_processor.caching import CachedFunction
+from stream_processor.schedulers import ThreadPoolScheduler
+from stream_processor.stream import Stream
+
+
+@given(data=lists(elements=integers(0, 20), max_size=200))
+def test_cached_map_calls_once_per_key(data):
+    func = MagicMock(side_effect=lambda x: x * 2)
+
+    stream = Stream(iter(data)).cached_map(func)
+
+    assert [x * 2 for x in data] == stream.list()
+    assert len(set(data)) == func.call_count
+    assert len(set(data)) == stream.cache.stats.misses
+    assert len(data) - len(set(data)) == stream.cache.stats.hits
+
+
+@given(data=lists(elements=integers(0, 20), max_size=200), max_size=integers(1, 5))
+def test_cached_map_evicts_least_recently_used(data, max_size):
+    calls = []
+    cached = CachedFunction(lambda x: calls.append(x) or x, max_size=max_size)
+
+    recent = []
+    expected_calls = []
+    for x in data:
+        assert x == cached(x)
+        if x in recent:
+            recent.remove(x)
+        else:
+            expected_calls.append(x)
+        recent.append(x)
+        recent = recent[-max_size:]
+
+    assert expected_calls == calls
+    assert len(cached) <= max_size
+
+
+def test_cached_map_expires_results():
+    func = MagicMock(side_effect=lambda x: x)
+    cached = CachedFunction(func, ttl=0.05)
+
+    cached(1)
+    cached(1)
+    time.sleep(0.1)
+    cached(1)
+
+    assert 2 == func.call_count
+    assert 1 == cached.stats.expirations
+
+
+def test_cached_map_with_key():
+    func = MagicMock(side_effect=lambda item: item["value"])
+
+    result = (
+        Stream(iter([{"id": 1, "value": "a"}, {"id": 1, "value": "b"}]))
+        .cached_map(func, key=lambda item: item["id"])
+        .list()
+    )
+
+    assert ["a", "a"] == result
+    assert 1 == func.call_count
+
+
+def test_cached_map_does_not_cache_failures():
+    func = MagicMock(side_effect=[ValueError(), 1])
+    cached = CachedFunction(func)
+
+    with pytest.raises(ValueError):
+        cached(1)
+    assert 1 == cached(1)
+
+
+@settings(deadline=None, max_examples=10)
+@given(data=lists(elements=integers(0, 3), min_size=1, max_size=50))
+def test_cached_map_coalesces_in_flight_calls(data):
+    calls = []
+    lock = threading.Lock()
+
+    def slow_lookup(x):
+        with lock:
+            calls.append(x)
+        time.sleep(0.01)
+        return x * 2
+
+    stream = Stream(iter(data)).cached_map(
+        slow_lookup, scheduler=ThreadPoolScheduler(max_workers=8)
+    )
+
+    assert [x * 2 for x in data] == stream.list()
+    assert sorted(set(data)) == sorted(calls)
+    stats = stream.cache.stats
+    assert len(data) == stats.hits + stats.misses + stats.coalesced
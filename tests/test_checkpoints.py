@@ -0,0 +1,119 @@
+import itertools
+import os
+
+import pytest
+from hypothesis import given, settings, HealthCheck
+from hypothesis.strategies import integers, lists, sampled_from
+
+from stream_processor.checkpoints import (
+    Checkpoint,
+    FileCheckpointStore,
+    SQLiteCheckpointStore,
+)
+from stream_processor.exceptions import CheckpointError
+from stream_processor.schedulers import ThreadPoolScheduler
+from stream_processor.stream import Stream
+from stream_processor.windows import Sum, TumblingWindows
+
+
+def double(x):
+    return x * 2
+
+
+def windowed(stream):
+    return stream.window(TumblingWindows(10), Sum(), timestamp=lambda x: x)
+
+
+def batched(stream):
+    return (
+        stream.map(double)
+        .filter(lambda x: x % 3)
+        .batch(4, max_weight=150, weigher=lambda x: x)
+        .concat()
+    )
+
+
+def scheduled(stream):
+    return stream.map(double, scheduler=ThreadPoolScheduler(max_workers=4)).take(150)
+
+
+PIPELINES = {"windowed": windowed, "batched": batched, "scheduled": scheduled}
+
+
+def new_store(kind, directory):
+    if kind == "sqlite":
+        return SQLiteCheckpointStore(os.path.join(directory, "checkpoints.db"))
+    return FileCheckpointStore(directory, compact_every=3)
+
+
+@settings(deadline=None, suppress_health_check=[HealthCheck.function_scoped_fixture])
+@given(
+    data=lists(elements=integers(0, 100), max_size=200),
+    pipeline=sampled_from(sorted(PIPELINES)),
+    store_kind=sampled_from(["sqlite", "file"]),
+    consumed=integers(1, 100),
+    interval=integers(1, 10),
+)
+def test_resumes_from_last_commit(
+    tmp_path_factory, data, pipeline, store_kind, consumed, interval
+):
+    data = sorted(data)
+    build = PIPELINES[pipeline]
+    expected = build(Stream(iter(data))).list()
+    directory = str(tmp_path_factory.mktemp("checkpoints"))
+
+    stream = build(Stream(iter(data))).checkpoint(
+        new_store(store_kind, directory), "test", interval=interval
+    )
+    # crash after `consumed` items
+    head = list(itertools.islice(stream, consumed))
+
+    resumed = (
+        build(Stream(iter(data)))
+        .checkpoint(new_store(store_kind, directory), "test", interval=interval)
+        .list()
+    )
+
+    committed = (len(head) - 1) // interval * interval
+    if len(head) < consumed:
+        committed = len(head)
+    assert expected[committed:] == resumed
+
+
+def test_exhausted_stream_resumes_empty(tmp_path):
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+
+    assert [2, 4, 6] == Stream([1, 2, 3]).map(double).checkpoint(store, "t").list()
+    assert [] == Stream([1, 2, 3]).map(double).checkpoint(store, "t").list()
+
+
+def test_changed_plan_is_rejected(tmp_path):
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+    Stream([1, 2, 3]).map(double).checkpoint(store, "t").list()
+
+    with pytest.raises(CheckpointError):
+        Stream([1, 2, 3]).filter(double).checkpoint(store, "t").list()
+
+
+def test_read_ahead_operators_are_rejected(tmp_path):
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+    unordered = ThreadPoolScheduler(ordered=False)
+
+    with pytest.raises(CheckpointError):
+        Stream([1]).batch(1, max_latency=1).checkpoint(store, "latency").list()
+    with pytest.raises(CheckpointError):
+        Stream([1]).map(double, scheduler=unordered).checkpoint(store, "map").list()
+
+
+def test_file_store_ignores_torn_record(tmp_path):
+    store = FileCheckpointStore(str(tmp_path))
+    store.commit("t", Checkpoint("plan", [1], 0.0))
+    store.commit("t", Checkpoint("plan", [2], 0.0))
+    with open(tmp_path / "t.checkpoints", "ab") as f:
+        f.write(b"\x00\x00\x01\x00torn")
+
+    assert [2] == FileCheckpointStore(str(tmp_path)).load("t").states
+
+    store = FileCheckpointStore(str(tmp_path))
+    store.commit("t", Checkpoint("plan", [3], 0.0))
+    assert [3] == store.load("t").states
@@ -0,0 +1,220 @@
+import gzip
+import threading
+
+import pytest
+from hypothesis import given, settings, HealthCheck
+from hypothesis.strategies import integers, lists, text, dictionaries, sampled_from
+
+from stream_processor.checkpoints import SQLiteCheckpointStore
+from stream_processor.files import (
+    BufferedSink,
+    FileSink,
+    FileSource,
+    read_csv,
+    read_jsonl,
+    read_lines,
+)
+from stream_processor.stream import Stream
+
+lines = lists(
+    elements=text(alphabet='abc é,"', max_size=20).filter(lambda s: "\n" not in s),
+    max_size=100,
+)
+
+
+@settings(suppress_health_check=[HealthCheck.function_scoped_fixture])
+@given(data=lines, chunk_size=integers(1, 64), suffix=sampled_from([".txt", ".gz"]))
+def test_read_lines(tmp_path, data, chunk_size, suffix):
+    path = str(tmp_path / f"lines{suffix}")
+    content = "".join(f"{line}\n" for line in data).encode()
+    with (gzip.open if suffix == ".gz" else open)(path, "wb") as f:
+        f.write(content)
+
+    assert data == read_lines(path, chunk_size=chunk_size).list()
+
+
+def test_read_lines_without_trailing_newline(tmp_path):
+    (tmp_path / "lines.txt").write_bytes(b"a\nb")
+    (tmp_path / "empty.txt").write_bytes(b"")
+
+    assert ["a", "b"] == read_lines(str(tmp_path / "lines.txt")).list()
+    assert [] == read_lines(str(tmp_path / "empty.txt")).list()
+
+
+@settings(suppress_health_check=[HealthCheck.function_scoped_fixture])
+@given(
+    data=lists(elements=dictionaries(text(max_size=5), integers()), max_size=50),
+    suffix=sampled_from([".jsonl", ".jsonl.gz"]),
+)
+def test_jsonl_round_trip(tmp_path, data, suffix):
+    path = str(tmp_path / f"records{suffix}")
+
+    with FileSink(path, format="jsonl", max_records=7) as sink:
+        for record in data:
+            sink.write(record)
+
+    assert data == read_jsonl(path).list()
+
+
+def test_read_jsonl_skips_blank_lines(tmp_path):
+    (tmp_path / "records.jsonl").write_text('{"a": 1}\n\n{"a": 2}\n')
+    assert [{"a": 1}, {"a": 2}] == read_jsonl(str(tmp_path / "records.jsonl")).list()
+
+
+@settings(suppress_health_check=[HealthCheck.function_scoped_fixture])
+@given(
+    data=lists(elements=lists(text(max_size=5), min_size=2, max_size=2), max_size=50),
+    chunk_size=integers(1, 10),
+    suffix=sampled_from([".csv", ".csv.gz"]),
+)
+def test_csv_round_trip(tmp_path, data, chunk_size, suffix):
+    path = str(tmp_path / f"rows{suffix}")
+    Stream([["a", "b"]] + data).sink(FileSink(path, format="csv"))
+
+    rows = [{"a": a, "b": b} for a, b in data]
+    assert rows == read_csv(path).list()
+    chunks = read_csv(path, chunk_size=chunk_size).list()
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    assert rows == [row for chunk in chunks for row in chunk]
+
+
+@settings(suppress_health_check=[HealthCheck.function_scoped_fixture])
+@given(
+    data=lists(elements=lists(text(max_size=5), min_size=2, max_size=2), max_size=50),
+    append=sampled_from([False, True]),
+)
+def test_csv_dict_records_round_trip(tmp_path, data, append):
+    path = str(tmp_path / "rows.csv")
+    rows = [{"a": a, "b": b} for a, b in data]
+    Stream(rows).sink(FileSink(path, format="csv", max_records=7))
+    Stream(rows).sink(FileSink(path, format="csv", append=append))
+
+    assert (rows + rows if append else rows) == read_csv(path).list()
+
+
+def test_csv_rejects_dict_records_with_other_keys(tmp_path):
+    sink = FileSink(str(tmp_path / "rows.csv"), format="csv")
+    sink.write({"a": 1})
+    sink.write({"b": 2})
+    with pytest.raises(ValueError):
+        sink.close()
+
+
+def test_file_source_resumes_from_byte_position(tmp_path):
+    path = str(tmp_path / "lines.txt")
+    (tmp_path / "lines.txt").write_text("".join(f"{i}\n" for i in range(100)))
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+
+    stream = read_lines(path, chunk_size=16).checkpoint(store, "lines", interval=10)
+    head = [next(stream) for _ in range(25)]
+
+    resumed = read_lines(path).checkpoint(store, "lines", interval=10).list()
+    assert [str(i) for i in range(25)] == head
+    assert [str(i) for i in range(20, 100)] == resumed
+
+
+@given(data=lists(elements=integers(), max_size=200), max_records=integers(1, 20))
+def test_buffered_sink_writes_in_bulk(data, max_records):
+    batches = []
+    sink = BufferedSink(batches.append, max_records=max_records)
+
+    assert len(data) == Stream(iter(data)).sink(sink)
+
+    assert data == [record for batch in batches for record in batch]
+    assert all(len(batch) <= max_records for batch in batches)
+    assert len(batches) == -(-len(data) // max_records)
+
+
+@settings(deadline=None)
+@given(data=lists(elements=integers(), max_size=200), max_records=integers(1, 20))
+def test_buffered_sink_with_writer_thread(data, max_records):
+    batches = []
+    threads = set()
+
+    def write(batch):
+        threads.add(threading.current_thread())
+        batches.append(batch)
+
+    with BufferedSink(write, max_records=max_records, background=True) as sink:
+        for record in data:
+            sink.write(record)
+
+    assert data == [record for batch in batches for record in batch]
+    assert threading.current_thread() not in threads
+
+
+def test_buffered_sink_flushes_after_max_delay_while_idle():
+    written = threading.Event()
+    sink = BufferedSink(lambda batch: written.set(), max_delay=0.05, background=True)
+
+    sink.write(1)
+
+    assert written.wait(1)
+    sink.close()
+
+
+def test_buffered_sink_raises_writer_errors():
+    def fail(batch):
+        raise IOError("disk full")
+
+    sink = BufferedSink(fail, max_records=1, background=True)
+    sink.write(1)
+
+    with pytest.raises(IOError):
+        sink.close()
+
+
+def test_buffered_sink_keeps_batches_after_writer_error():
+    def fail(batch):
+        raise IOError("disk full")
+
+    sink = BufferedSink(fail, max_records=1, background=True)
+    sink.write(1)
+    with pytest.raises(IOError):
+        sink.flush()
+    with pytest.raises(IOError):
+        sink.write(2)
+    with pytest.raises(IOError):
+        sink.close()
+
+    assert [[1], [2]] == sink.unwritten
+
+
+@pytest.mark.parametrize("encoding", [None, "utf-8", "utf-8-sig"])
+def test_file_source_resumes_crlf_lines(tmp_path, encoding):
+    path = str(tmp_path / "lines.txt")
+    content = "".join(f"é{i}\r\n" for i in range(50)).encode(encoding or "utf-8")
+    (tmp_path / "lines.txt").write_bytes(content)
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+
+    lines = FileSource(path, encoding, chunk_size=16)
+    stream = lines.checkpoint(store, "lines", interval=10)
+    head = [next(stream) for _ in range(25)]
+
+    resumed = FileSource(path, encoding).checkpoint(store, "lines", interval=10)
+    expected = [f"é{i}" for i in range(50)]
+    if encoding is None:
+        expected = [line.encode() for line in expected]
+    assert expected[:25] == head
+    assert expected[20:] == resumed.list()
+
+
+def test_file_source_rejects_encodings_without_newline_byte(tmp_path):
+    with pytest.raises(ValueError):
+        FileSource(str(tmp_path / "lines.txt"), "utf-16")
+
+
+def test_sink_is_flushed_before_checkpoint(tmp_path):
+    written, commits = [], []
+
+    class _Store(SQLiteCheckpointStore):
+        def commit(self, name, checkpoint):
+            commits.append((checkpoint.states[-1], len(written)))
+            super().commit(name, checkpoint)
+
+    store = _Store(str(tmp_path / "checkpoints.db"))
+    sink = BufferedSink(written.extend, max_records=100, background=True)
+
+    Stream(range(10)).checkpoint(store, "t", interval=3).sink(sink)
+
+    assert [(3, 3), (6, 6), (9, 9), (10, 10)] == commits
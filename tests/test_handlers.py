@@ -1,8 +1,13 @@
-from unittest.mock import MagicMock
+import asyncio
+import inspect
+import threading
+from unittest.mock import MagicMock, patch
 
-from hypothesis import given
-from hypothesis.strategies import integers, text, one_of
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists, text, one_of
 
+from stream_processor.events import BatchHandler, EventBus, InlineHandler
 from stream_processor.schedulers import ThreadPoolScheduler
 from stream_processor.tasks import Task, State
 
@@ -83,3 +88,172 @@ def test_handlers_when_error_flow(param):
     handler_args = failure_handler.call_args_list[0][0]
     assert isinstance(handler_args[0], CustomException)
     assert task.state == State.FAILED
+
+
+@given(param=one_of([text(min_size=1), integers()]),)
+def test_coroutine_handlers_are_awaited(param):
+    calls = []
+
+    async def start_handler(context=None):
+        await asyncio.sleep(0)
+        calls.append(context.state)
+
+    async def success_handler(response):
+        await asyncio.sleep(0)
+        calls.append(response)
+
+    task = Task(
+        lambda x: x * 2,
+        on_start_handlers=[start_handler],
+        on_completion_success_handlers=[success_handler],
+    )
+    assert task(param) == param * 2
+    assert calls == [State.RUNNING, param * 2]
+
+    calls.clear()
+    task = Task(
+        lambda x: x * 2,
+        on_start_handlers=[start_handler],
+        on_completion_success_handlers=[success_handler],
+    )
+    assert asyncio.run(task.run_async(param)) == param * 2
+    assert calls == [State.RUNNING, param * 2]
+
+
+@given(param=one_of([text(min_size=1), integers()]),)
+def test_handlers_are_introspected_once_per_template(param):
+    def success_handler(response, context=None):
+        assert context.state == State.SUCCESS
+
+    plain_handler = MagicMock()
+
+    with patch(
+        "stream_processor.tasks.inspect.getfullargspec",
+        wraps=inspect.getfullargspec,
+    ) as getfullargspec:
+        template = Task(
+            lambda x: x * 2,
+            on_start_handlers=[plain_handler],
+            on_completion_success_handlers=[success_handler],
+        )
+        introspections = getfullargspec.call_count
+
+        for _ in range(5):
+            assert template.spawn()(param) == param * 2
+
+        assert getfullargspec.call_count == introspections
+
+    assert plain_handler.call_count == 5
+    assert all(call == ((), {}) for call in plain_handler.call_args_list)
+
+
+def test_event_bus_runs_handlers_off_the_workers():
+    release = threading.Event()
+    threads = []
+
+    def slow_handler(response, context=None):
+        release.wait()
+        threads.append((threading.current_thread().name, context.task_name))
+
+    with EventBus() as bus:
+        task = Task(
+            lambda x: x * 2,
+            on_completion_success_handlers=[slow_handler],
+            event_bus=bus,
+            task_name="double",
+        )
+        scheduler = ThreadPoolScheduler(max_workers=2)
+
+        # the workers don't wait for the handlers
+        assert [0, 2, 4] == list(scheduler.map(task, range(3)))
+        release.set()
+        bus.flush()
+
+    assert [("EventBus-0", "double")] * 3 == threads
+    assert 3 == bus.handled
+
+
+@settings(deadline=None, max_examples=20)
+@given(params=lists(integers(), max_size=50), batch_size=integers(1, 20))
+def test_event_bus_calls_batch_handlers_with_lists_of_events(params, batch_size):
+    batches = []
+    with EventBus(batch_size=batch_size) as bus:
+        task = Task(
+            lambda x: x * 2,
+            on_completion_success_handlers=[BatchHandler(batches.append)],
+            event_bus=bus,
+        )
+        assert [x * 2 for x in params] == list(ThreadPoolScheduler().map(task, params))
+
+    assert all(1 <= len(batch) <= batch_size for batch in batches)
+    events = [event for batch in batches for event in batch]
+    assert sorted(x * 2 for x in params) == sorted(event.args[0] for event in events)
+    assert all(event.state == State.SUCCESS for event in events)
+
+
+@given(param=integers())
+def test_event_bus_keeps_inline_handlers_on_the_worker(param):
+    calls = []
+
+    def inline_handler(response, context=None):
+        calls.append((response, context.state, threading.current_thread().name))
+
+    with EventBus() as bus:
+        task = Task(
+            lambda x: x * 2,
+            on_completion_success_handlers=[InlineHandler(inline_handler)],
+            event_bus=bus,
+        )
+        task(param)
+        # called before the task returned, on the calling thread
+        assert [(param * 2, State.SUCCESS, "MainThread")] == calls
+
+    assert 0 == bus.handled
+
+
+def test_event_bus_drops_events_when_full():
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_handler(response):
+        started.set()
+        release.wait()
+
+    with EventBus(max_size=1, drop_when_full=True) as bus:
+        task = Task(
+            lambda x: x,
+            on_completion_success_handlers=[blocking_handler],
+            event_bus=bus,
+        )
+        task.spawn()(0)
+        started.wait()
+        for param in range(1, 5):
+            task.spawn()(param)
+        release.set()
+
+    # one event held by the handler, one queued
+    assert 3 == bus.dropped
+    assert 2 == bus.handled
+
+
+def test_event_bus_counts_handler_errors():
+    errors = []
+
+    def failing_handler(response):
+        raise ValueError(response)
+
+    with EventBus(on_error=errors.append) as bus:
+        task = Task(
+            lambda x: x,
+            on_completion_success_handlers=[failing_handler],
+            event_bus=bus,
+        )
+        assert 1 == task(1)
+        assert task.state == State.SUCCESS
+
+    assert 1 == bus.failed
+    assert [1] == [error.args[0] for error in errors]
+
+
+def test_batch_handler_needs_an_event_bus():
+    with pytest.raises(ValueError):
+        Task(lambda x: x, on_completion_success_handlers=[BatchHandler(print)])
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import floats, integers, lists
+
+from stream_processor.limits import AdaptiveConcurrency, TokenBucket
+from stream_processor.retries import RetryPolicy
+from stream_processor.schedulers import SerialScheduler, ThreadPoolScheduler
+
+
+def double(x):
+    return x * 2
+
+
+@given(burst=integers(1, 20))
+def test_token_bucket_allows_burst_then_throttles(burst):
+    bucket = TokenBucket(rate=0.001, burst=burst)
+
+    assert [0.0] * burst == [bucket.try_acquire() for _ in range(burst)]
+    assert bucket.try_acquire() > 0
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=100)
+    bucket.acquire()
+    wait = bucket.try_acquire()
+
+    assert 0 < wait <= 0.01
+    time.sleep(wait)
+    assert 0 == bucket.try_acquire()
+
+
+@pytest.mark.parametrize("arg", [{"rate": 0}, {"rate": 1, "burst": 0}])
+def test_token_bucket_rejects_invalid_arguments(arg):
+    with pytest.raises(ValueError):
+        TokenBucket(**arg)
+
+
+@settings(deadline=None, max_examples=10)
+@given(items=lists(integers(), max_size=20))
+def test_rate_limited_scheduler_caps_rate(items):
+    rate = 200
+    scheduler = ThreadPoolScheduler(rate_limit=TokenBucket(rate, burst=5))
+
+    started = time.monotonic()
+    assert [double(x) for x in items] == list(scheduler.map(double, items))
+    assert time.monotonic() - started >= (len(items) - 5) / rate
+
+
+def test_rate_limit_applies_to_retries():
+    calls = []
+
+    def flaky(x):
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise ValueError()
+        return x
+
+    scheduler = SerialScheduler(
+        retry_policy=RetryPolicy(backoff=0, jitter=0),
+        rate_limit=TokenBucket(rate=50),
+    )
+
+    assert [1] == list(scheduler.map(flaky, [1]))
+    assert calls[2] - calls[0] >= 0.03
+
+
+@given(latencies=lists(floats(0.001, 0.002), min_size=1, max_size=100))
+def test_adaptive_concurrency_grows_while_healthy(latencies):
+    concurrency = AdaptiveConcurrency(max_limit=10)
+    for latency in latencies:
+        concurrency.observe(latency, failed=False)
+
+    assert 1 <= concurrency.limit <= 10
+    assert 0 == concurrency.decreases
+    assert concurrency.limit >= min(len(latencies) ** 0.5, 10) - 1
+
+
+def test_adaptive_concurrency_backs_off_once_per_round():
+    concurrency = AdaptiveConcurrency(initial_limit=50, backoff_ratio=0.5)
+
+    for _ in range(10):
+        concurrency.observe(0.01, failed=True)
+
+    assert 25 == concurrency.limit
+    assert 1 == concurrency.decreases
+
+
+def test_adaptive_concurrency_backs_off_on_slow_tasks():
+    concurrency = AdaptiveConcurrency(initial_limit=10, latency_tolerance=2)
+    concurrency.observe(0.01, failed=False)
+    concurrency.observe(0.05, failed=False)
+
+    assert 9 == concurrency.limit
+    assert 1 == concurrency.decreases
+
+
+def test_adaptive_scheduler_limits_in_flight_tasks():
+    concurrency = AdaptiveConcurrency(initial_limit=2, max_limit=8)
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def tracked(x):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.001)
+        with lock:
+            in_flight[0] -= 1
+        return x
+
+    scheduler = ThreadPoolScheduler(max_workers=2, concurrency=concurrency)
+
+    assert list(range(100)) == list(scheduler.map(tracked, range(100)))
+    assert in_flight[1] <= 8
+    assert concurrency.limit > 2
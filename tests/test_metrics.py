@@ -0,0 +1,117 @@
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists
+
+from stream_processor import metrics
+from stream_processor.metrics import InMemoryMetrics, PrometheusExporter, Histogram
+from stream_processor.schedulers import ThreadPoolScheduler, SerialScheduler
+from stream_processor.tasks import Task, State
+
+
+def some_func(x):
+    return x * 2
+
+
+def error_func(x):
+    raise Exception
+
+
+@settings(deadline=None)
+@given(data=lists(elements=integers(), max_size=50))
+def test_metrics_count_task_transitions(data):
+    registry = metrics.enable(InMemoryMetrics())
+    try:
+        scheduler = ThreadPoolScheduler()
+        for param in data:
+            scheduler.add_task(some_func if param % 2 else error_func, param)
+        list(scheduler.results())
+    finally:
+        metrics.disable()
+
+    successes = len([param for param in data if param % 2])
+    failures = len(data) - successes
+
+    counter = registry.counter
+    assert counter(metrics.TRANSITIONS, task="some_func", state="QUEUED") == successes
+    assert counter(metrics.TRANSITIONS, task="some_func", state="SUCCESS") == successes
+    assert counter(metrics.TRANSITIONS, task="error_func", state="FAILED") == failures
+
+    if successes:
+        queued = registry.histogram(
+            metrics.STATE_DURATION, task="some_func", state="QUEUED"
+        )
+        running = registry.histogram(
+            metrics.STATE_DURATION, task="some_func", state="RUNNING"
+        )
+        assert queued.count == successes
+        assert running.count == successes
+
+
+def test_metrics_record_scheduler_gauges():
+    registry = metrics.enable(InMemoryMetrics())
+    try:
+        scheduler = SerialScheduler()
+        for param in range(3):
+            scheduler.add_task(some_func, param)
+        results = scheduler.results()
+        next(results)
+        assert registry.gauge(metrics.QUEUE_DEPTH, scheduler="SerialScheduler") == 2
+        assert registry.gauge(metrics.IN_FLIGHT, scheduler="SerialScheduler") == 1
+        list(results)
+    finally:
+        metrics.disable()
+
+
+def test_metrics_use_task_name():
+    registry = metrics.enable(InMemoryMetrics())
+    try:
+        Task(lambda x: x, task_name="identity")(1)
+    finally:
+        metrics.disable()
+
+    assert registry.counter(metrics.TRANSITIONS, task="identity", state="SUCCESS") == 1
+
+
+def test_metrics_are_not_recorded_when_disabled():
+    registry = InMemoryMetrics()
+    task = Task(some_func)
+    task(1)
+
+    assert task.state == State.SUCCESS
+    assert registry.counters == {}
+    assert metrics.recorder is None
+
+
+@given(values=lists(elements=integers(0, 20), max_size=50))
+def test_histogram_buckets_are_cumulative(values):
+    histogram = Histogram(buckets=(5, 10))
+    for value in values:
+        histogram.observe(value)
+
+    assert histogram.cumulative_counts() == [
+        (5, len([value for value in values if value <= 5])),
+        (10, len([value for value in values if value <= 10])),
+        (float("inf"), len(values)),
+    ]
+    assert histogram.sum == sum(values)
+
+
+def test_prometheus_exporter_renders_text_format():
+    registry = InMemoryMetrics(buckets=(1.0,))
+    registry.increment(metrics.TRANSITIONS, (("state", "SUCCESS"), ("task", "f")))
+    registry.set_gauge(metrics.IN_FLIGHT, (("scheduler", "s"),), 3)
+    registry.observe(metrics.STATE_DURATION, (("state", "RUNNING"), ("task", "f")), 0.5)
+
+    text = PrometheusExporter(registry).render()
+
+    assert "# TYPE task_transitions_total counter" in text
+    assert 'task_transitions_total{state="SUCCESS",task="f"} 1' in text
+    assert 'scheduler_tasks_in_flight{scheduler="s"} 3' in text
+    assert (
+        'task_state_duration_seconds_bucket{state="RUNNING",task="f",le="1.0"} 1'
+        in text
+    )
+    assert (
+        'task_state_duration_seconds_bucket{state="RUNNING",task="f",le="+Inf"} 1'
+        in text
+    )
+    assert 'task_state_duration_seconds_count{state="RUNNING",task="f"} 1' in text
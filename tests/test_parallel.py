@@ -0,0 +1,126 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import binary, integers, lists
+
+if sys.version_info < (3, 8):
+    pytest.skip("shared memory needs Python 3.8", allow_module_level=True)
+
+from stream_processor.checkpoints import SQLiteCheckpointStore
+from stream_processor.exceptions import CheckpointError
+from stream_processor.parallel import RingBuffer, _DATA, _encode
+from stream_processor.stream import Stream
+
+
+def double(x):
+    return x * 2
+
+
+def is_odd(x):
+    return x % 2
+
+
+def fail_on_seven(x):
+    if x == 7:
+        raise ValueError(x)
+    return x
+
+
+def roundtrip(ring, value):
+    import pickle
+
+    assert ring.put(_DATA, *_encode(value))
+    kind, data, buffers = ring.get()
+    result = pickle.loads(data, buffers=[bytearray(b) for b in buffers])
+    ring.release()
+    return kind, result
+
+
+@given(values=lists(binary(max_size=300), max_size=10))
+def test_ring_buffer_roundtrips_records(values):
+    ring = RingBuffer(slots=2, slot_size=256)
+    try:
+        for value in values:
+            # records larger than a slot spill to a segment of their own
+            assert roundtrip(ring, value) == (_DATA, value)
+    finally:
+        ring.close(written=True)
+
+
+def test_ring_buffer_reads_arrays_in_place():
+    ring = RingBuffer(slots=1, slot_size=1 << 16)
+    array = np.arange(1000)
+    try:
+        assert ring.put(_DATA, *_encode(array))
+        import pickle
+
+        _, data, buffers = ring.get()
+        result = pickle.loads(data, buffers=buffers)
+        assert not result.flags.owndata
+        assert (result == array).all()
+        del result
+        ring.release()
+    finally:
+        ring.close(written=True)
+
+
+def test_ring_buffer_put_blocks_while_full():
+    ring = RingBuffer(slots=2, slot_size=64)
+    try:
+        assert ring.put(_DATA, b"1", timeout=0)
+        assert ring.put(_DATA, b"2", timeout=0)
+        assert not ring.put(_DATA, b"3", timeout=0.01)
+
+        ring.get()
+        ring.release()
+        assert ring.put(_DATA, b"3", timeout=0)
+    finally:
+        ring.close(written=True)
+
+
+@settings(deadline=None, max_examples=5)
+@given(data=lists(integers(), max_size=500), batch_size=integers(1, 64))
+def test_parallel_stages_keep_order(data, batch_size):
+    stream = (
+        Stream(data)
+        .parallelize(2, batch_size=batch_size)
+        .map(double)
+        .filter(is_odd)
+        .parallelize(3, batch_size=batch_size)
+        .map(double)
+    )
+
+    assert [x * 4 for x in data if x * 2 % 2] == stream.list()
+
+
+def test_parallel_arrays_larger_than_slots():
+    arrays = [np.full(10000, i) for i in range(20)]
+
+    results = Stream(arrays).parallelize(2, batch_size=3, slot_size=4096).map(double)
+
+    assert [(a * 2).tolist() for a in arrays] == [r.tolist() for r in results]
+
+
+def test_parallel_worker_errors_are_raised():
+    stream = Stream(range(100)).parallelize(2, batch_size=4).map(fail_on_seven)
+
+    with pytest.raises(ValueError):
+        stream.list()
+
+
+def test_parallel_stages_are_explained():
+    stream = Stream(range(3)).parallelize(4).map(double).filter(is_odd)
+
+    assert stream.explain().startswith(
+        "Parallel(map(double) -> filter(is_odd), processes=4)"
+    )
+
+
+def test_parallel_stages_cannot_be_checkpointed(tmp_path):
+    store = SQLiteCheckpointStore(os.path.join(str(tmp_path), "checkpoints.db"))
+
+    with pytest.raises(CheckpointError):
+        Stream(range(3)).parallelize(2).map(double).checkpoint(store, "p").list()
@@ -0,0 +1,78 @@
+import time
+
+from hypothesis import given
+from hypothesis.strategies import integers, floats
+
+from stream_processor.retries import RetryPolicy, RetryBudget
+
+
+@given(
+    attempts=integers(1, 10),
+    backoff=floats(0.001, 1),
+    jitter=floats(0, 0.5),
+)
+def test_retry_policy_backs_off_exponentially(attempts, backoff, jitter):
+    policy = RetryPolicy(
+        max_attempts=11, backoff=backoff, multiplier=2, max_backoff=1000, jitter=jitter
+    )
+    expected_delay = backoff * 2 ** (attempts - 1)
+
+    delay = policy.next_delay(attempts, Exception())
+
+    assert expected_delay * (1 - jitter) <= delay <= expected_delay * (1 + jitter)
+
+
+@given(attempts=integers(1, 10))
+def test_retry_policy_caps_backoff(attempts):
+    policy = RetryPolicy(max_attempts=11, backoff=1, max_backoff=1.5, jitter=0)
+    assert policy.next_delay(attempts, Exception()) <= 1.5
+
+
+@given(max_attempts=integers(1, 10))
+def test_retry_policy_stops_after_max_attempts(max_attempts):
+    policy = RetryPolicy(max_attempts=max_attempts)
+    assert policy.next_delay(max_attempts, Exception()) is None
+
+
+def test_retry_policy_only_retries_matching_errors():
+    policy = RetryPolicy(retry_on=(TimeoutError,))
+
+    assert policy.next_delay(1, TimeoutError()) is not None
+    assert policy.next_delay(1, ValueError()) is None
+
+
+@given(max_retries=integers(0, 10))
+def test_retry_budget_is_shared_between_policies(max_retries):
+    budget = RetryBudget(max_retries)
+    policies = [RetryPolicy(budget=budget), RetryPolicy(budget=budget)]
+
+    retries = [
+        policy.next_delay(1, Exception())
+        for _ in range(max_retries + 1)
+        for policy in policies
+    ]
+
+    assert len([delay for delay in retries if delay is not None]) == max_retries
+    assert budget.remaining == 0
+
+
+def test_retry_budget_refills_after_window():
+    budget = RetryBudget(2, window=0.05)
+    policy = RetryPolicy(max_attempts=10, budget=budget)
+
+    assert policy.next_delay(1, Exception()) is not None
+    assert policy.next_delay(1, Exception()) is not None
+    assert policy.next_delay(1, Exception()) is None
+
+    time.sleep(0.05)
+
+    assert budget.remaining == 2
+    assert policy.next_delay(1, Exception()) is not None
+
+
+def test_retry_budget_without_window_never_refills():
+    budget = RetryBudget(1, window=None)
+
+    assert budget.acquire()
+    time.sleep(0.01)
+    assert not budget.acquire()
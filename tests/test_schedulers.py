@@ -1,7 +1,22 @@
-from hypothesis import given
-from hypothesis.strategies import integers, text, one_of
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
 
-from stream_processor.schedulers import ThreadPoolScheduler, SerialScheduler
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import integers, text, one_of, lists, tuples
+
+from stream_processor.schedulers import (
+    Scheduler,
+    ThreadPoolScheduler,
+    SerialScheduler,
+    ProcessPoolScheduler,
+    AsyncIOScheduler,
+    WorkStealingScheduler,
+)
+from stream_processor.exceptions import DeadlineExceeded
+from stream_processor.retries import RetryPolicy
 from stream_processor.tasks import Task, State
 
 
@@ -83,6 +98,19 @@ def test_serial_scheduler_returns_error_result(param):
     assert _result is None
 
 
+def test_scheduler_subclass_overriding_results():
+    class ListScheduler(Scheduler):
+        def results(self):
+            return [task(params) for task, params in self.tasks]
+
+    scheduler = ListScheduler()
+    for param in range(3):
+        scheduler.add_task(some_func, param)
+
+    assert scheduler.results() == [0, 2, 4]
+    assert list(scheduler.map(some_func, range(3))) == [0, 2, 4]
+
+
 @given(param=one_of([text(min_size=1), integers()]),)
 def test_thread_pool_scheduler_returns_error_result(param):
     def error_func(x):
@@ -98,3 +126,517 @@ def test_thread_pool_scheduler_returns_error_result(param):
 
     assert task.state == State.FAILED
     assert _result is None
+
+
+def error_func(x):
+    raise ValueError(x)
+
+
+def context_func(x, context=None):
+    context["seen"] = x
+    return x * 2
+
+
+@settings(max_examples=10, deadline=None)
+@given(data=lists(elements=integers(), max_size=50), chunk_size=integers(1, 10))
+def test_process_pool_scheduler_returns_results_in_order(data, chunk_size):
+    scheduler = ProcessPoolScheduler(max_workers=2, chunk_size=chunk_size)
+    tasks = [Task(some_func) for _ in data]
+    for task, param in zip(tasks, data):
+        scheduler.add_task(task, param)
+
+    assert list(scheduler.results()) == [some_func(param) for param in data]
+    assert all(task.state == State.SUCCESS for task in tasks)
+
+
+@settings(max_examples=10, deadline=None)
+@given(param=integers())
+def test_process_pool_scheduler_returns_error_result(param):
+    failure_handler = MagicMock()
+    scheduler = ProcessPoolScheduler(max_workers=1)
+    task = Task(error_func, on_failure_handlers=[failure_handler])
+    scheduler.add_task(task, param)
+
+    assert list(scheduler.results()) == [None]
+    assert task.state == State.FAILED
+    assert isinstance(task.error, ValueError)
+    assert failure_handler.called
+
+
+@settings(max_examples=10, deadline=None)
+@given(param=integers())
+def test_process_pool_scheduler_merges_context(param):
+    success_handler = MagicMock()
+    scheduler = ProcessPoolScheduler(max_workers=1)
+    task = Task(context_func, on_completion_success_handlers=[success_handler])
+    scheduler.add_task(task, param)
+
+    assert list(scheduler.results()) == [param * 2]
+    assert task.context["seen"] == param
+    success_handler.assert_called_once_with(param * 2)
+
+
+@settings(deadline=None)
+@given(data=lists(elements=integers(), max_size=100), limit=integers(1, 20))
+def test_asyncio_scheduler_returns_results_in_order(data, limit):
+    async def func(x):
+        await asyncio.sleep(0)
+        return x * 2
+
+    scheduler = AsyncIOScheduler(max_concurrency=limit)
+    tasks = [Task(func) for _ in data]
+    for task, param in zip(tasks, data):
+        scheduler.add_task(task, param)
+
+    assert list(scheduler.results()) == [some_func(param) for param in data]
+    assert all(task.state == State.SUCCESS for task in tasks)
+
+
+def test_asyncio_scheduler_runs_tasks_concurrently():
+    in_flight = []
+    peak = []
+
+    async def func(x):
+        in_flight.append(x)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(x)
+        return x
+
+    scheduler = AsyncIOScheduler(max_concurrency=50)
+    for param in range(200):
+        scheduler.add_task(func, param)
+
+    assert list(scheduler.results()) == list(range(200))
+    assert max(peak) == 50
+
+
+@given(param=integers())
+def test_asyncio_scheduler_returns_error_result(param):
+    async def func(x):
+        raise Exception
+
+    scheduler = AsyncIOScheduler()
+    task = Task(func)
+    scheduler.add_task(task, param)
+
+    assert list(scheduler.results()) == [None]
+    assert task.state == State.FAILED
+
+
+def _tracking_func(in_flight, peak, lock):
+    def func(x):
+        with lock:
+            in_flight.append(x)
+            peak.append(len(in_flight))
+        time.sleep(0.001)
+        with lock:
+            in_flight.remove(x)
+        return x
+
+    return func
+
+
+@settings(max_examples=20, deadline=None)
+@given(
+    data=lists(elements=integers(), max_size=50, unique=True),
+    max_in_flight=integers(1, 8),
+)
+def test_thread_pool_scheduler_bounds_tasks_in_flight(data, max_in_flight):
+    in_flight, peak, lock = [], [0], threading.Lock()
+    func = _tracking_func(in_flight, peak, lock)
+
+    scheduler = ThreadPoolScheduler(max_workers=10, max_in_flight=max_in_flight)
+    for param in data:
+        scheduler.add_task(func, param)
+
+    assert list(scheduler.results()) == data
+    assert max(peak) <= max_in_flight
+
+
+def test_thread_pool_scheduler_pulls_tasks_lazily():
+    scheduler = ThreadPoolScheduler(max_workers=2, max_in_flight=2)
+    tasks = [Task(some_func) for _ in range(20)]
+    for param, task in enumerate(tasks):
+        scheduler.add_task(task, param)
+
+    results = scheduler.results()
+    assert next(results) == 0
+
+    started = [task for task in tasks if task.state != State.QUEUED]
+    assert len(started) <= 4
+
+
+def test_thread_pool_scheduler_yields_in_completion_order():
+    def func(x):
+        time.sleep(x)
+        return x
+
+    scheduler = ThreadPoolScheduler(max_workers=3, ordered=False)
+    for param in [0.2, 0.1, 0.0]:
+        scheduler.add_task(func, param)
+
+    assert list(scheduler.results()) == [0.0, 0.1, 0.2]
+
+
+def test_thread_pool_scheduler_bounds_reorder_buffer():
+    release = threading.Event()
+    started_while_blocked = []
+
+    def func(x):
+        if x == 0:
+            release.wait(1)
+        elif not release.is_set():
+            started_while_blocked.append(x)
+        return x
+
+    scheduler = ThreadPoolScheduler(
+        max_workers=4, max_in_flight=4, reorder_buffer_size=2
+    )
+    for param in range(10):
+        scheduler.add_task(func, param)
+
+    results = scheduler.results()
+    threading.Timer(0.2, release.set).start()
+    assert list(results) == list(range(10))
+    # The blocked head, plus at most a full buffer and running window behind it
+    assert len(started_while_blocked) <= 2 + 4 - 1
+
+
+@given(
+    tasks=lists(elements=tuples(integers(-3, 3), integers()), max_size=50),
+)
+def test_scheduler_runs_tasks_by_priority(tasks):
+    scheduler = SerialScheduler()
+    for priority, param in tasks:
+        scheduler.add_task(some_func, param, priority=priority)
+
+    expected_result = [
+        some_func(param) for priority, param in sorted(tasks, key=lambda t: t[0])
+    ]
+    assert list(scheduler.results()) == expected_result
+
+
+def test_scheduler_queues_many_tasks():
+    scheduler = SerialScheduler()
+    for param in range(100000):
+        scheduler.add_task(some_func, param)
+
+    assert len(scheduler.tasks) == 100000
+    assert sum(scheduler.results()) == some_func(sum(range(100000)))
+
+
+def test_scheduler_picks_up_tasks_added_while_consuming_results():
+    scheduler = ThreadPoolScheduler(max_workers=2)
+    scheduler.add_task(some_func, 0)
+
+    results = scheduler.results()
+    assert next(results) == 0
+
+    thread = threading.Thread(target=scheduler.add_task, args=(some_func, 1))
+    thread.start()
+    thread.join()
+    assert list(results) == [2]
+
+
+@given(params=lists(elements=integers(), min_size=1, max_size=20))
+def test_scheduler_terminates_tasks_without_draining_queue(params):
+    termination_handler = MagicMock()
+    scheduler = SerialScheduler()
+    tasks = [Task(some_func, on_termination_handlers=[termination_handler])]
+    tasks += [Task(some_func) for _ in params[1:]]
+    for task, param in zip(tasks, params):
+        scheduler.add_task(task, param)
+
+    assert scheduler.tasks.states() == {State.QUEUED: len(params)}
+
+    scheduler.terminate_tasks()
+
+    assert termination_handler.called
+    assert len(scheduler.tasks) == 0
+    assert scheduler.tasks.states() == {State.TERMINATED: len(params)}
+
+    scheduler.reject_tasks()
+    assert all(task.state == State.REJECTED for task in tasks)
+    assert list(scheduler.results()) == []
+
+
+def _flaky_func(failures):
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        if len(calls) <= failures:
+            raise ConnectionError
+        return x * 2
+
+    return func
+
+
+@given(param=integers(), failures=integers(0, 2))
+def test_scheduler_retries_failed_tasks(param, failures):
+    failure_handler = MagicMock()
+    queue_handler = MagicMock()
+    policy = RetryPolicy(max_attempts=3, backoff=0.0001)
+
+    for scheduler in [SerialScheduler(), ThreadPoolScheduler(retry_policy=policy)]:
+        failure_handler.reset_mock()
+        queue_handler.reset_mock()
+        task = Task(
+            _flaky_func(failures),
+            on_failure_handlers=[failure_handler],
+            on_queue_handlers=[queue_handler],
+            retry_policy=policy,
+        )
+        scheduler.add_task(task, param)
+
+        assert list(scheduler.results()) == [param * 2]
+        assert task.state == State.SUCCESS
+        assert task.context.attempts == failures + 1
+        assert failure_handler.call_count == failures
+        assert queue_handler.call_count == failures + 1
+
+
+@given(param=integers())
+def test_scheduler_gives_up_after_max_attempts(param):
+    scheduler = SerialScheduler(retry_policy=RetryPolicy(max_attempts=2, backoff=0))
+    task = Task(_flaky_func(failures=5))
+    scheduler.add_task(task, param)
+
+    assert list(scheduler.results()) == [None]
+    assert task.state == State.FAILED
+    assert task.context.attempts == 2
+
+
+def test_scheduler_does_not_hold_worker_while_waiting_to_retry():
+    scheduler = ThreadPoolScheduler(
+        max_workers=1,
+        ordered=False,
+        retry_policy=RetryPolicy(backoff=0.2, jitter=0),
+    )
+    scheduler.add_task(_flaky_func(failures=1), "retried")
+    scheduler.add_task(lambda x: x, "next")
+
+    assert list(scheduler.results()) == ["next", "retriedretried"]
+
+
+@given(params=lists(elements=integers(), max_size=20))
+def test_scheduler_keeps_order_of_retried_tasks(params):
+    scheduler = ThreadPoolScheduler(
+        max_workers=4, retry_policy=RetryPolicy(backoff=0.0001)
+    )
+    for param in params:
+        scheduler.add_task(_flaky_func(failures=param % 2), param)
+
+    assert list(scheduler.results()) == [some_func(param) for param in params]
+
+
+def _hang(event):
+    def func(x):
+        if x < 0:
+            event.wait()
+        return x
+
+    return func
+
+
+def test_scheduler_queue_length_counts_tasks_left_to_run():
+    scheduler = SerialScheduler()
+    for param in range(3):
+        scheduler.add_task(some_func, param)
+    scheduler.terminate_tasks()
+    for param in range(2):
+        scheduler.add_task(some_func, param, priority=-1)
+    scheduler.add_task(some_func, 2)
+
+    assert len(scheduler.tasks) == 3
+    assert next(scheduler.results()) == 0
+    assert len(scheduler.tasks) == 2
+    assert list(scheduler.results()) == [2, 4]
+    assert len(scheduler.tasks) == 0
+
+
+def test_scheduler_terminates_tasks_past_their_timeout():
+    release = threading.Event()
+    termination_handler = MagicMock()
+    hung = Task(
+        _hang(release), timeout=0.05, on_termination_handlers=[termination_handler]
+    )
+    with ThreadPoolScheduler(max_workers=2) as scheduler:
+        scheduler.add_task(hung, -1)
+        scheduler.add_task(Task(_hang(release), timeout=0.05), 1)
+
+        assert list(scheduler.results()) == [None, 1]
+        assert hung.state == State.TERMINATED
+        assert termination_handler.call_count == 1
+        assert scheduler.expired == 1
+
+        # returning late doesn't move the task out of TERMINATED
+        release.set()
+        time.sleep(0.01)
+        assert hung.state == State.TERMINATED
+        assert hung.result is None
+
+
+@given(params=lists(elements=integers(-3, 3), max_size=10))
+@settings(deadline=None, max_examples=10)
+def test_scheduler_task_timeout_keeps_order(params):
+    release = threading.Event()
+    scheduler = ThreadPoolScheduler(max_workers=4, task_timeout=0.02)
+
+    results = list(scheduler.map(_hang(release), params))
+    release.set()
+    scheduler.close()
+
+    assert results == [None if x < 0 else x for x in params]
+    assert scheduler.expired == sum(1 for x in params if x < 0)
+
+
+def test_asyncio_scheduler_terminates_tasks_past_their_timeout():
+    async def slow(x):
+        await asyncio.sleep(x)
+        return x
+
+    with AsyncIOScheduler(task_timeout=0.05) as scheduler:
+        assert list(scheduler.map(slow, [0.01, 1, 0])) == [0.01, None, 0]
+        assert scheduler.expired == 1
+
+
+def sleep_and_return(x):
+    time.sleep(x)
+    return x
+
+
+def test_process_pool_timeout_runs_from_the_start_in_the_worker():
+    with ProcessPoolScheduler(max_workers=1, task_timeout=0.5) as scheduler:
+        # queued behind each other on a single worker, each within its timeout
+        assert list(scheduler.map(sleep_and_return, [0.2] * 4)) == [0.2] * 4
+        assert scheduler.expired == 0
+
+    with ProcessPoolScheduler(max_workers=4, task_timeout=0.3) as scheduler:
+        results = list(scheduler.map(sleep_and_return, [2, 0.01, 0.01, 0.01]))
+        assert results == [None, 0.01, 0.01, 0.01]
+        assert scheduler.expired == 1
+
+
+def test_process_pool_rejects_timeout_with_chunks():
+    with pytest.raises(ValueError):
+        ProcessPoolScheduler(chunk_size=4, task_timeout=1)
+
+
+def test_scheduler_deadline_terminates_remaining_tasks():
+    release = threading.Event()
+    scheduler = ThreadPoolScheduler(max_workers=1, max_in_flight=2)
+    tasks = [Task(_hang(release)) for _ in range(4)]
+    for task, param in zip(tasks, [1, -1, 2, 3]):
+        scheduler.add_task(task, param)
+
+    results = []
+    try:
+        for result in scheduler.results(deadline=0.05):
+            results.append(result)
+    except DeadlineExceeded:
+        pass
+    else:
+        raise AssertionError("Expected DeadlineExceeded")
+    finally:
+        release.set()
+        scheduler.close()
+
+    assert results == [1]
+    assert [task.state for task in tasks] == [State.SUCCESS] + [State.TERMINATED] * 3
+
+
+def test_scheduler_close_releases_workers():
+    with ThreadPoolScheduler(max_workers=4) as scheduler:
+        assert list(scheduler.map(some_func, range(10))) == list(range(0, 20, 2))
+        task = Task(some_func)
+        scheduler.add_task(task, 1)
+
+    assert task.state == State.TERMINATED
+    assert not any(
+        thread.name.startswith("ThreadPoolExecutor") and thread.is_alive()
+        for thread in scheduler._pool._threads
+    )
+
+
+@settings(max_examples=20, deadline=None)
+@given(data=lists(elements=integers(), max_size=50), workers=integers(1, 4))
+def test_work_stealing_scheduler_returns_results_in_order(data, workers):
+    with WorkStealingScheduler(max_workers=workers) as scheduler:
+        assert [some_func(x) for x in data] == list(scheduler.map(some_func, data))
+        assert len(data) == sum(stats.executed for stats in scheduler.stats())
+
+
+def test_work_stealing_scheduler_steals_from_busy_workers():
+    release = threading.Event()
+    subtasks = []
+
+    def fork(n):
+        subtasks.extend(scheduler.submit(some_func, x) for x in range(n))
+        # holds up its worker, but not the subtasks queued on it
+        release.wait()
+        return n
+
+    with WorkStealingScheduler(max_workers=2) as scheduler:
+        parent = scheduler.submit(fork, 5)
+        time.sleep(0.05)
+        assert [some_func(x) for x in range(5)] == [
+            subtask.result(timeout=1) for subtask in subtasks
+        ]
+        assert 5 <= sum(stats.steals for stats in scheduler.stats())
+        assert 0 < sum(stats.idle for stats in scheduler.stats())
+
+        release.set()
+        assert 5 == parent.result()
+
+
+def test_work_stealing_scheduler_idle_workers_sleep_until_notified():
+    with WorkStealingScheduler(max_workers=4) as scheduler:
+        assert [some_func(x) for x in range(8)] == list(
+            scheduler.map(some_func, range(8))
+        )
+        # the workers woken for the last tasks settle down
+        time.sleep(0.05)
+        idle = sum(stats.idle for stats in scheduler.stats())
+        time.sleep(0.1)
+        assert idle == sum(stats.idle for stats in scheduler.stats())
+
+
+def test_work_stealing_scheduler_runs_subtasks_locally():
+    threads = []
+
+    def split(n):
+        threads.append(threading.current_thread())
+        if n < 2:
+            return n
+        left, right = scheduler.submit(split, n - 1), scheduler.submit(split, n - 2)
+        # waiting for the subtasks runs them, even on a single worker
+        return left.result() + right.result()
+
+    with WorkStealingScheduler(max_workers=1) as scheduler:
+        assert [55] == list(scheduler.map(split, [10]))
+        assert {scheduler._workers[0]} == set(threads)
+        assert scheduler.stats()[0].executed == len(threads)
+        assert scheduler.stats()[0].steals == 0
+
+
+def test_work_stealing_scheduler_subtask_raises_error():
+    def fail(x):
+        raise ValueError(x)
+
+    with WorkStealingScheduler(max_workers=2) as scheduler:
+        future = scheduler.submit(Task(fail), 1)
+        try:
+            future.result()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Expected ValueError")
+
+
+def test_work_stealing_scheduler_close_stops_workers():
+    with WorkStealingScheduler(max_workers=4) as scheduler:
+        assert list(range(0, 20, 2)) == list(scheduler.map(some_func, range(10)))
+
+    assert not any(worker.is_alive() for worker in scheduler._workers)
@@ -1,7 +1,20 @@
-from hypothesis import given
-from hypothesis.strategies import integers, lists
+import itertools
+import threading
+import time
+from unittest.mock import MagicMock, patch
 
-from stream_processor.stream import Stream
+import pytest
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists, binary, tuples
+
+from stream_processor.exceptions import DeadlineExceeded
+from stream_processor.schedulers import (
+    ThreadPoolScheduler,
+    SerialScheduler,
+    IN_FLIGHT_PER_WORKER,
+)
+from stream_processor.stream import Stream, _compile
+from stream_processor.tasks import Task, State
 
 
 def some_func(x):
@@ -11,7 +24,10 @@ def some_func(x):
 @given(data=lists(elements=integers(), max_size=100))
 def test_map(data):
     class _FakeScheduler:
-        pass
+        @staticmethod
+        def map(func, items):
+            assert func == some_func
+            return map(func, items)
 
     stream = iter(data)
     expected_result = list(map(some_func, data))
@@ -52,6 +68,15 @@ def test_batch(count):
         assert data[i : i + count] == list(next(result))
 
 
+@given(data=lists(elements=integers(), max_size=100), count=integers(1, 10))
+def test_batch_of_fused_map_compiles_once(data, count):
+    with patch("stream_processor.stream._compile", wraps=_compile) as compile:
+        batches = Stream(iter(data)).map(some_func).batch(count).list()
+
+    assert [some_func(x) for x in data] == [x for batch in batches for x in batch]
+    assert compile.call_count == 1
+
+
 @given(data=lists(elements=integers(), max_size=1000))
 def test_concat(data):
 
@@ -86,15 +111,410 @@ def test_take_with_map_stream(count):
 
     class _FakeScheduler:
         @staticmethod
-        def add_task(func, *args, **kwargs):
+        def map(func, items):
             assert func == some_func
-
-        @staticmethod
-        def results():
-            return map(some_func, data[:count])
+            return map(func, items)
 
     expected_result = list(map(some_func, data[:count]))
 
     scheduler = _FakeScheduler()
     result = Stream(data).map(some_func, scheduler=scheduler).take(count)
     assert expected_result == list(result)
+
+
+@given(data=lists(elements=integers(), max_size=100))
+def test_map_without_scheduler(data):
+    result = Stream(iter(data)).map(some_func)
+    assert list(map(some_func, data)) == list(result)
+
+
+@settings(deadline=None)
+@given(count=integers(1, 100), max_workers=integers(1, 8))
+def test_map_streams_unbounded_input_through_scheduler(count, max_workers):
+    pulled = []
+
+    def source():
+        for item in itertools.count():
+            pulled.append(item)
+            yield item
+
+    scheduler = ThreadPoolScheduler(max_workers=max_workers)
+    result = Stream(source()).map(some_func, scheduler=scheduler)
+
+    assert [some_func(x) for x in range(count)] == list(itertools.islice(result, count))
+    assert len(pulled) <= count + max_workers * IN_FLIGHT_PER_WORKER
+
+
+@given(data=lists(elements=integers(), max_size=100))
+def test_map_keeps_read_ahead_items_between_iterations(data):
+    scheduler = ThreadPoolScheduler(max_workers=4)
+    result = Stream(iter(data)).map(some_func, scheduler=scheduler)
+
+    head = [next(result) for _ in data[:3]]
+    assert list(map(some_func, data)) == head + list(result)
+
+
+@given(data=lists(elements=integers(), min_size=1, max_size=100))
+def test_take_after_iteration_keeps_read_ahead_items(data):
+    scheduler = ThreadPoolScheduler(max_workers=4)
+    result = Stream(iter(data)).map(some_func, scheduler=scheduler)
+
+    head = next(result)
+    assert list(map(some_func, data[:4])) == [head] + result.take(3).list()
+
+
+@given(data=lists(elements=integers(), max_size=100))
+def test_map_spawns_task_template_per_item(data):
+    success_handler = MagicMock()
+    template = Task(some_func, on_completion_success_handlers=[success_handler])
+
+    result = Stream(iter(data)).map(template, scheduler=SerialScheduler())
+
+    assert list(map(some_func, data)) == list(result)
+    assert success_handler.call_count == len(data)
+    assert template.state == State.CREATED
+
+
+@given(
+    data=lists(elements=binary(max_size=20), max_size=100), max_weight=integers(20, 60)
+)
+def test_batch_with_max_weight(data, max_weight):
+    batches = Stream(iter(data)).batch(10, max_weight=max_weight).list()
+
+    assert data == [item for batch in batches for item in batch]
+    for batch in batches:
+        assert 0 < len(batch) <= 10
+        assert sum(map(len, batch)) <= max_weight
+
+
+@settings(max_examples=20, deadline=None)
+@given(data=lists(elements=integers(), max_size=100), count=integers(1, 20))
+def test_batch_with_max_latency_on_fast_source(data, count):
+    batches = Stream(iter(data)).batch(count, max_latency=1).list()
+
+    assert [data[i : i + count] for i in range(0, len(data), count)] == batches
+
+
+def test_batch_with_max_latency_emits_partial_batch_on_slow_source():
+    def slow_source():
+        yield from range(3)
+        time.sleep(0.5)
+        yield from range(3, 6)
+
+    started = time.monotonic()
+    batches = iter(Stream(slow_source()).batch(10, max_latency=0.05))
+
+    assert next(batches) == [0, 1, 2]
+    assert time.monotonic() - started < 0.4
+    assert list(batches) == [[3, 4, 5]]
+
+
+@settings(deadline=None)
+@given(
+    events=lists(elements=tuples(integers(0, 20), integers()), max_size=300),
+    partitions=integers(1, 8),
+)
+def test_partition_by_keeps_order_per_key(events, partitions):
+    processed = []
+    lock = threading.Lock()
+
+    def process(event):
+        with lock:
+            processed.append(event)
+        return event[1] * 2
+
+    scheduler = ThreadPoolScheduler(max_workers=4)
+    partitioned = Stream(iter(events)).partition_by(lambda e: e[0], partitions)
+    result = partitioned.map(process, scheduler=scheduler).list()
+
+    assert [some_func(value) for _, value in events] == result
+    for key in {key for key, _ in events}:
+        assert [e for e in processed if e[0] == key] == [
+            e for e in events if e[0] == key
+        ]
+    assert sum(partitioned.counts) == len(events)
+    assert partitioned.skew() >= 1.0
+
+
+def test_partition_by_runs_lanes_in_parallel():
+    events = [(key, value) for value in range(5) for key in range(4)]
+
+    def process(event):
+        time.sleep(0.02)
+        return event
+
+    partitioned = Stream(iter(events)).partition_by(lambda e: e[0], 4)
+    scheduler = ThreadPoolScheduler(max_workers=4)
+
+    started = time.monotonic()
+    assert events == partitioned.map(process, scheduler=scheduler).list()
+    assert time.monotonic() - started < len(events) * 0.02 / 2
+
+
+def test_partition_by_keeps_positions_with_unordered_scheduler():
+    def process(x):
+        # the lane of even items finishes last
+        time.sleep(0.02 if x % 2 == 0 else 0)
+        return x * 10
+
+    partitioned = Stream(range(6)).partition_by(lambda x: x % 2, 2)
+    scheduler = ThreadPoolScheduler(max_workers=2, ordered=False)
+
+    assert [0, 10, 20, 30, 40, 50] == partitioned.map(process, scheduler).list()
+
+
+def test_partition_by_reports_skew():
+    partitioned = Stream([1] * 30).partition_by(lambda x: x, 3)
+    partitioned.map(some_func).list()
+
+    assert sorted(partitioned.counts) == [0, 0, 30]
+    assert partitioned.skew() == 3.0
+
+
+@given(data=lists(elements=integers(), max_size=100))
+def test_fused_map_and_filter(data):
+    stream = Stream(iter(data)).map(some_func).filter(lambda x: x % 3).map(str)
+
+    assert [str(x * 2) for x in data if x * 2 % 3] == stream.list()
+    assert stream.explain().splitlines() == [
+        "Fused(map(some_func) -> filter(<lambda>) -> map(str))",
+        "  Source(list_iterator)",
+    ]
+
+
+@given(data=lists(elements=integers(), max_size=100))
+def test_fused_map_spawns_task_template_per_item(data):
+    success_handler = MagicMock()
+    template = Task(some_func, on_completion_success_handlers=[success_handler])
+
+    result = Stream(iter(data)).map(template).filter(lambda x: True).list()
+
+    assert list(map(some_func, data)) == result
+    assert success_handler.call_count == len(data)
+    assert template.state == State.CREATED
+
+
+@given(data=lists(elements=integers(), max_size=100), count=integers(0, 50))
+def test_take_is_pushed_below_maps(data, count):
+    source = iter(data)
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        return some_func(x)
+
+    stream = Stream(source).map(func).map(some_func).take(count)
+
+    assert [x * 4 for x in data[:count]] == stream.list()
+    assert data[:count] == calls
+    assert data[count:] == list(source)
+    assert stream.explain().startswith("Fused(map(")
+
+
+@given(data=lists(elements=integers(), max_size=100), count=integers(1, 10))
+def test_batch_with_concat_is_folded(data, count):
+    stream = Stream(iter(data)).map(some_func).batch(count).concat()
+
+    assert list(map(some_func, data)) == stream.list()
+    assert "Batch" not in stream.explain()
+
+
+def test_deadline_terminates_scheduled_maps():
+    release = threading.Event()
+
+    def slow(x):
+        if x == 3:
+            release.wait()
+        return x
+
+    with ThreadPoolScheduler(max_workers=2) as scheduler:
+        stream = Stream(range(10)).map(slow, scheduler=scheduler).deadline(0.05)
+        results = []
+        with pytest.raises(DeadlineExceeded):
+            for item in stream:
+                results.append(item)
+        release.set()
+
+    assert results == [0, 1, 2]
+    assert "Deadline(0.05)" in stream.explain()
+
+
+def test_deadline_bounds_serial_stream():
+    stream = Stream(itertools.count()).map(lambda x: time.sleep(0.01)).deadline(0.05)
+
+    with pytest.raises(DeadlineExceeded):
+        stream.list()
+
+
+def _sleepy(x):
+    time.sleep(0.002)
+    return x
+
+
+def _is_even(x):
+    return x % 2 == 0
+
+
+@given(data=lists(elements=integers(), max_size=100), count=integers(1, 20))
+def test_profile_counts_items_per_operator(data, count):
+    stream = Stream(data).map(some_func).filter(_is_even).batch(count).profile()
+    expected = Stream(data).map(some_func).filter(_is_even).batch(count).list()
+    kept = sum(len(batch) for batch in expected)
+
+    assert expected == stream.list()
+    source, fused, batch = stream.report().operators
+    assert (None, len(data)) == (source.items_in, source.items_out)
+    assert (len(data), kept) == (fused.items_in, fused.items_out)
+    assert (kept, len(expected)) == (batch.items_in, batch.items_out)
+
+
+def test_profile_splits_time_between_operators():
+    stream = Stream(iter(range(20))).map(_sleepy).take(10).profile()
+    stream.list()
+    source, take, fused = stream.report().operators
+
+    # take was pushed below the map, which spends its time sleeping
+    assert "Fused(map(_sleepy))" == fused.name
+    assert fused.wall >= 0.02
+    assert fused.cpu < fused.wall
+    assert fused.upstream == pytest.approx(take.wall + take.upstream)
+    assert 0 == fused.queue_wait
+
+
+def test_profile_reports_queue_wait_of_scheduled_maps():
+    scheduler = ThreadPoolScheduler(max_workers=2)
+    stream = Stream(range(20)).map(_sleepy, scheduler=scheduler).profile()
+    stream.list()
+    _, scheduled = stream.report().operators
+
+    assert 20 == scheduled.items_out
+    assert scheduled.queue_wait >= 0.01
+
+
+@given(data=lists(elements=integers(), min_size=50, max_size=200))
+def test_profile_samples_pulls(data):
+    stream = Stream(data).map(some_func).profile(sample_rate=0.1)
+
+    assert [some_func(x) for x in data] == stream.list()
+    _, fused = stream.report().operators
+    assert len(data) == fused.items_out
+    assert fused.wall > 0
+
+
+def test_profile_collapsed_stacks():
+    stream = Stream(range(10)).map(_sleepy).batch(2).profile()
+    stream.list()
+
+    lines = stream.report().collapsed().splitlines()
+    stacks = [line.rsplit(" ", 1)[0].split(";") for line in lines]
+    assert ["Batch(2)"] == stacks[0]
+    assert ["Batch(2)", "Fused(map(_sleepy))"] == stacks[1]
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_profile_leaves_plan_unchanged():
+    stream = Stream(range(10)).map(some_func).take(5).profile()
+    plan = stream.explain()
+    stream.list()
+
+    assert plan == stream.explain()
+    with pytest.raises(ValueError):
+        Stream(range(10)).profile(sample_rate=0)
+
+
+@settings(deadline=None, max_examples=20)
+@given(data=lists(elements=integers(), max_size=200), buffer_size=integers(1, 10))
+def test_tee_branches_share_one_pass(data, buffer_size):
+    pulled = []
+
+    def source():
+        for item in data:
+            pulled.append(item)
+            yield item
+
+    fast, slow = Stream(source()).tee(2, buffer_size=buffer_size)
+    lags, results = [], []
+
+    def consume_slow():
+        for item in slow:
+            time.sleep(0.0001)
+            results.append(item)
+
+    consumer = threading.Thread(target=consume_slow)
+    consumer.start()
+    for item in fast:
+        lags.append(len(pulled) - len(results))
+    consumer.join()
+
+    assert data == pulled == results
+    # the fast branch is held back by the buffer of the slow one
+    assert all(lag <= buffer_size + 1 for lag in lags)
+
+
+@given(data=lists(elements=integers(), max_size=100))
+def test_broadcast_runs_consumers_concurrently(data):
+    results = Stream(data).broadcast(
+        lambda branch: branch.list(),
+        lambda branch: branch.map(some_func).list(),
+        # stopping early doesn't hold back the other branches
+        lambda branch: branch.take(1).list(),
+        buffer_size=2,
+    )
+
+    assert [data, [some_func(x) for x in data], data[:1]] == results
+
+
+def test_broadcast_raises_errors():
+    def source():
+        yield 1
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        Stream(source()).broadcast(list, list)
+
+    def fail(branch):
+        raise KeyError()
+
+    with pytest.raises(KeyError):
+        Stream(range(100)).broadcast(list, fail, buffer_size=1)
+
+
+@given(streams=lists(lists(elements=integers(), max_size=50), min_size=1, max_size=4))
+def test_merge_yields_items_of_every_stream(streams):
+    first, *others = [
+        [(index, x) for x in items] for index, items in enumerate(streams)
+    ]
+    merged = Stream(first).merge(*others, buffer_size=4).list()
+
+    # the items of each stream keep their order
+    for index, items in enumerate(streams):
+        assert items == [x for i, x in merged if i == index]
+    assert sum(map(len, streams)) == len(merged)
+
+
+def test_merge_consumes_streams_concurrently():
+    def slow(items):
+        for item in items:
+            time.sleep(0.01)
+            yield item
+
+    started = time.monotonic()
+    merged = Stream(slow(range(10))).merge(slow(range(10, 20))).list()
+
+    assert list(range(20)) == sorted(merged)
+    assert time.monotonic() - started < 0.18
+
+
+@given(streams=lists(lists(elements=integers(), max_size=50), min_size=1, max_size=4))
+def test_zip_stops_at_shortest_stream(streams):
+    first, *others = streams
+    assert list(zip(*streams)) == Stream(first).zip(*others, buffer_size=2).list()
+
+
+def test_zip_raises_errors():
+    def source():
+        yield 1
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        Stream(source()).zip(range(10)).list()
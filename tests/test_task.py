@@ -1,3 +1,6 @@
+import asyncio
+import copy
+
 from hypothesis import given
 from hypothesis.strategies import integers, text, one_of
 
@@ -86,3 +89,91 @@ def test_task_context_kv_store(param):
 
     assert task.context[key_1] == value_1
     assert task.context[key_2] == value_2
+
+
+@given(param=one_of([text(min_size=1), integers()]),)
+def test_task_execution_for_coroutine_function(param):
+    async def func(x, context: TaskContext = None):
+        await asyncio.sleep(0)
+        assert context.state == State.RUNNING
+        return x * 2
+
+    task = Task(func)
+    result = task(param)
+
+    assert result == param * 2
+    assert task.result == param * 2
+    assert task.state == State.SUCCESS
+
+
+@given(param=one_of([text(min_size=1), integers()]),)
+def test_task_run_async_for_error_flow(param):
+    async def func(x):
+        raise Exception
+
+    task = Task(func)
+    result = asyncio.run(task.run_async(param))
+
+    assert result is None
+    assert isinstance(task.error, Exception)
+    assert task.state == State.FAILED
+
+
+@given(param=one_of([text(min_size=1), integers()]),)
+def test_task_spawn_isolates_context(param):
+    def func(x, context: TaskContext = None):
+        context["seen"] = x
+        return x * 2
+
+    template = Task(func, key="value")
+    task = template.spawn()
+
+    assert task(param) == param * 2
+    assert task.state == State.SUCCESS
+    assert task.context["seen"] == param
+    assert task.context["key"] == "value"
+
+    assert template.state == State.CREATED
+    assert template.context.get("seen") is None
+    assert template.context._handler_map is task.context._handler_map
+
+
+def test_task_returning_after_termination_stays_terminated():
+    task = Task(some_func)
+    task.context.timeout = 1
+    task.state = State.QUEUED
+
+    def terminate_midway(x):
+        task.context.terminate()
+        return x
+
+    task._func = terminate_midway
+    assert task(1) == 1
+    assert task.state == State.TERMINATED
+    assert task.result is None
+
+
+def test_task_run_async_returning_after_termination_stays_terminated():
+    async def terminate_midway(x):
+        task.context.terminate()
+        await asyncio.sleep(0)
+        return x
+
+    task = Task(terminate_midway)
+    task.context.timeout = 1
+    task.state = State.QUEUED
+
+    assert asyncio.run(task.run_async(1)) == 1
+    assert task.state == State.TERMINATED
+    assert task.result is None
+
+
+def test_task_contexts_lock_their_own_moves():
+    template = Task(some_func)
+    task = template.spawn()
+    copied = copy.deepcopy(template)
+
+    assert task.context._lock is not template.context._lock
+    assert copied.context._lock is not template.context._lock
+    assert copied(2) == 4
+    assert copied.state == State.SUCCESS
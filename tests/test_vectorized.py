@@ -0,0 +1,95 @@
+import pytest
+from hypothesis import given
+from hypothesis.strategies import integers, lists, floats
+
+from stream_processor.retries import RetryPolicy
+from stream_processor.schedulers import ThreadPoolScheduler
+from stream_processor.stream import Stream
+from stream_processor.vectorized import BatchFunction
+
+numpy = pytest.importorskip("numpy")
+
+
+@given(data=lists(elements=integers(-1000, 1000), max_size=200), size=integers(1, 50))
+def test_map_batches_with_numpy_arrays(data, size):
+    def double(batch):
+        assert isinstance(batch, numpy.ndarray)
+        assert len(batch) <= size
+        return batch * 2
+
+    result = Stream(iter(data)).map_batches(double, size).list()
+    assert [x * 2 for x in data] == result
+
+
+@given(
+    data=lists(elements=floats(-1000, 1000), max_size=200),
+    size=integers(1, 50),
+)
+def test_map_batches_with_columns(data, size):
+    rows = [{"x": x, "y": 1.0} for x in data]
+
+    def add(columns):
+        assert isinstance(columns["x"], numpy.ndarray)
+        return {"x": columns["x"], "sum": columns["x"] + columns["y"]}
+
+    result = Stream(iter(rows)).map_batches(add, size, format="columns").list()
+    assert [{"x": x, "sum": x + 1.0} for x in data] == result
+
+
+@given(data=lists(elements=integers(), max_size=200), size=integers(1, 50))
+def test_map_batches_on_scheduler(data, size):
+    scheduler = ThreadPoolScheduler(max_workers=4)
+    result = Stream(iter(data)).map_batches(
+        lambda batch: [x * 2 for x in batch], size, format="list", scheduler=scheduler
+    )
+    assert [x * 2 for x in data] == result.list()
+
+
+def test_map_batches_with_unknown_format():
+    with pytest.raises(ValueError):
+        BatchFunction(lambda batch: batch, format="pandas")
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_map_batches_on_scheduler_raises_the_batch_error(ordered):
+    def fail_on_seven(batch):
+        if 7 in batch:
+            raise KeyError(7)
+        return batch
+
+    scheduler = ThreadPoolScheduler(max_workers=4, ordered=ordered)
+    result = Stream(range(20)).map_batches(
+        fail_on_seven, 4, format="list", scheduler=scheduler
+    )
+    with pytest.raises(KeyError):
+        result.list()
+
+
+def test_map_batches_on_scheduler_retries_a_failing_batch():
+    failed = []
+
+    def fail_once(batch):
+        if 7 in batch and not failed:
+            failed.append(batch)
+            raise KeyError(7)
+        return batch
+
+    scheduler = ThreadPoolScheduler(
+        max_workers=4, retry_policy=RetryPolicy(max_attempts=2, backoff=0)
+    )
+    result = Stream(range(20)).map_batches(
+        fail_once, 4, format="list", scheduler=scheduler
+    )
+    assert list(range(20)) == result.list()
+
+
+def test_map_batches_rejects_results_of_another_length():
+    result = Stream(range(10)).map_batches(lambda batch: batch[1:], 4, format="list")
+    with pytest.raises(ValueError):
+        result.list()
+
+
+def test_map_batches_with_columns_takes_the_keys_of_all_rows():
+    rows = [{"x": 1.0}, {"x": 2.0, "y": 3.0}]
+    result = Stream(rows).map_batches(lambda columns: columns, 2, format="columns")
+    assert [{"x": 1.0, "y": None}, {"x": 2.0, "y": 3.0}] == result.list()
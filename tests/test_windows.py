@@ -0,0 +1,163 @@
+import collections
+import math
+import time
+
+from hypothesis import given, settings
+from hypothesis.strategies import integers, lists, floats, tuples
+
+from stream_processor.stream import Stream
+from stream_processor.windows import (
+    Aggregate,
+    Count,
+    Max,
+    Mean,
+    Min,
+    Quantile,
+    SessionWindows,
+    SlidingWindows,
+    Sum,
+    TumblingWindows,
+    Windower,
+)
+
+events = lists(elements=tuples(integers(0, 3), integers(0, 1000)), max_size=200)
+
+
+@given(data=events, size=integers(1, 100))
+def test_tumbling_windows(data, size):
+    data = sorted(data, key=lambda e: e[1])
+    expected = collections.defaultdict(int)
+    for key, ts in data:
+        expected[(key, ts // size * size)] += ts
+
+    results = (
+        Stream(iter(data))
+        .window(
+            TumblingWindows(size),
+            Sum(),
+            key=lambda e: e[0],
+            value=lambda e: e[1],
+            timestamp=lambda e: e[1],
+        )
+        .list()
+    )
+
+    assert expected == {(r.key, r.start): r.value for r in results}
+    assert all(r.end == r.start + size for r in results)
+    assert [r.end for r in results] == sorted(r.end for r in results)
+
+
+@given(data=events, slide=integers(1, 20), panes=integers(1, 5))
+def test_sliding_windows(data, slide, panes):
+    data = sorted(data, key=lambda e: e[1])
+    size = slide * panes
+    expected = collections.defaultdict(list)
+    for key, ts in data:
+        first = ts // slide * slide - size + slide
+        for start in range(first, ts + 1, slide):
+            expected[(key, start)].append(ts)
+
+    results = (
+        Stream(iter(data))
+        .window(
+            SlidingWindows(size, slide),
+            Aggregate(count=Count(), min=Min(), max=Max()),
+            key=lambda e: e[0],
+            value=lambda e: e[1],
+            timestamp=lambda e: e[1],
+        )
+        .list()
+    )
+
+    assert {
+        key: {"count": len(values), "min": min(values), "max": max(values)}
+        for key, values in expected.items()
+    } == {(r.key, r.start): r.value for r in results}
+
+
+@given(data=lists(elements=integers(0, 1000), max_size=200), gap=integers(1, 50))
+def test_session_windows(data, gap):
+    # shuffled timestamps are still merged into the same sessions
+    data = data[::2] + data[1::2]
+    expected = []
+    for ts in sorted(data):
+        if expected and ts <= expected[-1][-1] + gap:
+            expected[-1].append(ts)
+        else:
+            expected.append([ts])
+
+    results = (
+        Stream(iter(data))
+        .window(
+            SessionWindows(gap),
+            Count(),
+            timestamp=lambda ts: ts,
+            allowed_lateness=1000,
+        )
+        .list()
+    )
+
+    assert [(s[0], s[-1] + gap, len(s)) for s in expected] == [
+        (r.start, r.end, r.value) for r in results
+    ]
+
+
+def test_session_windows_keep_an_entry_per_session():
+    windower = Windower(SessionWindows(10), Count())
+    for ts in range(1000):
+        assert [] == windower.add(None, ts)
+
+    assert len(windower._windows._closing) == 1
+    assert [(0, 1009, 1000)] == [(r.start, r.end, r.value) for r in windower.flush()]
+
+
+def test_windower_snapshot_is_not_changed_by_later_items():
+    windower = Windower(TumblingWindows(10), Count())
+    windower.add(None, 1)
+    snapshot = windower.snapshot()
+    windower.add(None, 2)
+
+    windower.restore(snapshot)
+    assert [(0, 1)] == [(r.start, r.value) for r in windower.flush()]
+
+
+def test_late_items_are_dropped():
+    stream = Stream(iter([1, 12, 17, 3, 14, 25])).window(
+        TumblingWindows(10), Count(), timestamp=lambda ts: ts, allowed_lateness=5
+    )
+
+    assert [(0, 1), (10, 3), (20, 1)] == [(r.start, r.value) for r in stream]
+    assert 1 == stream.late
+
+
+@given(data=lists(elements=floats(-1e6, 1e6), min_size=1, max_size=500))
+def test_quantile_relative_accuracy(data):
+    quantile = Quantile(0.0, 0.5, 1.0, relative_accuracy=0.01)
+
+    result = Stream(iter(data)).aggregate(quantile)
+
+    ordered = sorted(data)
+    for q, estimate in result.items():
+        exact = ordered[math.floor(q * (len(ordered) - 1))]
+        assert math.isclose(estimate, exact, rel_tol=0.0101, abs_tol=1e-9)
+
+
+@given(data=lists(elements=integers(-1000, 1000), min_size=1, max_size=200))
+def test_aggregate(data):
+    result = Stream(iter(data)).aggregate(Aggregate(sum=Sum(), mean=Mean()))
+    assert {"sum": sum(data), "mean": sum(data) / len(data)} == result
+
+
+@settings(deadline=None, max_examples=5)
+@given(data=lists(elements=integers(), min_size=1, max_size=5))
+def test_processing_time_windows_close_while_idle(data):
+    def slow_source():
+        yield from data
+        time.sleep(0.5)
+
+    stream = Stream(slow_source()).window(TumblingWindows(0.1), Count())
+
+    start = time.monotonic()
+    first = next(iter(stream))
+    assert time.monotonic() - start < 0.4
+    assert len(data) == first.value + sum(r.value for r in stream)